@@ -0,0 +1,226 @@
+import asyncio
+import importlib.metadata
+import json
+import math
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import httpx
+from pydantic import BaseModel
+
+
+OPS = ('post', 'get', 'config_get', 'config_post')
+DEFAULT_MIX = 'post=2,get=6,config_get=1,config_post=1'
+RIG_PREFIX = 'bench-rig-'
+
+
+class OpStats(BaseModel):
+    """Latency summary of one kind of request, in milliseconds."""
+    count: int = 0
+    errors: int = 0
+    throughput: float = 0.0
+    mean_ms: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    max_ms: float = 0.0
+
+class BenchResult(BaseModel):
+    params: dict[str, Any]
+    environment: dict[str, str]
+    started: datetime
+    duration_secs: float
+    total: OpStats
+    ops: dict[str, OpStats]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parse a traffic mix like "post=2,get=6" into weights. Missing ops get no traffic."""
+    weights = {}
+    for part in mix.replace(' ', '').split(','):
+        if not part:
+            continue
+        op, _, weight = part.partition('=')
+        if op not in OPS:
+            raise ValueError(f'Unknown op {op!r} in mix, expected one of {", ".join(OPS)}.')
+        try:
+            weights[op] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f'Invalid weight {weight!r} for {op!r} in mix.') from None
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError(f'Mix {mix!r} has no traffic.')
+    return weights
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(latencies: list[float], errors: int, duration: float) -> OpStats:
+    ordered = sorted(latencies)
+    if not ordered:
+        return OpStats(errors=errors)
+    ms = 1e3
+    return OpStats(
+        count=len(ordered),
+        errors=errors,
+        throughput=len(ordered) / duration,
+        mean_ms=sum(ordered) / len(ordered) * ms,
+        p50_ms=percentile(ordered, 50) * ms,
+        p95_ms=percentile(ordered, 95) * ms,
+        p99_ms=percentile(ordered, 99) * ms,
+        max_ms=ordered[-1] * ms,
+    )
+
+
+class Rig:
+    """
+    One simulated client PC. It polls its own messages and config, and posts messages and
+    configs to the next rig, as fast as the server answers (plus think_ms between requests).
+    """
+    def __init__(self, index: int, n_rigs: int, client: httpx.AsyncClient, weights: dict[str, float],
+                 seed: int, think_ms: float = 0):
+        self.pc = f'{RIG_PREFIX}{index}'
+        self.peer = f'{RIG_PREFIX}{(index + 1) % n_rigs}'
+        self.client = client
+        self.ops = list(weights)
+        self.weights = list(weights.values())
+        self.random = random.Random(seed * 1000003 + index)
+        self.think_secs = think_ms / 1000
+        self.latencies: dict[str, list[float]] = {op: [] for op in OPS}
+        self.errors: dict[str, int] = {op: 0 for op in OPS}
+        self._n_sent = 0
+
+    def request(self, op: str):
+        self._n_sent += 1
+        if op == 'post':
+            return self.client.post(f'/msg/{self.peer}', json={"message": f"trial {self._n_sent}", "sender": self.pc})
+        if op == 'get':
+            return self.client.get(f'/msg/{self.pc}')
+        if op == 'config_get':
+            return self.client.get(f'/config/{self.pc}')
+        return self.client.post(f'/config/{self.peer}', json={"trial": self._n_sent, "sender": self.pc})
+
+    async def run(self, warmup_end: float, end: float):
+        while (now := time.perf_counter()) < end:
+            op = self.random.choices(self.ops, self.weights)[0]
+            try:
+                response = await self.request(op)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            stop = time.perf_counter()
+            if now >= warmup_end:
+                if failed:
+                    self.errors[op] += 1
+                else:
+                    self.latencies[op].append(stop - now)
+            if self.think_secs:
+                await asyncio.sleep(self.think_secs)
+
+
+async def run_bench(base_url: str, rigs: int = 10, duration: float = 10, warmup: float = 1,
+                    mix: str = DEFAULT_MIX, seed: int = 0, think_ms: float = 0,
+                    transport: httpx.AsyncBaseTransport | None = None) -> BenchResult:
+    """Drive a server with simulated rigs and summarize the latencies of each kind of request."""
+    weights = parse_mix(mix)
+    clients = [httpx.AsyncClient(base_url=base_url, transport=transport, timeout=30) for _ in range(rigs)]
+    bench_rigs = [Rig(i, rigs, client, weights, seed, think_ms) for i, client in enumerate(clients)]
+    started = datetime.now()
+    try:
+        # every rig starts with a message and a config, so reads don't just measure 404s
+        for rig in bench_rigs:
+            await rig.client.post(f'/msg/{rig.pc}', json={"message": "bench start", "sender": "bench"})
+            await rig.client.post(f'/config/{rig.pc}', json={"trial": 0})
+        warmup_end = time.perf_counter() + warmup
+        end = warmup_end + duration
+        await asyncio.gather(*(rig.run(warmup_end, end) for rig in bench_rigs))
+        for rig in bench_rigs:
+            await rig.client.delete(f'/db/{rig.pc}')
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    ops = {}
+    for op in weights:
+        latencies = [t for rig in bench_rigs for t in rig.latencies[op]]
+        ops[op] = summarize(latencies, sum(rig.errors[op] for rig in bench_rigs), duration)
+    total = summarize([t for rig in bench_rigs for op in weights for t in rig.latencies[op]],
+                      sum(stats.errors for stats in ops.values()), duration)
+    return BenchResult(
+        params={"rigs": rigs, "duration": duration, "warmup": warmup, "mix": weights, "seed": seed,
+                "think_ms": think_ms},
+        environment={"holochat": importlib.metadata.version('holochat'), "python": platform.python_version(),
+                     "platform": platform.platform(), "url": base_url},
+        started=started,
+        duration_secs=duration,
+        total=total,
+        ops=ops,
+    )
+
+
+def compare(result: BenchResult, baseline: BenchResult, tolerance: float = 0.1) -> list[str]:
+    """
+    Regressions of result against baseline: a throughput drop, or a p50/p95/p99 rise, of more
+    than tolerance (a fraction). Ops missing from either side are skipped.
+    """
+    regressions = []
+    for name, stats in [('total', result.total), *result.ops.items()]:
+        base = baseline.total if name == 'total' else baseline.ops.get(name)
+        if base is None or not base.count or not stats.count:
+            continue
+        if stats.throughput < base.throughput * (1 - tolerance):
+            regressions.append(f'{name}: throughput {stats.throughput:.1f}/s, baseline {base.throughput:.1f}/s')
+        for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+            value, base_value = getattr(stats, field), getattr(base, field)
+            if value > base_value * (1 + tolerance):
+                regressions.append(f'{name}: {field[:3]} {value:.2f} ms, baseline {base_value:.2f} ms')
+    return regressions
+
+def format_result(result: BenchResult) -> str:
+    lines = [f'{result.params["rigs"]} rigs for {result.duration_secs:g}s, mix {result.params["mix"]}',
+             f'  {"":12s} {"count":>8s} {"errors":>7s} {"req/s":>9s} {"p50 ms":>8s} {"p95 ms":>8s} '
+             f'{"p99 ms":>8s} {"max ms":>8s}']
+    for name, stats in [*result.ops.items(), ('total', result.total)]:
+        lines.append(f'  {name:12s} {stats.count:8d} {stats.errors:7d} {stats.throughput:9.1f} {stats.p50_ms:8.2f} '
+                     f'{stats.p95_ms:8.2f} {stats.p99_ms:8.2f} {stats.max_ms:8.2f}')
+    return '\n'.join(lines)
+
+def load_result(path: str | Path) -> BenchResult:
+    with open(path) as f:
+        return BenchResult.model_validate(json.load(f))
+
+def save_result(result: BenchResult, path: str | Path):
+    with open(path, 'w') as f:
+        f.write(result.model_dump_json(indent=4))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def launch_server(app_module: str, port: int, workers: int = 1, timeout: float = 30) -> subprocess.Popen:
+    """Start a local server in its own process, so it doesn't share a CPU with the rigs, and wait until it answers."""
+    proc = subprocess.Popen([sys.executable, '-m', 'uvicorn', app_module, '--host', '127.0.0.1',
+                             '--port', str(port), '--workers', str(workers), '--log-level', 'warning'])
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'Server exited with code {proc.returncode} before it was ready.')
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/msg/latest', timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f'Server did not answer within {timeout}s.')
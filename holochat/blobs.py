@@ -0,0 +1,168 @@
+import math
+import mmap
+import time
+import uuid
+import weakref
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+
+# bytes per element of the supported dtypes (numpy names, little-endian)
+DTYPE_SIZES = {
+    'bool': 1,
+    'int8': 1, 'uint8': 1,
+    'int16': 2, 'uint16': 2, 'float16': 2,
+    'int32': 4, 'uint32': 4, 'float32': 4,
+    'int64': 8, 'uint64': 8, 'float64': 8,
+}
+
+SPILL_SUFFIX = '.blob'
+
+
+class BlobError(ValueError):
+    """A blob upload that doesn't match its declared dtype and shape."""
+
+
+def parse_shape(shape: str) -> tuple[int, ...]:
+    """Parse an X-Shape header like "1000,3" (empty for a scalar)."""
+    try:
+        dims = tuple(int(dim) for dim in shape.replace(' ', '').split(',') if dim)
+    except ValueError:
+        raise BlobError(f'Invalid shape {shape!r}, expected comma-separated integers.') from None
+    if any(dim < 0 for dim in dims):
+        raise BlobError(f'Invalid shape {shape!r}, dimensions must not be negative.')
+    return dims
+
+def blob_nbytes(dtype: str, shape: tuple[int, ...]) -> int:
+    if dtype not in DTYPE_SIZES:
+        raise BlobError(f'Unknown dtype {dtype!r}, expected one of {", ".join(DTYPE_SIZES)}.')
+    return DTYPE_SIZES[dtype] * math.prod(shape)
+
+def _release(mm: mmap.mmap | None, path: Path | None):
+    if mm is not None:
+        try:
+            mm.close()
+        except BufferError:
+            # a response is still sending it; the mapping goes away once that's done
+            pass
+    if path is not None:
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            # still mapped on Windows, cleared from the spill directory on the next start
+            pass
+
+
+class Blob:
+    """
+    A typed numeric array stored as raw bytes, exactly as uploaded: either one contiguous
+    bytearray or, for large blobs, a read-only memory map of a spill file. `data` is a
+    memoryview over it, so serving a blob never copies or re-encodes it.
+    """
+    def __init__(self, dtype: str, shape: tuple[int, ...], buffer: bytearray | mmap.mmap,
+                 path: Path | None = None):
+        self.dtype = dtype
+        self.shape = shape
+        self.nbytes = len(buffer)
+        self.version = time.time_ns()
+        self.path = path
+        self._buffer = buffer
+        mm = buffer if isinstance(buffer, mmap.mmap) else None
+        self._finalizer = weakref.finalize(self, _release, mm, path)
+
+    @property
+    def data(self) -> memoryview:
+        return memoryview(self._buffer)
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    def release(self):
+        """Drop a spilled blob's memory map and file. In-memory blobs are left to the GC."""
+        self._finalizer()
+
+    def info(self) -> dict[str, Any]:
+        return {"dtype": self.dtype, "shape": list(self.shape), "nbytes": self.nbytes, "spilled": self.spilled}
+
+
+class BlobStore:
+    """The blobs of every client PC, by name. Blobs of at least spill_bytes are kept in spill_dir."""
+    def __init__(self, spill_dir: str | Path, spill_bytes: int | None):
+        self.spill_dir = Path(spill_dir)
+        self.spill_bytes = spill_bytes
+        self.blobs: defaultdict[str, dict[str, Blob]] = defaultdict(dict)
+        self._cleaned = False
+
+    def get(self, dest_pc: str, name: str) -> Blob | None:
+        return self.blobs.get(dest_pc, {}).get(name)
+
+    async def put(self, dest_pc: str, name: str, dtype: str, shape: tuple[int, ...],
+                  chunks: AsyncIterator[bytes]) -> Blob:
+        """Store a blob from an upload stream, checking it against its dtype and shape."""
+        nbytes = blob_nbytes(dtype, shape)
+        if self.spill_bytes is not None and 0 < self.spill_bytes <= nbytes:
+            blob = await self._read_spilled(dtype, shape, nbytes, chunks)
+        else:
+            blob = await self._read_memory(dtype, shape, nbytes, chunks)
+        self.delete(dest_pc, name)
+        self.blobs[dest_pc][name] = blob
+        return blob
+
+    def delete(self, dest_pc: str, name: str) -> bool:
+        blob = self.blobs.get(dest_pc, {}).pop(name, None)
+        if blob is None:
+            return False
+        blob.release()
+        if not self.blobs[dest_pc]:
+            del self.blobs[dest_pc]
+        return True
+
+    def delete_pc(self, dest_pc: str):
+        for name in list(self.blobs.get(dest_pc, ())):
+            self.delete(dest_pc, name)
+
+    def clear(self):
+        for dest_pc in list(self.blobs):
+            self.delete_pc(dest_pc)
+
+    async def _read_memory(self, dtype, shape, nbytes, chunks) -> Blob:
+        # one allocation up front, filled in place as the chunks arrive
+        buffer = bytearray(nbytes)
+        view = memoryview(buffer)
+        pos = 0
+        async for chunk in chunks:
+            if pos + len(chunk) > nbytes:
+                raise BlobError(f'Blob is larger than its dtype and shape ({nbytes} bytes).')
+            view[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+        view.release()
+        if pos != nbytes:
+            raise BlobError(f'Blob has {pos} bytes, its dtype and shape need {nbytes}.')
+        return Blob(dtype, shape, buffer)
+
+    async def _read_spilled(self, dtype, shape, nbytes, chunks) -> Blob:
+        if not self._cleaned:
+            # blobs don't outlive the server, so anything left here is from an earlier run
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            for leftover in self.spill_dir.glob(f'*{SPILL_SUFFIX}'):
+                _release(None, leftover)
+            self._cleaned = True
+        path = self.spill_dir / f'{uuid.uuid4().hex}{SPILL_SUFFIX}'
+        pos = 0
+        try:
+            with open(path, 'wb') as f:
+                async for chunk in chunks:
+                    pos += len(chunk)
+                    if pos > nbytes:
+                        raise BlobError(f'Blob is larger than its dtype and shape ({nbytes} bytes).')
+                    f.write(chunk)
+            if pos != nbytes:
+                raise BlobError(f'Blob has {pos} bytes, its dtype and shape need {nbytes}.')
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            _release(None, path)
+            raise
+        return Blob(dtype, shape, mm, path)
@@ -0,0 +1,72 @@
+import asyncio
+import itertools
+import json
+from collections import deque
+from typing import Any, Callable
+
+
+def format_sse(seq: int, event: str, data: str) -> str:
+    """Format a single Server-Sent Events frame."""
+    return f"id: {seq}\nevent: {event}\ndata: {data}\n\n"
+
+
+class ChangeFeed:
+    """
+    Incremental change records with monotonically increasing sequence ids. The most recent
+    records are kept (already formatted as SSE frames) so that clients can resume from a
+    Last-Event-ID.
+    """
+    def __init__(self, backlog: int = 1000):
+        self.seq = 0
+        self.backlog: deque[tuple[int, str]] = deque(maxlen=backlog)
+        self.waiters: set[asyncio.Future] = set()
+        # called with (seq, json record) for every change, e.g. to write it to disk
+        self.listeners: list[Callable[[int, str], None]] = []
+        # called with (event, target, data) for every change, before it is serialized
+        self.observers: list[Callable[[str, str, Any], None]] = []
+
+    def publish(self, event: str, target: str, data: Any = None) -> int:
+        """Record a change and wake up every listener. Returns the sequence id of the change."""
+        self.seq += 1
+        for observer in self.observers:
+            observer(event, target, data)
+        record = json.dumps({"seq": self.seq, "event": event, "target": target, "data": data})
+        self.backlog.append((self.seq, format_sse(self.seq, event, record)))
+        for listener in self.listeners:
+            listener(self.seq, record)
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.waiters.clear()
+        return self.seq
+
+    def can_resume(self, last_seq: int) -> bool:
+        """Check that every change after last_seq is still in the backlog."""
+        if last_seq > self.seq:
+            # the client saw ids from a previous server run
+            return False
+        if not self.backlog:
+            return last_seq >= self.seq
+        return self.backlog[0][0] <= last_seq + 1
+
+    def since(self, last_seq: int) -> list[tuple[int, str]]:
+        """Return the (seq, frame) pairs newer than last_seq that are still in the backlog."""
+        if not self.backlog or last_seq >= self.seq:
+            return []
+        # sequence ids are contiguous, so the start index can be computed directly
+        start = max(last_seq + 1 - self.backlog[0][0], 0)
+        return list(itertools.islice(self.backlog, start, None))
+
+    async def wait(self, last_seq: int, timeout: float) -> bool:
+        """Wait for a change newer than last_seq. Returns False if the wait timed out."""
+        if self.seq > last_seq:
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except TimeoutError:
+            return False
+        finally:
+            self.waiters.discard(waiter)
+        return True
@@ -1,40 +1,47 @@
-import argparse
-import importlib.metadata
-import socket
+import time
 
-import httpx
-import uvicorn
-from colorama import just_fix_windows_console
-
-from holochat.settings import load_settings, save_settings
+CLI_START = time.perf_counter()
 
+import argparse
+import os
+import socket
+import sys
+import threading
 
-just_fix_windows_console()
 
-settings = load_settings()
+# settings (pydantic), uvicorn, httpx, colorama and the app itself are imported where they're
+# used, so each command only pays for what it needs
 
-PORT = settings.server.port
-HOST_IP = settings.server.ip
-WORKERS = settings.server.workers
 APP_MODULE = 'holochat.main:app'
 
-HC_VERSION = importlib.metadata.version('holochat')
+
+def hc_version() -> str:
+    import importlib.metadata
+    return importlib.metadata.version('holochat')
 
 
 def run_holochat():
     """The function that runs everything."""
+    if os.name == 'nt':
+        # only the Windows console needs the ANSI codes translated
+        from colorama import just_fix_windows_console
+        just_fix_windows_console()
     parser = setup_parser()
     args = parser.parse_args()
-            
+
     if args.command == 'setup':
-        print('holochat v', HC_VERSION, sep='')
+        print('holochat v', hc_version(), sep='')
         print('Run setup...')
+        from holochat.settings import save_settings
         save_settings(args.home, args.ow)
         print('done.')
-        
+
     elif args.command == 'run':
         start_server(args)
-        
+
+    elif args.command == 'bench':
+        run_bench(args)
+
     else:
         print('WARNING! No command given. I guess we will just run it anyway?')
         start_server(args)
@@ -43,39 +50,152 @@ def run_holochat():
 def setup_parser():
     parser = argparse.ArgumentParser(description='holochat: a RESTful api for running experiments.')
     subparses = parser.add_subparsers(dest='command')
-    
+
     # setup command
     setup_parser = subparses.add_parser('setup', help='generate settings files')
     setup_parser.add_argument('--home', action='store_true', help="Also save to user's home directory.")
     setup_parser.add_argument('--ow', action='store_true', help="Overwrite existing file(s).")
-    
+
     # run command
     run_parser = subparses.add_parser('run', help='run holochat server')
-    run_parser.add_argument('--debug', action='store_true', 
+    run_parser.add_argument('--debug', action='store_true',
                         help='this will run on localhost despite the config file. also enables reload on uvicorn.')
-    
+    run_parser.add_argument('--public-ip', action='store_true',
+                            help='Look up the public IP address of this computer (needs internet access).')
+    run_parser.add_argument('--timings', action='store_true', help='Report how long each step of startup took.')
+
+    # bench command
+    bench_parser = subparses.add_parser('bench', help='load test a holochat server with simulated rigs')
+    bench_parser.add_argument('--rigs', type=int, default=10, help='Number of simulated client PCs.')
+    bench_parser.add_argument('--duration', type=float, default=10, help='Seconds to measure for.')
+    bench_parser.add_argument('--warmup', type=float, default=1, help='Seconds of traffic before measuring.')
+    bench_parser.add_argument('--mix',
+                              help='Weights of each kind of request (default: post=2,get=6,config_get=1,config_post=1).')
+    bench_parser.add_argument('--seed', type=int, default=0, help='Random seed for the request sequence.')
+    bench_parser.add_argument('--think-ms', type=float, default=0, help='Pause of each rig between requests.')
+    bench_parser.add_argument('--url', help='Benchmark this running server instead of launching one locally.')
+    bench_parser.add_argument('--workers', type=int, default=1, help='Workers of the local server.')
+    bench_parser.add_argument('--out', help='Save the results to this JSON file.')
+    bench_parser.add_argument('--baseline', help='Compare against the results in this JSON file.')
+    bench_parser.add_argument('--tolerance', type=float, default=0.1,
+                              help='Allowed slowdown against the baseline, as a fraction (default: 0.1).')
+
     return parser
-   
+
+
+class StartupTimer:
+    """Time spent in each step of startup, for `holochat run --timings`."""
+    def __init__(self, start: float):
+        self.start = start
+        self.last = start
+        self.steps: list[tuple[str, float]] = []
+
+    def mark(self, step: str):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        lines = ['Startup timings (ms):']
+        lines += [f'  {step:24s} {secs * 1e3:8.1f}' for step, secs in self.steps]
+        lines.append(f'  {"total":24s} {(self.last - self.start) * 1e3:8.1f}')
+        return '\n'.join(lines)
+
 def start_server(args: argparse.Namespace):
-    print_server_startup()
-#    if 'debug' not in args:
-    uvicorn.run(APP_MODULE, host=HOST_IP, port=PORT, workers=WORKERS)
-#    else:
-#        print('Running in debug mode.')
-#        uvicorn.run(APP_MODULE, host="localhost", port=PORT, reload=True)
+    timer = StartupTimer(CLI_START)
+    timer.mark('cli import')
+    from holochat.settings import get_settings
+    settings = get_settings()
+    timer.mark('settings')
+    print_server_startup(settings.server.port)
+    if settings.trigger.enabled:
+        # the listeners themselves run in the app's event loop, started with it
+        print(f'Trigger listeners on tcp port {settings.trigger.tcp_port}, udp port {settings.trigger.udp_port}')
+    # IP lookups can hang on a network without DNS or internet, so they never hold up the server
+    threading.Thread(target=get_other_ips, daemon=True).start()
+    if getattr(args, 'public_ip', False):
+        threading.Thread(target=get_public_ip, daemon=True).start()
+    timer.mark('banner')
+
+    import uvicorn
+    timer.mark('uvicorn import')
+    workers = settings.server.workers
+    if workers > 1:
+        if settings.store.backend == 'memory':
+            print('WARNING: Running', workers, 'workers with the memory store. Each worker will have its own '
+                  'database! Set "store": {"backend": "sqlite"} in the settings file to share one.')
+        if getattr(args, 'timings', False):
+            print(timer.report())
+            print('(the app is imported and started in each worker, which is not timed)')
+        uvicorn.run(APP_MODULE, host=settings.server.ip, port=settings.server.port, workers=workers)
+        return
+
+    from holochat.main import app
+    timer.mark('app import')
+    server = uvicorn.Server(uvicorn.Config(app, host=settings.server.ip, port=settings.server.port))
+    if getattr(args, 'timings', False):
+        threading.Thread(target=report_when_started, args=(server, timer), daemon=True).start()
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass  # as uvicorn.run does: Ctrl+C is a normal way to stop the server
+
+def report_when_started(server, timer: StartupTimer):
+    while not server.started:
+        if server.should_exit:
+            return
+        time.sleep(0.001)
+    timer.mark('server startup')
+    print(timer.report())
+
+def run_bench(args: argparse.Namespace):
+    """Benchmark a server and exit with code 1 if it regressed against the baseline."""
+    import asyncio
+    from holochat import bench
+    print('holochat v', hc_version(), ' benchmark', sep='')
+    server = None
+    url = args.url
+    if url is None:
+        port = bench.free_port()
+        url = f'http://127.0.0.1:{port}'
+        print(f'Starting a local server at {url}...')
+        server = bench.launch_server(APP_MODULE, port, args.workers)
+    try:
+        result = asyncio.run(bench.run_bench(url, rigs=args.rigs, duration=args.duration, warmup=args.warmup,
+                                             mix=args.mix or bench.DEFAULT_MIX, seed=args.seed,
+                                             think_ms=args.think_ms))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    result.params["workers"] = args.workers if args.url is None else None
+    print(bench.format_result(result))
+    if args.out:
+        bench.save_result(result, args.out)
+        print('Results saved to', args.out)
+    if args.baseline:
+        regressions = bench.compare(result, bench.load_result(args.baseline), args.tolerance)
+        if regressions:
+            print(f'REGRESSION against {args.baseline}:')
+            for regression in regressions:
+                print('  ->', regression)
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}.')
 
 def get_public_ip():
-    print(f'The public IP address of this computer is:')
+    import httpx
     try:
         public_ip = httpx.get('https://api.ipify.org', timeout=3).text
+        print('The public IP address of this computer is:')
         print('  ->', bold_str(public_ip))
     except httpx.HTTPError as e:
-        print('  ->', e)
-        print('WARNING: Could not get public IP address??')
+        print('WARNING: Could not get public IP address:', e)
 
 def get_other_ips():
-    hostname = socket.gethostname()
-    ip_list = socket.gethostbyname_ex(hostname)[-1]
+    try:
+        ip_list = socket.gethostbyname_ex(socket.gethostname())[-1]
+    except OSError:
+        return
     localhost = '127.0.0.1'
     if localhost in ip_list:
         ip_list.remove(localhost)
@@ -83,16 +203,14 @@ def get_other_ips():
         print('*** note: You have multiple IPs available:')
         for ip in ip_list:
             print('  ->',bold_str(ip))
-            
+
 def bold_str(string: str):
     return f'\033[1m{string}\033[0m'
 
-def print_server_startup():
+def print_server_startup(port: int):
     print('\n( h o l o c h a t )')
-    print('v', HC_VERSION, sep='', end='\n\n')
+    print('v', hc_version(), sep='', end='\n\n')
     print("~ at least it's not msockets ~", end='\n\n\n')
     print('Starting server...')
-    local_ip_addr = bold_str(f'localhost:{PORT}')
+    local_ip_addr = bold_str(f'localhost:{port}')
     print(f'holochat will run locally at {local_ip_addr}')
-    get_public_ip()
-    get_other_ips()
\ No newline at end of file
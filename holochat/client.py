@@ -0,0 +1,448 @@
+import asyncio
+import random
+import socket
+import time
+from typing import Any, Callable
+
+import httpx
+from pydantic import BaseModel
+
+from .models import BatchMessage, MessageHold, MessageRequest, MessageStore, settings
+
+
+Message = MessageHold | MessageRequest
+
+# statuses worth retrying: the server (or a proxy in front of it) is briefly unavailable
+RETRY_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+def parse_message(data: dict[str, Any]) -> Message:
+    """A message as the server sends it: a MessageHold until its first read, a MessageRequest after."""
+    if "request_time" in data:
+        return MessageRequest.model_validate(data)
+    return MessageHold.model_validate(data)
+
+def _parse_messages(response: httpx.Response) -> dict[str, list[Message]]:
+    return {pc: [parse_message(m) for m in msgs] for pc, msgs in response.json().items()}
+
+def _parse_latest(response: httpx.Response) -> dict[str, Message]:
+    return {pc: parse_message(m) for pc, m in response.json().items()}
+
+def _parse_store(response: httpx.Response) -> MessageStore:
+    return MessageStore.model_validate(response.json())
+
+def _parse_db(response: httpx.Response) -> dict[str, MessageStore]:
+    return {pc: MessageStore.model_validate(store) for pc, store in response.json().items()}
+
+class ConfigUpdate(BaseModel):
+    """
+    The answer to a config revalidation: unchanged, a merge patch from the version the client
+    has, or the whole config when the server can't send a patch.
+    """
+    changed: bool
+    config_version: int
+    etag: str | None = None
+    patch: dict[str, Any] | None = None
+    config: dict[str, Any] | None = None
+
+def _parse_config_update(response: httpx.Response) -> ConfigUpdate:
+    version = int(response.headers["X-Config-Version"])
+    etag = response.headers.get("ETag")
+    if response.status_code == 304:
+        return ConfigUpdate(changed=False, config_version=version, etag=etag)
+    data = response.json()
+    return ConfigUpdate(changed=True, config_version=data["config_version"], etag=etag,
+                        patch=data.get("patch"), config=data.get("config"))
+
+def _parse_json(response: httpx.Response) -> Any:
+    return response.json()
+
+def _parse_none(response: httpx.Response) -> None:
+    return None
+
+
+class _Call:
+    """One API call: the request to send, and how to read the response."""
+    __slots__ = ('method', 'url', 'params', 'json', 'headers', 'parse', 'missing', 'timeout', 'idempotent')
+
+    def __init__(self, method: str, url: str, parse: Callable[[httpx.Response], Any] = _parse_json, *,
+                 params: dict[str, Any] | None = None, json: Any = None, headers: dict[str, str] | None = None,
+                 missing: set[int] = frozenset(), timeout: float | None = None, idempotent: bool | None = None):
+        self.method = method
+        self.url = url
+        self.parse = parse
+        self.params = {k: v for k, v in params.items() if v is not None} if params else None
+        self.json = json
+        self.headers = headers
+        # statuses that mean "nothing there" and come back as None rather than an error
+        self.missing = missing
+        self.timeout = timeout
+        # whether a call the server may already have handled can be sent again
+        self.idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+
+    def result(self, response: httpx.Response) -> Any:
+        if response.status_code in self.missing:
+            return None
+        if response.status_code != 304:
+            # only conditional calls send If-None-Match, and they parse 304 themselves
+            response.raise_for_status()
+        return self.parse(response)
+
+
+class _BaseClient:
+    """The API calls and retry policy shared by Client and AsyncClient."""
+    def __init__(self, base_url: str | None = None, timeout: float | httpx.Timeout = 5.0,
+                 retries: int = 3, backoff: float = 0.05, max_backoff: float = 2.0,
+                 max_connections: int = 10):
+        self.base_url = base_url or f'http://localhost:{settings.server.port}'
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+    def _should_retry(self, call: _Call, attempt: int, error: Exception | None = None,
+                      response: httpx.Response | None = None) -> bool:
+        if attempt >= self.retries:
+            return False
+        if error is not None:
+            # a failed connect never reached the server, so even a POST can be sent again
+            return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)) or (
+                call.idempotent and isinstance(error, httpx.TransportError))
+        return response.status_code in RETRY_STATUSES and call.idempotent
+
+    def _delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter, so rigs that lost the server don't retry in lockstep."""
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        return delay * (0.5 + random.random() / 2)
+
+    def _timeout(self, call: _Call) -> float | httpx.Timeout | None:
+        if call.timeout is None:
+            return self.timeout
+        # a long poll may hold the response for up to `wait` seconds
+        timeout = httpx.Timeout(self.timeout)
+        return httpx.Timeout(connect=timeout.connect, read=(timeout.read or 0) + call.timeout,
+                             write=timeout.write, pool=timeout.pool)
+
+    # --- messages --- #
+
+    def _post_message(self, dest_pc: str, message: str, sender: str | None = None) -> _Call:
+        body = {"message": message} if sender is None else {"message": message, "sender": sender}
+        return _Call("POST", f"/msg/{dest_pc}", _parse_none, json=body)
+
+    def _post_batch(self, batch: list[BatchMessage | dict[str, str]]) -> _Call:
+        body = [item.model_dump() if isinstance(item, BatchMessage) else item for item in batch]
+        return _Call("POST", "/msg/batch", lambda r: r.json()["results"], json=body)
+
+    def _get_message(self, dest_pc: str, wait: float | None = None, after: int | None = None) -> _Call:
+        # a GET of a message counts as a read, so a lost response isn't asked for again
+        return _Call("GET", f"/msg/{dest_pc}", lambda r: parse_message(r.json()),
+                     params={"wait": wait, "after": after}, missing={204, 404}, timeout=wait, idempotent=False)
+
+    def _latest_messages(self) -> _Call:
+        return _Call("GET", "/msg/latest", _parse_latest)
+
+    def _all_messages(self, limit: int | None = None, sender: str | None = None) -> _Call:
+        return _Call("GET", "/msg/all", _parse_messages, params={"limit": limit, "sender": sender})
+
+    def _message_history(self, dest_pc: str, offset: int = 0, limit: int = 50) -> _Call:
+        return _Call("GET", f"/msg/{dest_pc}/history", lambda r: [parse_message(m) for m in r.json()["messages"]],
+                     params={"offset": offset, "limit": limit}, missing={404})
+
+    def _delete_messages(self, dest_pc: str | None = None) -> _Call:
+        return _Call("DELETE", "/msg" if dest_pc is None else f"/msg/{dest_pc}", _parse_none, missing={404})
+
+    # --- config --- #
+
+    def _set_config(self, dest_pc: str, config: dict[str, Any]) -> _Call:
+        return _Call("POST", f"/config/{dest_pc}", _parse_none, json=config)
+
+    def _patch_config(self, dest_pc: str, patch: dict[str, Any]) -> _Call:
+        return _Call("PATCH", f"/config/{dest_pc}", lambda r: r.json()["config_version"], json=patch)
+
+    def _get_config(self, dest_pc: str) -> _Call:
+        return _Call("GET", f"/config/{dest_pc}", missing={404})
+
+    def _config_update(self, dest_pc: str, since_version: int = 0, etag: str | None = None) -> _Call:
+        headers = {"If-None-Match": etag} if etag is not None else None
+        return _Call("GET", f"/config/{dest_pc}", _parse_config_update, params={"since_version": since_version},
+                     headers=headers, missing={404})
+
+    def _all_configs(self) -> _Call:
+        return _Call("GET", "/config")
+
+    def _delete_config(self, dest_pc: str | None = None) -> _Call:
+        return _Call("DELETE", "/config" if dest_pc is None else f"/config/{dest_pc}", _parse_none, missing={404})
+
+    # --- queue --- #
+
+    def _enable_queue(self, dest_pc: str, ack_timeout: float | None = None) -> _Call:
+        return _Call("POST", f"/queue/{dest_pc}", _parse_none, params={"ack_timeout": ack_timeout})
+
+    def _queue_pop(self, dest_pc: str, consumer: str, max_count: int = 1, wait: float | None = None) -> _Call:
+        return _Call("POST", f"/queue/{dest_pc}/pop", lambda r: r.json()["messages"],
+                     params={"consumer": consumer, "max": max_count, "wait": wait}, timeout=wait)
+
+    def _queue_ack(self, dest_pc: str, consumer: str, seqs: list[int]) -> _Call:
+        return _Call("POST", f"/queue/{dest_pc}/ack", lambda r: r.json()["acked"],
+                     json={"consumer": consumer, "seqs": seqs})
+
+    # --- database --- #
+
+    def _get_db(self) -> _Call:
+        return _Call("GET", "/db", _parse_db)
+
+    def _get_store(self, dest_pc: str) -> _Call:
+        return _Call("GET", f"/db/{dest_pc}", _parse_store, missing={404})
+
+    def _delete_db(self, dest_pc: str | None = None) -> _Call:
+        return _Call("DELETE", "/db" if dest_pc is None else f"/db/{dest_pc}", _parse_none, missing={404})
+
+
+class Client(_BaseClient):
+    """
+    Blocking holochat client. Create one per rig and keep it: every request goes over the same
+    pool of keep-alive connections, so a trigger doesn't pay for a new TCP handshake.
+    """
+    def __init__(self, base_url: str | None = None, *, transport: httpx.BaseTransport | None = None, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.http = httpx.Client(base_url=self.base_url, timeout=self.timeout, limits=self.limits,
+                                 transport=transport)
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def call(self, call: _Call) -> Any:
+        attempt = 0
+        while True:
+            try:
+                response = self.http.request(call.method, call.url, params=call.params, json=call.json,
+                                             headers=call.headers, timeout=self._timeout(call))
+            except httpx.TransportError as e:
+                if not self._should_retry(call, attempt, error=e):
+                    raise
+            else:
+                if not self._should_retry(call, attempt, response=response):
+                    return call.result(response)
+            time.sleep(self._delay(attempt))
+            attempt += 1
+
+    def post_message(self, dest_pc: str, message: str, sender: str | None = None) -> None:
+        return self.call(self._post_message(dest_pc, message, sender))
+
+    def post_batch(self, batch: list[BatchMessage | dict[str, str]]) -> list[dict[str, Any]]:
+        return self.call(self._post_batch(batch))
+
+    def get_message(self, dest_pc: str, wait: float | None = None, after: int | None = None) -> Message | None:
+        """
+        The current message of a PC, or None. With `wait`, long-poll for one other than `after`.
+        Reads are counted, so this is only retried when the connection failed.
+        """
+        return self.call(self._get_message(dest_pc, wait, after))
+
+    def latest_messages(self) -> dict[str, Message]:
+        return self.call(self._latest_messages())
+
+    def all_messages(self, limit: int | None = None, sender: str | None = None) -> dict[str, list[Message]]:
+        return self.call(self._all_messages(limit, sender))
+
+    def message_history(self, dest_pc: str, offset: int = 0, limit: int = 50) -> list[Message] | None:
+        return self.call(self._message_history(dest_pc, offset, limit))
+
+    def delete_messages(self, dest_pc: str | None = None) -> None:
+        return self.call(self._delete_messages(dest_pc))
+
+    def set_config(self, dest_pc: str, config: dict[str, Any]) -> None:
+        return self.call(self._set_config(dest_pc, config))
+
+    def patch_config(self, dest_pc: str, patch: dict[str, Any]) -> int:
+        """Merge patch a PC's config and return the new config version."""
+        return self.call(self._patch_config(dest_pc, patch))
+
+    def get_config(self, dest_pc: str) -> dict[str, Any] | None:
+        return self.call(self._get_config(dest_pc))
+
+    def config_update(self, dest_pc: str, since_version: int = 0, etag: str | None = None) -> ConfigUpdate | None:
+        """Check a config for changes since a version (and ETag) the client already has. None if it's gone."""
+        return self.call(self._config_update(dest_pc, since_version, etag))
+
+    def all_configs(self) -> dict[str, dict[str, Any]]:
+        return self.call(self._all_configs())
+
+    def delete_config(self, dest_pc: str | None = None) -> None:
+        return self.call(self._delete_config(dest_pc))
+
+    def enable_queue(self, dest_pc: str, ack_timeout: float | None = None) -> None:
+        return self.call(self._enable_queue(dest_pc, ack_timeout))
+
+    def queue_pop(self, dest_pc: str, consumer: str, max_count: int = 1,
+                  wait: float | None = None) -> list[dict[str, Any]]:
+        """The next queued messages for a consumer, oldest first. Ack each one by its "seq"."""
+        return self.call(self._queue_pop(dest_pc, consumer, max_count, wait))
+
+    def queue_ack(self, dest_pc: str, consumer: str, seqs: list[int]) -> int:
+        return self.call(self._queue_ack(dest_pc, consumer, seqs))
+
+    def get_db(self) -> dict[str, MessageStore]:
+        return self.call(self._get_db())
+
+    def get_store(self, dest_pc: str) -> MessageStore | None:
+        return self.call(self._get_store(dest_pc))
+
+    def delete_db(self, dest_pc: str | None = None) -> None:
+        return self.call(self._delete_db(dest_pc))
+
+
+class AsyncClient(_BaseClient):
+    """asyncio holochat client, with the same methods as Client."""
+    def __init__(self, base_url: str | None = None, *, transport: httpx.AsyncBaseTransport | None = None, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.http = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits,
+                                      transport=transport)
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def __aenter__(self) -> 'AsyncClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def call(self, call: _Call) -> Any:
+        attempt = 0
+        while True:
+            try:
+                response = await self.http.request(call.method, call.url, params=call.params, json=call.json,
+                                                   headers=call.headers, timeout=self._timeout(call))
+            except httpx.TransportError as e:
+                if not self._should_retry(call, attempt, error=e):
+                    raise
+            else:
+                if not self._should_retry(call, attempt, response=response):
+                    return call.result(response)
+            await asyncio.sleep(self._delay(attempt))
+            attempt += 1
+
+    async def post_message(self, dest_pc: str, message: str, sender: str | None = None) -> None:
+        return await self.call(self._post_message(dest_pc, message, sender))
+
+    async def post_batch(self, batch: list[BatchMessage | dict[str, str]]) -> list[dict[str, Any]]:
+        return await self.call(self._post_batch(batch))
+
+    async def get_message(self, dest_pc: str, wait: float | None = None, after: int | None = None) -> Message | None:
+        """
+        The current message of a PC, or None. With `wait`, long-poll for one other than `after`.
+        Reads are counted, so this is only retried when the connection failed.
+        """
+        return await self.call(self._get_message(dest_pc, wait, after))
+
+    async def latest_messages(self) -> dict[str, Message]:
+        return await self.call(self._latest_messages())
+
+    async def all_messages(self, limit: int | None = None, sender: str | None = None) -> dict[str, list[Message]]:
+        return await self.call(self._all_messages(limit, sender))
+
+    async def message_history(self, dest_pc: str, offset: int = 0, limit: int = 50) -> list[Message] | None:
+        return await self.call(self._message_history(dest_pc, offset, limit))
+
+    async def delete_messages(self, dest_pc: str | None = None) -> None:
+        return await self.call(self._delete_messages(dest_pc))
+
+    async def set_config(self, dest_pc: str, config: dict[str, Any]) -> None:
+        return await self.call(self._set_config(dest_pc, config))
+
+    async def patch_config(self, dest_pc: str, patch: dict[str, Any]) -> int:
+        """Merge patch a PC's config and return the new config version."""
+        return await self.call(self._patch_config(dest_pc, patch))
+
+    async def get_config(self, dest_pc: str) -> dict[str, Any] | None:
+        return await self.call(self._get_config(dest_pc))
+
+    async def config_update(self, dest_pc: str, since_version: int = 0, etag: str | None = None) -> ConfigUpdate | None:
+        """Check a config for changes since a version (and ETag) the client already has. None if it's gone."""
+        return await self.call(self._config_update(dest_pc, since_version, etag))
+
+    async def all_configs(self) -> dict[str, dict[str, Any]]:
+        return await self.call(self._all_configs())
+
+    async def delete_config(self, dest_pc: str | None = None) -> None:
+        return await self.call(self._delete_config(dest_pc))
+
+    async def enable_queue(self, dest_pc: str, ack_timeout: float | None = None) -> None:
+        return await self.call(self._enable_queue(dest_pc, ack_timeout))
+
+    async def queue_pop(self, dest_pc: str, consumer: str, max_count: int = 1,
+                        wait: float | None = None) -> list[dict[str, Any]]:
+        """The next queued messages for a consumer, oldest first. Ack each one by its "seq"."""
+        return await self.call(self._queue_pop(dest_pc, consumer, max_count, wait))
+
+    async def queue_ack(self, dest_pc: str, consumer: str, seqs: list[int]) -> int:
+        return await self.call(self._queue_ack(dest_pc, consumer, seqs))
+
+    async def get_db(self) -> dict[str, MessageStore]:
+        return await self.call(self._get_db())
+
+    async def get_store(self, dest_pc: str) -> MessageStore | None:
+        return await self.call(self._get_store(dest_pc))
+
+    async def delete_db(self, dest_pc: str | None = None) -> None:
+        return await self.call(self._delete_db(dest_pc))
+
+
+class TriggerClient:
+    """
+    Blocking client for the raw TCP trigger listener (holochat.trigger), for triggers that can't
+    afford an HTTP request. Keeps one connection open; messages must be a single line.
+    """
+    def __init__(self, host: str = 'localhost', port: int | None = None, sender: str | None = None,
+                 timeout: float = 5.0):
+        self.sock = socket.create_connection((host, port or settings.trigger.tcp_port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self.sock.makefile('rb')
+        if sender is not None:
+            self.command(f'SENDER {sender}')
+
+    def command(self, line: str) -> str:
+        self.sock.sendall(line.encode() + b'\n')
+        reply = self._reader.readline()
+        if not reply:
+            raise ConnectionError('The trigger listener closed the connection.')
+        reply = reply.decode().rstrip('\n')
+        if reply.startswith('ERR '):
+            raise ValueError(reply[4:])
+        return reply
+
+    def ping(self):
+        self.command('PING')
+
+    def post_message(self, dest_pc: str, message: str) -> int:
+        """Post a message and return its msg_id."""
+        if '\n' in message or '\r' in message:
+            raise ValueError('Trigger messages must be a single line.')
+        return int(self.command(f'POST {dest_pc} {message}').removeprefix('OK '))
+
+    def get_message(self, dest_pc: str) -> tuple[int, int, str] | None:
+        """Read the current message of a PC as (msg_id, read_count, message), or None."""
+        reply = self.command(f'GET {dest_pc}')
+        if reply == 'NONE':
+            return None
+        _, msg_id, read_count, message = reply.split(' ', 3)
+        return int(msg_id), int(read_count), message
+
+    def close(self):
+        self._reader.close()
+        self.sock.close()
+
+    def __enter__(self) -> 'TriggerClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
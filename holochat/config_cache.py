@@ -0,0 +1,236 @@
+import asyncio
+import copy
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable
+
+import httpx
+
+from .client import AsyncClient, Client, ConfigUpdate
+from .patch import apply_merge_patch
+
+
+class CachedConfig:
+    """A config as last seen on the server. Replaced, never mutated, so readers need no lock."""
+    __slots__ = ('config', 'config_version', 'etag', 'checked')
+
+    def __init__(self, config: dict[str, Any], config_version: int = 0, etag: str | None = None,
+                 checked: float = 0.0):
+        self.config = config
+        self.config_version = config_version
+        self.etag = etag
+        # time.monotonic() of the last successful check, 0 if never checked in this process
+        self.checked = checked
+
+    def changed_by(self, update: ConfigUpdate) -> bool:
+        """Whether an update brings a different config, rather than confirming this one."""
+        return update.changed and update.patch != {} and update.config_version != self.config_version
+
+    def updated(self, update: ConfigUpdate) -> 'CachedConfig':
+        now = time.monotonic()
+        if not self.changed_by(update):
+            return CachedConfig(self.config, update.config_version, update.etag, now)
+        if update.patch is not None:
+            config = apply_merge_patch(copy.deepcopy(self.config), update.patch)
+        else:
+            config = update.config
+        return CachedConfig(config, update.config_version, update.etag, now)
+
+
+class _ConfigCacheBase:
+    """The entries and disk file shared by ConfigCache and AsyncConfigCache."""
+    def __init__(self, pcs: Iterable[str] = (), interval: float = 1.0, path: str | Path | None = None):
+        self.interval = interval
+        self.path = Path(path) if path is not None else None
+        self.entries: dict[str, CachedConfig | None] = {pc: None for pc in pcs}
+        self.last_error: Exception | None = None
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def cached(self, dest_pc: str) -> dict[str, Any] | None:
+        """The cached config of a PC, without touching the network."""
+        entry = self.entries.get(dest_pc)
+        return entry.config if entry is not None else None
+
+    def age(self, dest_pc: str) -> float:
+        """Seconds since the cached config was last confirmed by the server (inf if never)."""
+        entry = self.entries.get(dest_pc)
+        if entry is None or not entry.checked:
+            return float('inf')
+        return time.monotonic() - entry.checked
+
+    def _is_fresh(self, dest_pc: str, max_staleness: float | None) -> bool:
+        if dest_pc not in self.entries or self.entries[dest_pc] is None:
+            return False
+        return max_staleness is None or self.age(dest_pc) <= max_staleness
+
+    def _since(self, dest_pc: str, force: bool = False) -> tuple[int, str | None]:
+        entry = self.entries.get(dest_pc)
+        if entry is None or force:
+            return 0, None
+        return entry.config_version, entry.etag
+
+    def _store(self, dest_pc: str, update: ConfigUpdate | None, force: bool = False):
+        entry = self.entries.get(dest_pc)
+        if update is None:
+            # no config (anymore): keep watching, so a new one shows up
+            self.entries[dest_pc] = CachedConfig({}, checked=time.monotonic())
+            changed = entry is None or bool(entry.config) or entry.config_version != 0
+        elif entry is None or force:
+            self.entries[dest_pc] = CachedConfig({}).updated(update)
+            changed = True
+        else:
+            self.entries[dest_pc] = entry.updated(update)
+            changed = entry.changed_by(update)
+        if self.path is not None and changed:
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for pc, entry in saved.items():
+            # served until the first check confirms it, which is what makes a restart fast
+            self.entries[pc] = CachedConfig(entry["config"], entry["config_version"], entry.get("etag"))
+
+    def _save(self):
+        saved = {pc: {"config": e.config, "config_version": e.config_version, "etag": e.etag}
+                 for pc, e in list(self.entries.items()) if e is not None}
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.path)
+
+
+class ConfigCache(_ConfigCacheBase):
+    """
+    Local copies of PC configs, kept up to date by a background thread. Reads are dictionary
+    lookups; every `interval` seconds the thread asks the server for changes with a conditional
+    request, which costs a 304 (or a small merge patch) when nothing much changed.
+
+        cache = ConfigCache(client, ["rig1"], interval=1, path="rig1_config.json").start()
+        config = cache.get("rig1")
+    """
+    def __init__(self, client: Client, pcs: Iterable[str] = (), interval: float = 1.0,
+                 path: str | Path | None = None):
+        super().__init__(pcs, interval, path)
+        self.client = client
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def get(self, dest_pc: str, max_staleness: float | None = None) -> dict[str, Any]:
+        """
+        The config of a PC ({} if it has none). The first read of a PC fetches it, and with
+        max_staleness, so does a read of a copy the server hasn't confirmed for that long. The dict
+        is shared with the cache: copy it before changing it.
+        """
+        if not self._is_fresh(dest_pc, max_staleness):
+            self.refresh(dest_pc)
+        return self.cached(dest_pc)
+
+    def refresh(self, dest_pc: str, force: bool = False):
+        """Check one PC with the server now. With force, refetch the whole config."""
+        with self._lock:
+            since_version, etag = self._since(dest_pc, force)
+            self._store(dest_pc, self.client.config_update(dest_pc, since_version, etag), force)
+
+    def invalidate(self, dest_pc: str | None = None):
+        """Force a full refetch of one PC's config, or all of them, e.g. right after changing it."""
+        for pc in [dest_pc] if dest_pc is not None else list(self.entries):
+            self.refresh(pc, force=True)
+
+    def revalidate(self):
+        """Check every PC once. Errors leave the cached configs as they are."""
+        for pc in list(self.entries):
+            try:
+                self.refresh(pc)
+            except httpx.HTTPError as e:
+                self.last_error = e
+
+    def run(self):
+        while not self._stop.is_set():
+            self.revalidate()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self) -> 'ConfigCache':
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='holochat-config-cache', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self) -> 'ConfigCache':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncConfigCache(_ConfigCacheBase):
+    """ConfigCache for asyncio, revalidated by a background task."""
+    def __init__(self, client: AsyncClient, pcs: Iterable[str] = (), interval: float = 1.0,
+                 path: str | Path | None = None):
+        super().__init__(pcs, interval, path)
+        self.client = client
+        self._task: asyncio.Task | None = None
+
+    async def get(self, dest_pc: str, max_staleness: float | None = None) -> dict[str, Any]:
+        """The config of a PC, fetched first if it isn't cached (or is older than max_staleness)."""
+        if not self._is_fresh(dest_pc, max_staleness):
+            await self.refresh(dest_pc)
+        return self.cached(dest_pc)
+
+    async def refresh(self, dest_pc: str, force: bool = False):
+        since_version, etag = self._since(dest_pc, force)
+        self._store(dest_pc, await self.client.config_update(dest_pc, since_version, etag), force)
+
+    async def invalidate(self, dest_pc: str | None = None):
+        for pc in [dest_pc] if dest_pc is not None else list(self.entries):
+            await self.refresh(pc, force=True)
+
+    async def revalidate(self):
+        for pc in list(self.entries):
+            try:
+                await self.refresh(pc)
+            except httpx.HTTPError as e:
+                self.last_error = e
+
+    async def run(self):
+        while True:
+            await self.revalidate()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> 'AsyncConfigCache':
+        self._task = asyncio.create_task(self.run())
+        return self
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def __aenter__(self) -> 'AsyncConfigCache':
+        return self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,169 @@
+import json
+from datetime import datetime
+from typing import Any, Callable
+
+import pydantic_core
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from .models import MessageHistory, MessageRecord, settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+
+
+def _default(obj: Any) -> Any:
+    """Encode the objects the database is made of, for types the JSON library doesn't know."""
+    if isinstance(obj, MessageRecord):
+        return obj.to_dict()
+    if isinstance(obj, MessageHistory):
+        return list(obj)
+    if isinstance(obj, BaseModel):
+        # shallow: nested values come back through here, and plain configs are left to the encoder
+        out = dict(obj)
+        for name in type(obj).model_computed_fields:
+            out[name] = getattr(obj, name)
+        return out
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _orjson_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default)
+
+def _pydantic_dumps(obj: Any) -> bytes:
+    # pydantic's own Rust encoder, always installed; NaN becomes null like with orjson
+    return pydantic_core.to_json(obj, fallback=_default, inf_nan_mode='null')
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    # same output options as starlette's JSONResponse
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default).encode()
+
+def get_dumps(encoder: str) -> Callable[[Any], bytes]:
+    """Pick the JSON encoder from the settings. 'auto' uses orjson if it is installed, pydantic otherwise."""
+    if encoder == 'stdlib':
+        return _stdlib_dumps
+    if encoder == 'pydantic' or (encoder == 'auto' and orjson is None):
+        return _pydantic_dumps
+    if orjson is None:
+        raise ImportError('The "orjson" JSON encoder is selected in the settings, but orjson is not '
+                          'installed. Run `pip install holochat[fast]` or set "json_encoder": "auto".')
+    return _orjson_dumps
+
+dumps = get_dumps(settings.json_encoder)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    The default response class. Renders with the encoder from the settings, and can be handed
+    MessageStores and MessageRecords directly, so routes that return one skip FastAPI's
+    jsonable_encoder pass.
+    """
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class MsgpackResponse(Response):
+    """Binary MessagePack response, for clients that send Accept: application/msgpack."""
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=_default)
+
+def _media_type(header_value: str) -> str:
+    return header_value.split(";", 1)[0].strip().lower()
+
+def is_msgpack(content_type: str | None) -> bool:
+    return content_type is not None and _media_type(content_type) in MSGPACK_MEDIA_TYPES
+
+def _quality(params: list[str]) -> float:
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+def accepts_msgpack(accept: str | None) -> bool:
+    """
+    True if the Accept header prefers msgpack to JSON (and msgpack is installed): the higher q
+    wins, and on equal q the one listed first.
+    """
+    if msgpack is None or not accept:
+        return False
+    # media type -> (q, -position), so the best rank is the largest
+    ranks: dict[str, tuple[float, int]] = {}
+    for position, media_range in enumerate(accept.split(",")):
+        media_type, *params = media_range.split(";")
+        ranks.setdefault(media_type.strip().lower(), (_quality(params), -position))
+    msgpack_rank = max((ranks[t] for t in MSGPACK_MEDIA_TYPES if t in ranks), default=None)
+    if msgpack_rank is None or msgpack_rank[0] <= 0:
+        return False
+    # the most specific range that covers JSON decides how much it is wanted
+    json_rank = next((ranks[t] for t in ("application/json", "application/*", "*/*") if t in ranks), None)
+    return json_rank is None or msgpack_rank > json_rank
+
+def negotiate(request: Request, content: Any, headers: dict[str, str] | None = None) -> Response:
+    """Respond with msgpack or JSON, following the Accept header of the request."""
+    headers = {**(headers or {}), "Vary": "Accept"}
+    if accepts_msgpack(request.headers.get("accept")):
+        return MsgpackResponse(content, headers=headers)
+    return FastJSONResponse(content, headers=headers)
+
+
+def _check_json_types(obj: Any):
+    """Reject msgpack values JSON has no type for (bin, ext, timestamps): they couldn't be stored or sent on."""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, (bytes, msgpack.ExtType, msgpack.Timestamp)):
+            raise HTTPException(status_code=400, detail="msgpack bodies may only hold values JSON has, "
+                                                        "not bin or ext; send binary data as a blob.")
+
+
+class MsgpackRequest(Request):
+    """A request whose msgpack body stands in for JSON, so FastAPI validates it into the usual models."""
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            body = msgpack.unpackb(await self.body())
+            _check_json_types(body)
+            self._json = body
+        return self._json
+
+
+class NegotiatedRoute(APIRoute):
+    """Route class of the app: request bodies may be sent as msgpack instead of JSON."""
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if self.body_field is not None and is_msgpack(request.headers.get("content-type")):
+                if msgpack is None:
+                    raise HTTPException(status_code=415, detail="msgpack is not installed on the server.")
+                # FastAPI only parses JSON bodies, so present the body as JSON and decode it as msgpack
+                headers = [(k, v) for k, v in request.scope["headers"] if k != b"content-type"]
+                scope = {**request.scope, "headers": [*headers, (b"content-type", b"application/json")]}
+                request = MsgpackRequest(scope, request.receive)
+            return await handler(request)
+
+        return route_handler
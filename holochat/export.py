@@ -0,0 +1,59 @@
+import asyncio
+import itertools
+import json
+from typing import AsyncIterator, Iterable
+
+from .models import MessageStore
+
+
+# number of history messages serialized per chunk
+CHUNK_MESSAGES = 256
+
+
+def dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"))
+
+def snapshot_items(items: Iterable[tuple[str, MessageStore]]) -> list[tuple[str, dict, list]]:
+    """
+    Take a consistent view of the stores to export: the small parts are serialized right away, and
+    the history is copied by reference so later writes can't mutate it mid-stream.
+    """
+    return [(pc, store.model_dump(mode="json", exclude={"messages"}), list(store.messages))
+            for pc, store in items]
+
+def _batched(messages: list, n: int):
+    it = iter(messages)
+    while batch := list(itertools.islice(it, n)):
+        yield batch
+
+async def iter_store_json(header: dict, messages: list) -> AsyncIterator[str]:
+    """Stream one store as compact JSON, shaped like a MessageStore dump."""
+    yield '{"messages":['
+    for i, batch in enumerate(_batched(messages, CHUNK_MESSAGES)):
+        chunk = ','.join(dumps(m.to_dict()) for m in batch)
+        yield chunk if i == 0 else ',' + chunk
+        # let other requests run between chunks
+        await asyncio.sleep(0)
+    # the header is a JSON object too, splice its keys in after the messages
+    yield '],' + dumps(header)[1:]
+
+async def iter_db_json(snapshot: list[tuple[str, dict, list]]) -> AsyncIterator[str]:
+    """Stream several stores as one compact JSON object keyed by PC."""
+    yield '{'
+    for i, (dest_pc, header, messages) in enumerate(snapshot):
+        yield ('' if i == 0 else ',') + dumps(dest_pc) + ':'
+        async for chunk in iter_store_json(header, messages):
+            yield chunk
+    yield '}'
+
+async def iter_db_ndjson(snapshot: list[tuple[str, dict, list]]) -> AsyncIterator[str]:
+    """
+    Stream stores as NDJSON: for each PC, one "store" line (everything but the history) followed by
+    one "message" line per history message, oldest first.
+    """
+    for dest_pc, header, messages in snapshot:
+        yield dumps({"type": "store", "target": dest_pc, "data": header}) + '\n'
+        for batch in _batched(messages, CHUNK_MESSAGES):
+            yield ''.join(dumps({"type": "message", "target": dest_pc, "data": m.to_dict()}) + '\n'
+                          for m in batch)
+            await asyncio.sleep(0)
@@ -0,0 +1,197 @@
+import codecs
+import json
+from typing import Any, AsyncIterator
+
+from pydantic import TypeAdapter, ValidationError
+
+from .models import MessageRecord, MessageStore
+
+
+# number of history messages validated at once
+BATCH_SIZE = 1000
+
+WHITESPACE = ' \t\r\n'
+
+message_batch = TypeAdapter(list[MessageRecord])
+
+
+class DumpError(ValueError):
+    """A dump that can't be loaded. The message says which record was bad."""
+
+
+class JsonReader:
+    """
+    Minimal incremental reader for a JSON document arriving in chunks. Objects and arrays are
+    walked one member at a time, so only a single member (e.g. one message) has to be decoded and
+    held in memory at once.
+    """
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    async def _fill(self) -> bool:
+        """Read the next chunk into the buffer, dropping what was already consumed."""
+        if self.eof:
+            return False
+        try:
+            chunk = await anext(self.chunks)
+        except StopAsyncIteration:
+            self.eof = True
+            chunk = b''
+        self.buf = self.buf[self.pos:] + self._utf8.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    async def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self._fill():
+                raise DumpError('Unexpected end of JSON document.')
+
+    async def expect(self, char: str):
+        found = await self.peek()
+        if found != char:
+            raise DumpError(f'Expected {char!r} in JSON document, found {found!r}.')
+        self.pos += 1
+
+    async def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        await self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if not await self._fill():
+                    raise DumpError(f'Invalid JSON document: {e}') from None
+                continue
+            # a number at the very end of the buffer might continue in the next chunk
+            if end == len(self.buf) and isinstance(obj, (int, float)) and await self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    async def keys(self) -> AsyncIterator[str]:
+        """Walk an object. The caller must consume each member's value before asking for the next key."""
+        await self.expect('{')
+        if await self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = await self.value()
+            await self.expect(':')
+            yield key
+            if await self.peek() == '}':
+                self.pos += 1
+                return
+            await self.expect(',')
+
+    async def elements(self) -> AsyncIterator[Any]:
+        """Walk an array, decoding one element at a time."""
+        await self.expect('[')
+        if await self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield await self.value()
+            if await self.peek() == ']':
+                self.pos += 1
+                return
+            await self.expect(',')
+
+
+class StoreLoader:
+    """Rebuilds MessageStores from a dump in a single pass, validating history messages in batches."""
+    def __init__(self):
+        self.stores: dict[str, MessageStore] = {}
+        self.records = 0
+        self._pending: dict[str, list[Any]] = {}
+
+    def add_header(self, dest_pc: str, header: dict[str, Any]):
+        """Everything in a saved store except its history (current message, config, ...)."""
+        header = {k: v for k, v in header.items() if k not in ("messages", "message_count")}
+        try:
+            store = MessageStore.model_validate(header)
+        except ValidationError as e:
+            raise DumpError(f'Invalid store for {dest_pc!r} (record {self.records + 1}): {e}') from None
+        if dest_pc in self.stores:
+            # messages may have been seen before the header
+            store.messages = self.stores[dest_pc].messages
+        self.stores[dest_pc] = store
+        self.records += 1
+
+    def add_message(self, dest_pc: str, message: Any):
+        pending = self._pending.setdefault(dest_pc, [])
+        pending.append(message)
+        if len(pending) >= BATCH_SIZE:
+            self._flush(dest_pc)
+
+    def _flush(self, dest_pc: str):
+        pending = self._pending.pop(dest_pc, [])
+        if not pending:
+            return
+        try:
+            messages = message_batch.validate_python(pending)
+        except (ValidationError, ValueError) as e:
+            raise DumpError(f'Invalid message for {dest_pc!r} (records {self.records + 1}-'
+                            f'{self.records + len(pending)}): {e}') from None
+        if dest_pc not in self.stores:
+            self.stores[dest_pc] = MessageStore()
+        # the history ring buffer keeps only the newest messages
+        self.stores[dest_pc].messages.extend(messages)
+        self.records += len(messages)
+
+    def finish(self) -> dict[str, MessageStore]:
+        for dest_pc in list(self._pending):
+            self._flush(dest_pc)
+        return self.stores
+
+    async def load_store_json(self, reader: JsonReader, dest_pc: str):
+        """A single saved store: {"messages": [...], "current": ..., "config": ..., ...}"""
+        header = {}
+        async for key in reader.keys():
+            if key == "messages":
+                async for message in reader.elements():
+                    self.add_message(dest_pc, message)
+            else:
+                header[key] = await reader.value()
+        self.add_header(dest_pc, header)
+
+    async def load_db_json(self, reader: JsonReader):
+        """Several saved stores keyed by PC: {"pc1": {...}, "pc2": {...}}"""
+        async for dest_pc in reader.keys():
+            await self.load_store_json(reader, dest_pc)
+
+    async def load_ndjson(self, chunks: AsyncIterator[bytes], dest_pc: str | None = None):
+        """NDJSON lines of {"type": "store" | "message", "target": pc, "data": ...}"""
+        buf = b''
+        async for chunk in chunks:
+            buf += chunk
+            *lines, buf = buf.split(b'\n')
+            for line in lines:
+                self._load_line(line, dest_pc)
+        self._load_line(buf, dest_pc)
+
+    def _load_line(self, line: bytes, dest_pc: str | None):
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            kind, target, data = record["type"], record["target"], record["data"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            raise DumpError(f'Invalid NDJSON record after record {self.records}.') from None
+        if dest_pc is not None and target != dest_pc:
+            return
+        if kind == "store":
+            self.add_header(target, data)
+        elif kind == "message":
+            self.add_message(target, data)
+        else:
+            raise DumpError(f'Unknown NDJSON record type {kind!r} after record {self.records}.')
@@ -0,0 +1,57 @@
+from typing import Any, Iterable
+
+from .encoding import dumps
+from .models import MessageRecord, MessageStore
+
+
+class ActiveIndex:
+    """
+    The client PCs that currently hold a message or a config, kept up to date by the routes that
+    change them. /msg/latest and /config then cost time in the number of active PCs instead of
+    all PCs, and their JSON is cached until the next change.
+    """
+    def __init__(self):
+        self.messages: dict[str, MessageRecord] = {}
+        self.configs: dict[str, dict[str, Any]] = {}
+        self._latest_json: bytes | None = None
+        self._configs_json: bytes | None = None
+
+    def message_changed(self, dest_pc: str, current: MessageRecord | None):
+        """After a post, read or delete. Reads mutate the record in place, so they must call this too."""
+        if current is not None:
+            self.messages[dest_pc] = current
+        else:
+            self.messages.pop(dest_pc, None)
+        self._latest_json = None
+
+    def config_changed(self, dest_pc: str, config: dict[str, Any]):
+        if config:
+            self.configs[dest_pc] = config
+        else:
+            self.configs.pop(dest_pc, None)
+        self._configs_json = None
+
+    def discard(self, dest_pc: str):
+        self.message_changed(dest_pc, None)
+        self.config_changed(dest_pc, {})
+
+    def rebuild(self, items: Iterable[tuple[str, MessageStore]]):
+        """Start over from the whole database, e.g. after it was restored from disk."""
+        self.messages.clear()
+        self.configs.clear()
+        for dest_pc, store in items:
+            self.message_changed(dest_pc, store.current)
+            self.config_changed(dest_pc, store.config)
+        self._latest_json = self._configs_json = None
+
+    def latest_json(self) -> bytes:
+        """The most recent message of each client, as returned by /msg/latest."""
+        if self._latest_json is None:
+            self._latest_json = dumps(self.messages)
+        return self._latest_json
+
+    def configs_json(self) -> bytes:
+        """Every non-empty config, as returned by /config."""
+        if self._configs_json is None:
+            self._configs_json = dumps(self.configs)
+        return self._configs_json
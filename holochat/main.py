@@ -1,159 +1,956 @@
+import asyncio
+import base64
+import functools
 import importlib.metadata
+import itertools
+import json
+import time
 from collections import defaultdict
-from typing import Any
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Callable, Literal, TypeVar
 from pathlib import Path
 
-from fastapi import Depends, FastAPI, HTTPException, Request
+import anyio
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket
 from fastapi.responses import StreamingResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-
-from .models import MessageContent, MessageHold, MessageRequest, MessageStore
 
-
-app = FastAPI()
+from .blobs import BlobError, BlobStore, blob_nbytes, parse_shape
+from .changes import ChangeFeed, format_sse
+from .encoding import FastJSONResponse, NegotiatedRoute, accepts_msgpack, negotiate
+from .export import iter_db_json, iter_db_ndjson, iter_store_json, snapshot_items
+from .importer import DumpError, JsonReader, StoreLoader
+from .index import ActiveIndex
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, MetricsMiddleware, render_store_metrics
+from .models import (BatchMessage, MessageContent, MessageHistory, MessageRecord, MessageRequest, MessageStore,
+                     QueueAck, settings)
+from .patch import ConfigHistory, apply_merge_patch
+from .persistence import WriteAheadLog
+from .pubsub import PubSub
+from .queues import MessageQueue, QueueRegistry
+from .store import open_backend
+from .sweeper import Sweeper
+from .trigger import TriggerCommands, TriggerServer
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Restore the database from disk and keep logging changes, if persistence is enabled. Then run
+    the TTL sweeper and the trigger listeners, if they are enabled.
+    """
+    wal = None
+    # a shared backend is already on disk
+    if settings.persistence.enabled and not message_db.shared:
+        wal = WriteAheadLog(
+            message_db,
+            data_dir=settings.persistence.data_dir,
+            durability=settings.persistence.durability,
+            commit_interval_ms=settings.persistence.commit_interval_ms,
+            compact_every=settings.persistence.compact_every,
+        )
+        # continue the sequence ids where the log left off
+        changes.seq = wal.recover()
+        active.rebuild(message_db.items())
+        wal.start()
+        changes.listeners.append(wal.append)
+    if settings.sweeper.enabled:
+        sweeper.schedule_all(message_db.items())
+        changes.observers.append(sweeper.observe)
+        sweeper.start()
+    if settings.trigger.enabled:
+        await trigger_server.start()
+    try:
+        yield
+    finally:
+        if settings.trigger.enabled:
+            await trigger_server.close()
+        if settings.sweeper.enabled:
+            changes.observers.remove(sweeper.observe)
+            await sweeper.close()
+        if wal is not None:
+            changes.listeners.remove(wal.append)
+            await wal.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+app.router.route_class = NegotiatedRoute
+
+# request counts and latencies by route, for /metrics
+metrics = Metrics()
+if settings.metrics:
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 logo_path = Path(__file__).parent.parent / "logo"
 app.mount("/logo", StaticFiles(directory=logo_path), name="logo")
 
 templates_path = Path(__file__).parent.parent / "templates"
-templates = Jinja2Templates(directory=templates_path)
-
-message_db: defaultdict[str, MessageStore] = defaultdict(MessageStore)
 
+@functools.cache
+def get_templates():
+    # jinja2 is only needed for the index page, so it's loaded on the first visit, not at startup
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory=templates_path)
+
+message_db = open_backend(settings.store.backend, settings.store.sqlite_path)
+
+# long-poll GET requests park here until write_message wakes them up
+message_waiters: defaultdict[str, set[asyncio.Future]] = defaultdict(set)
+
+# websocket subscribers, each with a bounded send queue
+pubsub = PubSub(queue_size=settings.ws_queue_size)
+
+# incremental change records for the /events stream
+changes = ChangeFeed(backlog=settings.event_backlog)
+
+# recent config changes, for incremental config syncs
+config_history = ConfigHistory(maxlen=settings.config_history_len)
+
+# numeric array attachments, kept outside the message stores
+blob_store = BlobStore(spill_dir=settings.blobs.spill_dir, spill_bytes=settings.blobs.spill_bytes)
+
+# PCs with a current message or a config, for /msg/latest and /config
+# (only used with an in-process backend, other workers don't update it)
+active = ActiveIndex()
+
+# FIFO queues of the PCs in queue mode
+# (process-local like the index, so a shared backend doesn't get any)
+queues = QueueRegistry(
+    settings.queue.pcs if not message_db.shared else (),
+    ack_timeout=settings.queue.ack_timeout_secs,
+    max_len=settings.queue.max_len,
+)
+
+T = TypeVar("T")
+
+async def run_db(fn: Callable[..., T], *args) -> T:
+    """
+    Run a store call. A shared backend can wait up to busy_timeout on another worker's write
+    lock, so there it runs in a worker thread instead of holding up the event loop.
+    """
+    if not message_db.shared:
+        return fn(*args)
+    return await anyio.to_thread.run_sync(fn, *args)
+
+def notify(fn: Callable[..., None], *args):
+    """
+    Run the event loop part of a store change from a function that may itself run through run_db:
+    in place with the memory backend, and back on the event loop from a worker thread otherwise.
+    """
+    if message_db.shared:
+        anyio.from_thread.run_sync(fn, *args)
+    else:
+        fn(*args)
 
 async def verify_db_key(dest_pc: str):
     """Verify that the target PC exists in the database."""
-    if dest_pc not in message_db:
+    if not await run_db(message_db.__contains__, dest_pc):
         raise HTTPException(status_code=404, detail="Client PC not found in message database.")
 
+def store_etag(store: MessageStore) -> str:
+    # weak: the body of a message also carries its read count and freshness
+    return f'W/"{store.version}"'
+
+def config_etag(store: MessageStore) -> str:
+    # only config writes move config_version, so messages posted and read leave it alone
+    return f'W/"{store.config_version}"'
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak If-None-Match comparison against the current ETag."""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+def has_message_after(dest_pc: str, after: int | None) -> bool:
+    """Check if the target PC holds a message the client hasn't seen yet (msg_id != after)."""
+    store = message_db.get(dest_pc)
+    if store is None or store.current is None:
+        return False
+    return after is None or store.current.msg_id != after
+
+def wake_message_waiters(dest_pc: str):
+    """Release every long-poll request waiting on the target PC."""
+    for waiter in message_waiters.pop(dest_pc, ()):
+        if not waiter.done():
+            waiter.set_result(None)
+
+async def wait_for_message(dest_pc: str, after: int | None, timeout: float) -> bool:
+    """Wait up to timeout seconds for a new message. Returns False if the wait timed out."""
+    return await wait_until(dest_pc, lambda: has_message_after(dest_pc, after), timeout)
+
+async def wait_until(dest_pc: str, ready: Callable[[], bool], timeout: float,
+                     poll_secs: float | None = None) -> bool:
+    """
+    Wait up to timeout seconds for ready() to hold, checking again whenever a message is posted
+    to the target PC (and every poll_secs). Returns False if the wait timed out.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await run_db(ready):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        if message_db.shared:
+            # other workers can't wake us up, so check back regularly
+            remaining = min(remaining, settings.store.poll_interval_ms / 1000)
+        if poll_secs is not None:
+            remaining = min(remaining, poll_secs)
+        waiter = loop.create_future()
+        message_waiters[dest_pc].add(waiter)
+        try:
+            await asyncio.wait_for(waiter, remaining)
+        except TimeoutError:
+            pass
+        finally:
+            waiters = message_waiters.get(dest_pc)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del message_waiters[dest_pc]
+    return True
+
+def push_update(dest_pc: str, event: str, data: Any):
+    """Serialize an update once and queue it for every websocket subscriber of the target PC."""
+    if not pubsub.has_subscribers(dest_pc):
+        return
+    payload = json.dumps({"event": event, "target": dest_pc, "data": data})
+    pubsub.publish(dest_pc, payload)
+
+class HistoryQuery:
+    """Cursor pagination and filters over the message history of every client PC."""
+    def __init__(
+        self,
+        limit: int | None = Query(None, ge=1, description="Maximum number of messages per page."),
+        cursor: str | None = Query(None, description="The X-Next-Cursor header of the previous page."),
+        since: datetime | None = Query(None, description="Only messages received at or after this time."),
+        until: datetime | None = Query(None, description="Only messages received at or before this time."),
+        sender: str | None = Query(None, description="Only messages from this sender."),
+    ):
+        self.limit = limit
+        self.since = self._local_time(since)
+        self.until = self._local_time(until)
+        self.sender = sender
+        self.start_pc, self.after_id = self._decode_cursor(cursor) if cursor else (None, None)
+        
+    @property
+    def is_empty(self) -> bool:
+        return (self.limit is None and self.start_pc is None and self.since is None 
+                and self.until is None and self.sender is None)
+    
+    @staticmethod
+    def _local_time(t: datetime | None) -> datetime | None:
+        # recv_time is naive local time
+        if t is not None and t.tzinfo is not None:
+            t = t.astimezone().replace(tzinfo=None)
+        return t
+    
+    @staticmethod
+    def encode_cursor(dest_pc: str, msg_id: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([dest_pc, msg_id]).encode()).decode()
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> tuple[str, int]:
+        try:
+            dest_pc, msg_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return str(dest_pc), int(msg_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        
+    def scan(self) -> tuple[list[tuple[str, MessageStore, list[MessageRecord]]], str | None]:
+        """
+        Walk the histories in (PC name, msg_id) order and collect one page. Each history is
+        binary-searched for the time range and the cursor, so only the returned messages (and
+        any skipped by the sender filter) are visited. Returns every store the page passed
+        through with its matching messages, and the cursor of the next page if the page is full.
+        """
+        page = []
+        n_found = 0
+        for dest_pc in sorted(message_db.keys()):
+            if self.start_pc is not None and dest_pc < self.start_pc:
+                continue
+            store = message_db.get(dest_pc)
+            history = store.messages
+            lo, hi = history.time_range(self.since, self.until)
+            if dest_pc == self.start_pc:
+                lo = max(lo, history.index_after(self.after_id))
+            found = []
+            for i in range(lo, hi):
+                if self.limit is not None and n_found == self.limit:
+                    break
+                msg = history[i]
+                if self.sender is not None and msg.sender != self.sender:
+                    continue
+                found.append(msg)
+                n_found += 1
+            page.append((dest_pc, store, found))
+            if self.limit is not None and n_found == self.limit:
+                return page, self.encode_cursor(dest_pc, found[-1].msg_id) if found else None
+        return page, None
+
+async def replace_config(dest_pc: str, config: dict[str, Any]) -> int:
+    """Replace the whole config of a client PC (created if missing). Returns the new config version."""
+    def write() -> tuple[int, MessageStore]:
+        with message_db.edit(dest_pc, "config", "config_version", "version") as store:
+            prev_version = store.config_version
+            store.config = config
+            store.config_version = store.touch()
+        return prev_version, store
+    prev_version, store = await run_db(write)
+    config_history.record(dest_pc, prev_version, store.config_version, None)
+    active.config_changed(dest_pc, config)
+    changes.publish("config_changed", dest_pc, {"config": config, "config_version": store.config_version})
+    return store.config_version
+
+def drop_store(dest_pc: str):
+    """Delete everything the server holds for a client PC."""
+    message_db.delete(dest_pc)
+    notify(forget_store, dest_pc)
+
+def forget_store(dest_pc: str):
+    """Drop what the server keeps about a client PC next to its store, once the store is deleted."""
+    blob_store.delete_pc(dest_pc)
+    config_history.discard(dest_pc)
+    active.discard(dest_pc)
+    queues.discard(dest_pc)
+    changes.publish("store_deleted", dest_pc)
+
+def expire_message(dest_pc: str, msg_id: int):
+    """Evict the current message of a client PC once it has expired."""
+    with message_db.edit(dest_pc, "current", "version") as store:
+        store.current = None
+        store.touch()
+    notify(announce_expired, dest_pc, msg_id)
+
+def announce_expired(dest_pc: str, msg_id: int):
+    active.message_changed(dest_pc, None)
+    changes.publish("message_expired", dest_pc, {"msg_id": msg_id})
+
+def trim_history(dest_pc: str, cutoff: datetime):
+    """Drop the history messages of a client PC received before cutoff."""
+    with message_db.edit(dest_pc, "messages", "version") as store:
+        count = store.messages.trim_before(cutoff)
+        store.touch()
+    notify(changes.publish, "history_trimmed", dest_pc, {"before": cutoff.isoformat(), "count": count})
+
+# evicts expired messages and idle stores when settings.sweeper is enabled
+sweeper = Sweeper(
+    message_db,
+    expire_secs=settings.message_expire_secs,
+    expire_message=expire_message,
+    trim_history=trim_history,
+    drop_store=drop_store,
+    default_policy=settings.sweeper.default,
+    policies=settings.sweeper.pcs,
+    slice_ms=settings.sweeper.slice_ms,
+    run_db=run_db,
+)
+
+def post_message(dest_pc: str, msg: MessageContent) -> MessageRecord:
+    """Make a message the current one for a client PC and notify everyone waiting on it."""
+    new_msg = save_message(dest_pc, msg)
+    notify(announce_message, dest_pc, new_msg)
+    return new_msg
+
+def save_message(dest_pc: str, msg: MessageContent) -> MessageRecord:
+    """Store a message as the current one for a client PC (the store part of post_message)."""
+    # take the raw message and hold it as a record (waiting for first GET request)
+    with message_db.edit(dest_pc, "current", "messages", "last_msg_id", "version") as store:
+        store.last_msg_id += 1
+        new_msg = MessageRecord(msg.message, msg.sender, dest_pc, msg_id=store.last_msg_id)
+        # the new message becomes the current one, and the history ring buffer drops the oldest
+        store.current = new_msg
+        store.messages.append(new_msg.copy())
+        store.touch()
+    return new_msg
+
+def announce_message(dest_pc: str, new_msg: MessageRecord):
+    """Notify everyone waiting on a client PC of its new message (the event loop part of post_message)."""
+    active.message_changed(dest_pc, new_msg)
+    queue = queues.get(dest_pc)
+    if queue is not None:
+        queue.append(new_msg.copy())
+    wake_message_waiters(dest_pc)
+    changes.publish("message_posted", dest_pc, new_msg.held_dict())
+    if pubsub.has_subscribers(dest_pc):
+        push_update(dest_pc, "message", new_msg.request_dict(datetime.now()))
+
+def read_current(dest_pc: str) -> tuple[dict[str, Any], str] | None:
+    """
+    Count a read of the current message of a client PC. Returns it shaped like a MessageRequest,
+    with the store's ETag, or None if there's no message.
+    """
+    read = count_read(dest_pc)
+    if read is None:
+        return None
+    msg, out, etag = read
+    notify(announce_read, dest_pc, msg, out)
+    return out, etag
+
+def count_read(dest_pc: str) -> tuple[MessageRecord, dict[str, Any], str] | None:
+    """The store part of read_current: returns the record too, for announce_read."""
+    store = message_db.get(dest_pc)
+    if store is None or store.current is None:
+        return None
+    with message_db.edit(dest_pc, "current") as store:
+        msg = store.current
+        if msg is None:
+            return None
+        # hot path: bump the record in place and skip pydantic entirely
+        msg.mark_read()
+        return msg, msg.request_dict(), store_etag(store)
+
+def announce_read(dest_pc: str, msg: MessageRecord, out: dict[str, Any]):
+    active.message_changed(dest_pc, msg)
+    changes.publish("message_read", dest_pc, 
+                    {"msg_id": out["msg_id"], "read_count": out["read_count"], "request_time": out["request_time"]})
+
+# raw TCP/UDP listeners for hard-timed triggers, next to the HTTP API
+trigger_server = TriggerServer(
+    TriggerCommands(post_message, read_current),
+    host=settings.trigger.host,
+    tcp_port=settings.trigger.tcp_port,
+    udp_port=settings.trigger.udp_port,
+    reuse_port=settings.server.workers > 1,
+    offload=message_db.shared,
+)
+
 
 ### --- Root --- ###
 
 @app.get("/")
 async def root(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse(
+    return get_templates().TemplateResponse(
         name="index.html", 
         request=request, 
         context={"version": f"v{importlib.metadata.version('holochat')}"}
     )
 
+EXPORT_MEDIA_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+@app.get("/save")
+async def save_db_all(format: Literal["json", "ndjson"] = "ndjson"):
+    """Stream the entire database as a download, chunk by chunk."""
+    snapshot = snapshot_items(await run_db(message_db.items))
+    out = iter_db_ndjson(snapshot) if format == "ndjson" else iter_db_json(snapshot)
+    fname = f"holochat_db.{format}"
+    return StreamingResponse(out, media_type=EXPORT_MEDIA_TYPES[format], 
+                             headers={"Content-Disposition": "attachment; filename="+fname})
+
 @app.get("/save/{dest_pc}")
-async def save_db(dest_pc: str):
-    out = message_db[dest_pc].model_dump_json(indent=2)
-    fname = f"{dest_pc}_holochat_db.json"
-    return StreamingResponse(out, media_type="application/json", 
+async def save_db(dest_pc: str, format: Literal["json", "ndjson"] = "json"):
+    """Stream the database of a client PC as a download, chunk by chunk."""
+    snapshot = snapshot_items([(dest_pc, await run_db(message_db.get, dest_pc) or MessageStore())])
+    if format == "ndjson":
+        out = iter_db_ndjson(snapshot)
+    else:
+        _, header, messages = snapshot[0]
+        out = iter_store_json(header, messages)
+    fname = f"{dest_pc}_holochat_db.{format}"
+    return StreamingResponse(out, media_type=EXPORT_MEDIA_TYPES[format], 
                              headers={"Content-Disposition": "attachment; filename="+fname})
 
+async def load_dump(request: Request, format: str | None, dest_pc: str | None = None) -> dict[str, Any]:
+    """Rebuild stores from an uploaded dump, streamed straight from the request body."""
+    if format is None:
+        format = "ndjson" if "ndjson" in request.headers.get("content-type", "") else "json"
+    start = time.perf_counter()
+    loader = StoreLoader()
+    try:
+        if format == "ndjson":
+            await loader.load_ndjson(request.stream(), dest_pc)
+        elif dest_pc is not None:
+            await loader.load_store_json(JsonReader(request.stream()), dest_pc)
+        else:
+            await loader.load_db_json(JsonReader(request.stream()))
+        stores = loader.finish()
+    except DumpError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    # nothing is applied until the whole dump has been validated
+    def put_stores():
+        for pc, store in stores.items():
+            # keep versions moving forward so ETags handed out before the load don't match
+            old = message_db.get(pc)
+            if old is not None:
+                store.version = max(store.version, old.version)
+            store.touch()
+            message_db.put(pc, store)
+    await run_db(put_stores)
+    for pc, store in stores.items():
+        config_history.discard(pc)
+        active.message_changed(pc, store.current)
+        active.config_changed(pc, store.config)
+        changes.publish("store_loaded", pc, store.model_dump(mode="json"))
+        wake_message_waiters(pc)
+    seconds = time.perf_counter() - start
+    return {
+        "message": "Database loaded.",
+        "targets": list(stores),
+        "records": loader.records,
+        "seconds": round(seconds, 6),
+        "records_per_sec": round(loader.records / seconds, 1) if seconds > 0 else None,
+    }
+
+@app.post("/load", tags=["database"])
+async def load_db_all(request: Request, format: Literal["json", "ndjson"] | None = None) -> dict[str, Any]:
+    """
+    Restore a dump made with /save. The body is streamed, so big dumps are never held in memory
+    as a whole. The format follows the Content-Type (application/x-ndjson or application/json)
+    unless `format` is given. Stores in the dump replace the stores in the database.
+    """
+    return await load_dump(request, format)
+
+@app.post("/load/{dest_pc}", tags=["database"])
+async def load_db(dest_pc: str, request: Request, format: Literal["json", "ndjson"] | None = None) -> dict[str, Any]:
+    """Restore the store of a client PC from a dump made with /save/{dest_pc}."""
+    return await load_dump(request, format, dest_pc)
+
 ### --- Messages --- ###
 
 # these routes must be defined first, before routes with the path parameter
 @app.get("/msg/all", tags=["messages"])
-async def read_all_messages():
-    """Show all messages received by the server."""
-    message_dict = {k: v.messages for k,v in message_db.items() if len(v.messages) > 0}
-    return message_dict
+async def read_all_messages(request: Request, query: HistoryQuery = Depends()):
+    """
+    Show all messages received by the server. Use `limit` to page through them; the cursor for
+    the next page comes back in the X-Next-Cursor header.
+    """
+    # records go straight to the encoder, no jsonable_encoder pass
+    if query.is_empty:
+        return negotiate(request, {k: v.messages for k,v in await run_db(message_db.items) if len(v.messages) > 0})
+    page, next_cursor = await run_db(query.scan)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    return negotiate(request, {pc: found for pc, _, found in page if found}, headers=headers)
 
 @app.get("/msg/latest", tags=["messages"])
-async def read_most_recent():
+async def read_most_recent(request: Request):
     """Show the most recent message for each client."""
-    message_dict = {k: v.messages[-1] for k,v in message_db.items() if len(v.messages) > 0}
-    return message_dict
+    if message_db.shared:
+        return negotiate(request, {k: v.current for k,v in await run_db(message_db.items) if v.current is not None})
+    if accepts_msgpack(request.headers.get("accept")):
+        return negotiate(request, active.messages)
+    return Response(active.latest_json(), media_type="application/json", headers={"Vary": "Accept"})
+
+@app.post("/msg/batch", tags=["messages"])
+async def write_message_batch(batch: list[BatchMessage]) -> dict[str, Any]:
+    """
+    Write several messages in one request. A target can also be the name of a target group from
+    the settings file, which sends the message to every PC in the group. All items are validated
+    before any of them is written.
+    """
+    targets = [settings.target_groups.get(item.target, [item.target]) for item in batch]
+    sends = [(i, dest_pc, item) for i, (item, item_targets) in enumerate(zip(batch, targets)) for dest_pc in item_targets]
+    new_msgs = await run_db(lambda: [save_message(dest_pc, item) for _, dest_pc, item in sends])
+    results = []
+    for (i, dest_pc, _), new_msg in zip(sends, new_msgs):
+        announce_message(dest_pc, new_msg)
+        results.append({"item": i, "target": dest_pc, "msg_id": new_msg.msg_id})
+    return {"message": "Messages received.", "results": results}
 
 @app.post("/msg/{dest_pc}", tags=["messages"])
 async def write_message(dest_pc: str, msg: MessageContent):
     """Write a message to the database."""
-    # take the raw message and turn it into a MessageHold (waiting for first GET request)
-    new_msg = MessageHold(
-        **msg.model_dump(), 
-        target=dest_pc,
-    )
-    # message_db is a dict of lists, so we can append the new message to the list
-    message_db[dest_pc].messages.append(new_msg)
+    announce_message(dest_pc, await run_db(save_message, dest_pc, msg))
     return {"message": "Message received.", "target": dest_pc}
 
-@app.get("/msg/{dest_pc}", tags=["messages"], dependencies=[Depends(verify_db_key)])
-async def read_message(dest_pc: str) -> MessageRequest:
-    """Read a message from the database. This will return the most recent message for a client PC."""
+@app.get("/msg/{dest_pc}", tags=["messages"], response_model=MessageRequest,
+         responses={204: {"description": "No new message before wait timed out."},
+                    304: {"description": "The store hasn't changed since the If-None-Match ETag."}})
+async def read_message(
+    request: Request,
+    dest_pc: str,
+    wait: float | None = Query(None, ge=0, description="Long-poll: seconds to wait for a new message."),
+    after: int | None = Query(None, description="Long-poll cursor: msg_id of the last message already seen."),
+    if_none_match: str | None = Header(None),
+) -> Response:
+    """
+    Read a message from the database. This will return the most recent message for a client PC.
+    With `wait`, the request blocks until a message other than `after` arrives, or returns 204 on
+    timeout. With If-None-Match, an unchanged store returns 304 and the read isn't counted.
+    """
+    sweeper.touch(dest_pc)
+    if wait is not None:
+        timeout = min(wait, settings.long_poll_max_secs)
+        if not await wait_for_message(dest_pc, after, timeout):
+            return Response(status_code=204)
     
-    if len(message_db[dest_pc].messages) == 0:
+    await verify_db_key(dest_pc)
+    if if_none_match is not None:
+        etag = store_etag(await run_db(message_db.get, dest_pc))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    read = await run_db(count_read, dest_pc)
+    if read is None:
         raise HTTPException(status_code=404, detail="No messages found for this client PC.")
-    
-    held_msg = message_db[dest_pc].messages[-1]
-    
-    if isinstance(held_msg, MessageRequest):
-        held_msg.read_count += 1
-    
-    msg = MessageRequest(
-        **held_msg.model_dump(exclude={"request_time"}),
-    )
-    message_db[dest_pc].messages[-1] = msg
-    
-    return msg
+    msg, out, etag = read
+    announce_read(dest_pc, msg, out)
+    return negotiate(request, out, headers={"ETag": etag})
+
+@app.head("/msg/{dest_pc}", tags=["messages"], dependencies=[Depends(verify_db_key)])
+async def check_message(dest_pc: str) -> Response:
+    """Get the ETag of the current message without reading it (read_count is left alone)."""
+    sweeper.touch(dest_pc)
+    store = await run_db(message_db.get, dest_pc)
+    if store.current is None:
+        raise HTTPException(status_code=404, detail="No messages found for this client PC.")
+    return Response(headers={"ETag": store_etag(store)})
+
+@app.get("/msg/{dest_pc}/history", tags=["messages"], dependencies=[Depends(verify_db_key)])
+async def read_message_history(
+    request: Request,
+    dest_pc: str,
+    offset: int = Query(0, ge=0, description="Number of messages to skip, newest first."),
+    limit: int = Query(50, ge=1, le=1000),
+) -> dict[str, Any]:
+    """Page through the message history of a client PC, newest messages first."""
+    history = (await run_db(message_db.get, dest_pc)).messages
+    # walk the ring buffer from the newest end so recent pages don't cost a full copy
+    page = list(itertools.islice(reversed(history), offset, offset + limit))
+    return negotiate(request, {"target": dest_pc, "total": len(history), "offset": offset, "limit": limit, "messages": page})
 
 @app.delete("/msg/{dest_pc}", tags=["messages"], dependencies=[Depends(verify_db_key)])
 async def delete_pc_messages(dest_pc: str) -> dict[str, str]:
-    message_db[dest_pc].messages = []
+    await run_db(clear_messages, dest_pc)
+    announce_messages_deleted(dest_pc)
     return {"message": "Messages deleted.", "target": dest_pc}
 
 @app.delete("/msg", tags=["messages"])
 async def delete_all_messages() -> dict[str, str]:
-    for pc in message_db:
-        message_db[pc].messages = []
+    def clear_all() -> list[str]:
+        pcs = [pc for pc, store in message_db.items() if store.current is not None or store.messages]
+        for pc in pcs:
+            clear_messages(pc)
+        return pcs
+    for pc in await run_db(clear_all):
+        announce_messages_deleted(pc)
     return {"message": "All messages deleted."}
 
+def clear_messages(dest_pc: str):
+    with message_db.edit(dest_pc, "current", "messages", "version") as store:
+        store.current = None
+        store.messages.clear()
+        store.touch()
+
+def announce_messages_deleted(dest_pc: str):
+    active.message_changed(dest_pc, None)
+    queues.clear_messages(dest_pc)
+    changes.publish("messages_deleted", dest_pc)
+
+
+### --- Queue --- ###
+
+def get_queue(dest_pc: str) -> MessageQueue:
+    queue = queues.get(dest_pc)
+    if queue is None:
+        raise HTTPException(status_code=404, detail="Queue mode is not enabled for this client PC.")
+    return queue
+
+@app.post("/queue/{dest_pc}", tags=["queue"])
+async def enable_queue(
+    dest_pc: str,
+    ack_timeout: float | None = Query(None, gt=0, description="Seconds before an unacked message is delivered again."),
+) -> dict[str, Any]:
+    """
+    Put a client PC in queue mode: from now on, every message posted to it is also queued, and
+    consumers pop them in order instead of only seeing the latest one.
+    """
+    if message_db.shared:
+        raise HTTPException(status_code=501, detail="Queue mode needs the in-process memory store backend.")
+    try:
+        queue = queues.enable(dest_pc, ack_timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": "Queue mode enabled.", "target": dest_pc, "ack_timeout": queue.ack_timeout}
+
+@app.get("/queue/{dest_pc}", tags=["queue"])
+async def read_queue_info(dest_pc: str) -> dict[str, Any]:
+    """Show the length of a queue and where each consumer is in it."""
+    return {"target": dest_pc, **get_queue(dest_pc).info()}
+
+@app.post("/queue/{dest_pc}/pop", tags=["queue"])
+async def pop_queue(
+    dest_pc: str,
+    consumer: str = Query(..., description="Name of the consumer; each one reads the queue at its own offset."),
+    max_count: int = Query(1, ge=1, le=1000, alias="max"),
+    wait: float | None = Query(None, ge=0, description="Long-poll: seconds to wait for a message."),
+) -> dict[str, Any]:
+    """
+    Take the next messages for a consumer, oldest first. Messages that were delivered but not
+    acked within the ack timeout come again, before any new ones. Ack each message by its seq.
+    """
+    queue = get_queue(dest_pc)
+    if wait is not None and not queue.has_ready(consumer, time.monotonic()):
+        def ready() -> bool:
+            current = queues.get(dest_pc)
+            return current is None or current.has_ready(consumer, time.monotonic())
+        # redeliveries come due without a post to wake us, so look again when the next one does
+        due = queue.next_due(consumer)
+        poll_secs = None if due is None else max(due - time.monotonic(), 0.001)
+        await wait_until(dest_pc, ready, min(wait, settings.long_poll_max_secs), poll_secs=poll_secs)
+        queue = get_queue(dest_pc)
+    return {"target": dest_pc, "consumer": consumer, "messages": queue.pop(consumer, time.monotonic(), max_count)}
+
+@app.post("/queue/{dest_pc}/ack", tags=["queue"])
+async def ack_queue(dest_pc: str, ack: QueueAck) -> dict[str, Any]:
+    """Acknowledge messages by seq, so they aren't delivered to this consumer again."""
+    return {"target": dest_pc, "consumer": ack.consumer, "acked": get_queue(dest_pc).ack(ack.consumer, ack.seqs)}
+
+@app.delete("/queue/{dest_pc}/consumers/{consumer}", tags=["queue"])
+async def delete_queue_consumer(dest_pc: str, consumer: str) -> dict[str, str]:
+    """Forget a consumer, so the queue no longer keeps messages for it."""
+    if not get_queue(dest_pc).remove_consumer(consumer):
+        raise HTTPException(status_code=404, detail="Consumer not found in this queue.")
+    return {"message": "Consumer deleted.", "target": dest_pc, "consumer": consumer}
+
+@app.delete("/queue/{dest_pc}", tags=["queue"])
+async def disable_queue(dest_pc: str) -> dict[str, str]:
+    """Leave queue mode, dropping the queue and its consumers."""
+    if not queues.disable(dest_pc):
+        raise HTTPException(status_code=404, detail="Queue mode is not enabled for this client PC.")
+    return {"message": "Queue mode disabled.", "target": dest_pc}
+
 
 ### --- Config --- ###
 
 @app.post("/config/{dest_pc}", tags=["config"])
 async def write_config(dest_pc: str, config: dict[str, Any]):
     """Write a config to the database for a specific client."""
-    message_db[dest_pc].config = config
+    await replace_config(dest_pc, config)
+    push_update(dest_pc, "config", config)
     return {"message": "Config received.", "target": dest_pc}
 
-@app.get("/config/{dest_pc}", tags=["config"], dependencies=[Depends(verify_db_key)])
-async def read_config(dest_pc: str) -> dict[str, Any]:
-    """Read a config from the database for a specific client."""
-    if not message_db[dest_pc].config:
+@app.patch("/config/{dest_pc}", tags=["config"])
+async def patch_config(dest_pc: str, patch: dict[str, Any]) -> dict[str, Any]:
+    """
+    Update part of a client's config with a JSON merge patch (RFC 7386): keys in the patch are
+    set, keys set to null are removed, and nested objects are patched the same way.
+    """
+    def write() -> tuple[int, MessageStore]:
+        with message_db.edit(dest_pc, "config", "config_version", "version") as store:
+            prev_version = store.config_version
+            apply_merge_patch(store.config, patch)
+            store.config_version = store.touch()
+        return prev_version, store
+    prev_version, store = await run_db(write)
+    config_history.record(dest_pc, prev_version, store.config_version, patch)
+    active.config_changed(dest_pc, store.config)
+    push_update(dest_pc, "config", store.config)
+    changes.publish("config_patched", dest_pc, {"patch": patch, "config_version": store.config_version})
+    return {"message": "Config patched.", "target": dest_pc, "config_version": store.config_version}
+
+@app.get("/config/{dest_pc}", tags=["config"], dependencies=[Depends(verify_db_key)],
+         responses={304: {"description": "The config hasn't changed since the If-None-Match ETag."}})
+async def read_config(
+    request: Request,
+    dest_pc: str,
+    since_version: int | None = Query(None, description="Config version the client already has."),
+    if_none_match: str | None = Header(None),
+) -> dict[str, Any]:
+    """
+    Read a config from the database for a specific client. Send If-None-Match to get 304 when it's
+    unchanged. With `since_version`, the response is {"config_version": ..., "patch": ...}, a merge
+    patch that brings that version up to date, or {"config_version": ..., "config": ...} with the
+    whole config if the server no longer has the changes since then.
+    """
+    sweeper.touch(dest_pc)
+    store = await run_db(message_db.get, dest_pc)
+    if not store.config:
         raise HTTPException(status_code=404, detail="No config found for this client PC.")
-    return message_db[dest_pc].config
+    headers = {"ETag": config_etag(store), "X-Config-Version": str(store.config_version)}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if since_version is None:
+        return negotiate(request, store.config, headers=headers)
+    patch = config_history.diff(dest_pc, since_version, store.config_version)
+    if patch is None:
+        return negotiate(request, {"config_version": store.config_version, "config": store.config}, headers=headers)
+    return negotiate(request, {"config_version": store.config_version, "patch": patch}, headers=headers)
 
 @app.delete("/config/{dest_pc}", tags=["config"], dependencies=[Depends(verify_db_key)])
 async def delete_pc_config(dest_pc: str) -> dict[str, str]:
-    message_db[dest_pc].config.clear()
+    await replace_config(dest_pc, {})
+    push_update(dest_pc, "config", {})
     return {"message": "Config deleted.", "target": dest_pc}
 
 @app.get("/config", tags=["config"])
-async def get_all_configs() -> dict[str, dict[str, Any]]:
+async def get_all_configs(request: Request) -> dict[str, dict[str, Any]]:
     """Get all configs from the database."""
-    return {k: v.config for k,v in message_db.items() if len(v.config) > 0}
+    if message_db.shared:
+        return negotiate(request, {k: v.config for k,v in await run_db(message_db.items) if len(v.config) > 0})
+    if accepts_msgpack(request.headers.get("accept")):
+        return negotiate(request, active.configs)
+    return Response(active.configs_json(), media_type="application/json", headers={"Vary": "Accept"})
 
 @app.delete("/config", tags=["config"])
 async def delete_all_configs() -> dict[str, str]:
-    for pc in message_db:
-        message_db[pc].config = {}
+    for pc, store in await run_db(message_db.items):
+        if store.config:
+            await replace_config(pc, {})
+            push_update(pc, "config", {})
     return {"message": "All configs deleted."}
 
 
+### --- Blobs --- ###
+
+def blob_headers(blob) -> dict[str, str]:
+    return {"X-Dtype": blob.dtype, "X-Shape": ",".join(map(str, blob.shape)), "ETag": f'"{blob.version}"'}
+
+@app.post("/blob/{dest_pc}/{name}", tags=["blobs"])
+async def write_blob(
+    dest_pc: str,
+    name: str,
+    request: Request,
+    x_dtype: str = Header(..., description="Element type, e.g. float32 or int16 (little-endian)."),
+    x_shape: str = Header(..., description="Comma-separated dimensions, e.g. 1000,3."),
+) -> dict[str, Any]:
+    """
+    Attach a numeric array to a client PC. The body is the raw array bytes (C order), stored
+    once as they are and served back without re-encoding. Large blobs are kept in a
+    memory-mapped file instead of the server's memory.
+    """
+    try:
+        shape = parse_shape(x_shape)
+        if blob_nbytes(x_dtype, shape) > settings.blobs.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Blobs are limited to {settings.blobs.max_bytes} bytes.")
+        blob = await blob_store.put(dest_pc, name, x_dtype, shape, request.stream())
+    except BlobError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    changes.publish("blob_stored", dest_pc, {"name": name, **blob.info()})
+    return {"message": "Blob received.", "target": dest_pc, "name": name, **blob.info()}
+
+@app.get("/blob/{dest_pc}", tags=["blobs"])
+async def list_blobs(dest_pc: str) -> dict[str, dict[str, Any]]:
+    """Show the dtype, shape and size of every blob of a client PC."""
+    blobs = blob_store.blobs.get(dest_pc)
+    if not blobs:
+        raise HTTPException(status_code=404, detail="No blobs found for this client PC.")
+    return {name: blob.info() for name, blob in blobs.items()}
+
+@app.get("/blob/{dest_pc}/{name}", tags=["blobs"], response_class=Response,
+         responses={200: {"content": {"application/octet-stream": {}}},
+                    304: {"description": "The blob hasn't changed since the If-None-Match ETag."}})
+async def read_blob(dest_pc: str, name: str, if_none_match: str | None = Header(None)) -> Response:
+    """Download a blob as raw bytes. Its dtype and shape come back in the X-Dtype and X-Shape headers."""
+    sweeper.touch(dest_pc)
+    blob = blob_store.get(dest_pc, name)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Blob not found.")
+    headers = blob_headers(blob)
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(blob.data, media_type="application/octet-stream", headers=headers)
+
+@app.delete("/blob/{dest_pc}/{name}", tags=["blobs"])
+async def delete_blob(dest_pc: str, name: str) -> dict[str, str]:
+    if not blob_store.delete(dest_pc, name):
+        raise HTTPException(status_code=404, detail="Blob not found.")
+    changes.publish("blob_deleted", dest_pc, {"name": name})
+    return {"message": "Blob deleted.", "target": dest_pc, "name": name}
+
+
+### --- WebSocket --- ###
+
+@app.websocket("/ws/{dest_pc}")
+async def message_socket(websocket: WebSocket, dest_pc: str):
+    """Push every new message and config for a client PC as soon as it is written."""
+    await websocket.accept()
+    sub = pubsub.subscribe(dest_pc)
+    
+    async def send_updates():
+        while True:
+            payload = await sub.queue.get()
+            await websocket.send_text(payload)
+    
+    try:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(send_updates)
+            # nothing is expected from the client, just wait for it to go away
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+            tg.cancel_scope.cancel()
+    finally:
+        pubsub.unsubscribe(dest_pc, sub)
+
+
+### --- Events --- ###
+
+@app.get("/events", tags=["events"], response_class=StreamingResponse)
+async def stream_events(last_event_id: str | None = Header(None)) -> StreamingResponse:
+    """
+    Server-Sent Events stream of incremental changes (messages posted/read, configs changed, 
+    stores deleted). Reconnecting clients resume from their Last-Event-ID. If the changes they
+    missed are no longer available, a 'reset' event tells them to reload the full database.
+    """
+    try:
+        last_seq = int(last_event_id) if last_event_id is not None else changes.seq
+    except ValueError:
+        last_seq = changes.seq
+    
+    async def event_stream():
+        nonlocal last_seq
+        while True:
+            # also while connected: a client that falls behind the backlog has to reload too
+            if not changes.can_resume(last_seq):
+                last_seq = changes.seq
+                yield format_sse(last_seq, "reset", "{}")
+            for seq, frame in changes.since(last_seq):
+                last_seq = seq
+                yield frame
+            if not await changes.wait(last_seq, settings.event_keepalive_secs):
+                yield ": keepalive\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 ### --- Database --- ###
 
 @app.get("/db", tags=["database"])
-async def read_db_all() -> dict[str, MessageStore]:
-    """Show the entire database."""
-    return message_db
+async def read_db_all(query: HistoryQuery = Depends()) -> dict[str, MessageStore]:
+    """
+    Show the entire database. With pagination or filters, each store only lists the matching
+    messages of the page, and the cursor for the next page comes back in the X-Next-Cursor header.
+    """
+    if query.is_empty:
+        return FastJSONResponse(dict(await run_db(message_db.items)))
+    page, next_cursor = await run_db(query.scan)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    return FastJSONResponse({
+        pc: store.model_copy(update={"messages": MessageHistory(found, maxlen=max(len(found), 1))})
+        for pc, store, found in page
+    }, headers=headers)
 
 @app.get("/db/{dest_pc}", tags=["database"], dependencies=[Depends(verify_db_key)])
 async def read_pc_db(dest_pc: str) -> MessageStore:
     """Show the database for a specific client."""
-    return message_db[dest_pc]
+    return FastJSONResponse(await run_db(message_db.get, dest_pc))
 
 @app.delete("/db/{dest_pc}", tags=["database"], dependencies=[Depends(verify_db_key)])
 async def delete_pc_db(dest_pc: str) -> dict[str, str]:
     """Show the database for a specific client."""
-    del message_db[dest_pc]
+    await run_db(message_db.delete, dest_pc)
+    forget_store(dest_pc)
     return {"message": "Database deleted for target client.", "target": dest_pc}
 
 @app.delete("/db", tags=["database"])
 async def delete_db() -> dict[str, str]:
-    message_db.clear()
-    return {"message": "Database deleted."}
\ No newline at end of file
+    for pc in await run_db(message_db.keys):
+        changes.publish("store_deleted", pc)
+    await run_db(message_db.clear)
+    blob_store.clear()
+    config_history.clear()
+    active.rebuild(())
+    queues.clear()
+    return {"message": "Database deleted."}
+
+### --- Metrics --- ###
+
+@app.get("/metrics", tags=["metrics"])
+async def read_metrics() -> Response:
+    """Request, message and memory metrics in the Prometheus text format."""
+    blob_bytes = {pc: sum(blob.nbytes for blob in blobs.values()) for pc, blobs in blob_store.blobs.items()}
+    lines = [*metrics.render(), *render_store_metrics(await run_db(message_db.items), blob_bytes)]
+    return Response("\n".join(lines) + "\n", media_type=METRICS_CONTENT_TYPE)
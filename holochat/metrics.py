@@ -0,0 +1,167 @@
+import bisect
+import sys
+import time
+from typing import Any, Iterable
+
+from .models import MessageStore
+
+
+# request latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+READ_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels: Any) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + '}'
+
+
+class Histogram:
+    """Prometheus-style histogram over fixed buckets. The counts are allocated once, up front."""
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # one count per bucket, plus one for +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def render(self, name: str, **labels: Any) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}'
+        yield f'{name}_sum{_labels(**labels)} {self.sum}'
+        yield f'{name}_count{_labels(**labels)} {cumulative}'
+
+
+class RouteStats:
+    """Request counts by status and a latency histogram for one method of one route."""
+    __slots__ = ('statuses', 'latency')
+
+    def __init__(self):
+        self.statuses: dict[int, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+
+class Metrics:
+    """
+    Request metrics, by route template (not by raw path, so PC names don't multiply the series).
+    Everything runs on the event loop thread, so the counters are plain ints without locks.
+    """
+    def __init__(self):
+        self.routes: dict[str, dict[str, RouteStats]] = {}
+        self.started = time.time()
+
+    def stats(self, path: str, method: str) -> RouteStats:
+        methods = self.routes.get(path)
+        if methods is None:
+            methods = self.routes[path] = {}
+        stats = methods.get(method)
+        if stats is None:
+            # only the first request of a route and method allocates anything
+            stats = methods[method] = RouteStats()
+        return stats
+
+    def render(self) -> Iterable[str]:
+        yield '# HELP holochat_requests_total Requests handled, by route and status code.'
+        yield '# TYPE holochat_requests_total counter'
+        for path, methods in self.routes.items():
+            for method, stats in methods.items():
+                for status, count in stats.statuses.items():
+                    yield f'holochat_requests_total{_labels(method=method, route=path, status=status)} {count}'
+        yield '# HELP holochat_request_duration_seconds Request latency, by route.'
+        yield '# TYPE holochat_request_duration_seconds histogram'
+        for path, methods in self.routes.items():
+            for method, stats in methods.items():
+                yield from stats.latency.render('holochat_request_duration_seconds', method=method, route=path)
+        yield '# HELP holochat_uptime_seconds Time since the server started.'
+        yield '# TYPE holochat_uptime_seconds gauge'
+        yield f'holochat_uptime_seconds {time.time() - self.started}'
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request into Metrics."""
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # unmatched paths share one series, so random URLs can't blow up the metrics
+            stats = self.metrics.stats(route.path if route is not None else "<unmatched>", scope["method"])
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.latency.observe(time.perf_counter() - start)
+
+
+def _nbytes(obj: Any) -> int:
+    """Rough deep size of a JSON-like value."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_nbytes(k) + _nbytes(v) for k, v in obj.items())
+    elif isinstance(obj, list):
+        size += sum(_nbytes(v) for v in obj)
+    return size
+
+def _record_nbytes(record) -> int:
+    return (sys.getsizeof(record) + sys.getsizeof(record.message) + sys.getsizeof(record.sender)
+            + sys.getsizeof(record.target) + 2 * sys.getsizeof(record.recv_time))
+
+def store_nbytes(store: MessageStore) -> int:
+    """Approximate memory footprint of a store: its records, their strings and its config."""
+    size = sys.getsizeof(store) + _nbytes(store.config)
+    if store.current is not None:
+        size += _record_nbytes(store.current)
+    return size + sum(_record_nbytes(m) for m in store.messages)
+
+def render_store_metrics(items: Iterable[tuple[str, MessageStore]], blob_nbytes: dict[str, int]) -> Iterable[str]:
+    """Gauges computed from the database at scrape time."""
+    items = list(items)
+    read_counts = Histogram(READ_COUNT_BUCKETS)
+    for _, store in items:
+        if store.current is not None:
+            read_counts.observe(store.current.read_count)
+    yield '# HELP holochat_messages Messages in the history of each client PC.'
+    yield '# TYPE holochat_messages gauge'
+    for dest_pc, store in items:
+        yield f'holochat_messages{_labels(dest_pc=dest_pc)} {len(store.messages)}'
+    yield '# HELP holochat_current_message_reads Read counts of the current messages.'
+    yield '# TYPE holochat_current_message_reads histogram'
+    yield from read_counts.render('holochat_current_message_reads')
+    yield '# HELP holochat_store_bytes Approximate memory used by the store of each client PC.'
+    yield '# TYPE holochat_store_bytes gauge'
+    for dest_pc, store in items:
+        yield f'holochat_store_bytes{_labels(dest_pc=dest_pc)} {store_nbytes(store)}'
+    yield '# HELP holochat_blob_bytes Bytes of blob data held for each client PC.'
+    yield '# TYPE holochat_blob_bytes gauge'
+    for dest_pc, nbytes in blob_nbytes.items():
+        yield f'holochat_blob_bytes{_labels(dest_pc=dest_pc)} {nbytes}'
@@ -1,13 +1,16 @@
+import bisect
+import time
 from datetime import datetime
 from enum import Enum
 from typing import Any
 
-from pydantic import BaseModel, Field, computed_field
+from pydantic import BaseModel, Field, GetCoreSchemaHandler, GetJsonSchemaHandler, TypeAdapter, computed_field
+from pydantic_core import core_schema
 
-from .settings import load_settings
+from .settings import get_settings
 
 
-settings = load_settings()
+settings = get_settings()
 
 def time_diff_seconds(start: datetime, end: datetime) -> float:
     return (end - start).total_seconds()
@@ -27,11 +30,21 @@ class MessageContent(BaseModel):
     message: str
     sender: str = 'unknown'
 
+class BatchMessage(MessageContent):
+    """One item of a batch POST: a message plus the PC (or target group) it goes to."""
+    target: str
+
+class QueueAck(BaseModel):
+    """Acknowledgement of queued messages, by seq, from one consumer."""
+    consumer: str
+    seqs: list[int]
+
 class MessageHold(BaseModel):
     """The message that is held in the server, until a first GET request is made."""
     message: str
     sender: str
     target: str
+    msg_id: int = 0
     recv_time: datetime = Field(default_factory=datetime.now)
     message_freshness: MessageStaleness = MessageStaleness.NONE
     message_status: MessageStatus = MessageStatus.NEW
@@ -41,6 +54,7 @@ class MessageRequest(BaseModel):
     message: str
     sender: str
     target: str
+    msg_id: int = 0
     recv_time: datetime
     request_time: datetime = Field(default_factory=datetime.now)
     read_count: int = 0
@@ -55,12 +69,7 @@ class MessageRequest(BaseModel):
     @property
     def message_freshness(self) -> MessageStaleness:
         """Calculated message freshness based on age in seconds."""
-        if self.message_age_secs < settings.message_stale_secs:
-            return MessageStaleness.FRESH
-        elif self.message_age_secs < settings.message_expire_secs:
-            return MessageStaleness.STALE
-        else:
-            return MessageStaleness.EXPIRED
+        return freshness_from_age(self.message_age_secs)
         
     @computed_field
     @property
@@ -71,12 +80,215 @@ class MessageRequest(BaseModel):
         else:
             return MessageStatus.READ
         
+def freshness_from_age(age_secs: float) -> MessageStaleness:
+    """Message freshness based on age in seconds."""
+    if age_secs < settings.message_stale_secs:
+        return MessageStaleness.FRESH
+    elif age_secs < settings.message_expire_secs:
+        return MessageStaleness.STALE
+    else:
+        return MessageStaleness.EXPIRED
+
+class MessageRecord:
+    """
+    Compact internal message, mutated in place when it is read. MessageHold and MessageRequest
+    describe what it looks like at the API boundary: a record serializes as a MessageHold until
+    its first read (request_time is None), and as a MessageRequest afterwards.
+    """
+    __slots__ = ('message', 'sender', 'target', 'msg_id', 'recv_time', 'request_time', 'read_count')
+    
+    def __init__(self, message: str, sender: str, target: str, msg_id: int = 0, 
+                 recv_time: datetime | None = None, request_time: datetime | None = None, 
+                 read_count: int = 0):
+        self.message = message
+        self.sender = sender
+        self.target = target
+        self.msg_id = msg_id
+        self.recv_time = recv_time or datetime.now()
+        self.request_time = request_time
+        self.read_count = read_count
+        
+    def copy(self) -> 'MessageRecord':
+        return MessageRecord(self.message, self.sender, self.target, self.msg_id, 
+                             self.recv_time, self.request_time, self.read_count)
+        
+    def mark_read(self):
+        """Count a GET request. The first one just moves the message from held to requested."""
+        if self.request_time is not None:
+            self.read_count += 1
+        self.request_time = datetime.now()
+        
+    def held_dict(self) -> dict[str, Any]:
+        """JSON-ready dict shaped like a MessageHold."""
+        return {
+            "message": self.message,
+            "sender": self.sender,
+            "target": self.target,
+            "msg_id": self.msg_id,
+            "recv_time": self.recv_time.isoformat(),
+            "message_freshness": MessageStaleness.NONE.value,
+            "message_status": MessageStatus.NEW.value,
+        }
+        
+    def request_dict(self, request_time: datetime | None = None) -> dict[str, Any]:
+        """JSON-ready dict shaped like a MessageRequest, as of request_time (default: the last read)."""
+        request_time = request_time or self.request_time
+        age_secs = time_diff_seconds(self.recv_time, request_time)
+        return {
+            "message": self.message,
+            "sender": self.sender,
+            "target": self.target,
+            "msg_id": self.msg_id,
+            "recv_time": self.recv_time.isoformat(),
+            "request_time": request_time.isoformat(),
+            "read_count": self.read_count,
+            "message_age_secs": age_secs,
+            "message_freshness": freshness_from_age(age_secs).value,
+            "message_status": (MessageStatus.NEW if self.read_count == 0 else MessageStatus.READ).value,
+        }
+        
+    def to_dict(self) -> dict[str, Any]:
+        if self.request_time is None:
+            return self.held_dict()
+        return self.request_dict()
+    
+    @classmethod
+    def validate(cls, value: Any) -> 'MessageRecord':
+        """Build a record from a MessageHold/MessageRequest (or a dict of one)."""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            if value.get("request_time") is not None:
+                value = MessageRequest.model_validate(value)
+            else:
+                value = MessageHold.model_validate(value)
+        if isinstance(value, MessageRequest):
+            return cls(value.message, value.sender, value.target, value.msg_id, 
+                       value.recv_time, value.request_time, value.read_count)
+        if isinstance(value, MessageHold):
+            return cls(value.message, value.sender, value.target, value.msg_id, value.recv_time)
+        raise ValueError(f"Can't make a message record from {type(value).__name__}.")
+    
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(cls.to_dict),
+        )
+        
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema: core_schema.CoreSchema, handler: GetJsonSchemaHandler):
+        return handler(core_schema.union_schema([
+            MessageRequest.__pydantic_core_schema__, 
+            MessageHold.__pydantic_core_schema__,
+        ]))
+        
+class MessageHistory:
+    """
+    Fixed-capacity ring buffer of message records, oldest first. Capacity comes from the
+    message_history_len setting. Records arrive in recv_time and msg_id order, so both work as
+    a sorted index: range lookups are binary searches over O(1) indexing.
+    """
+    __slots__ = ('_buf', '_start', 'maxlen')
+    
+    def __init__(self, records=(), maxlen: int | None = None):
+        self.maxlen = settings.message_history_len if maxlen is None else maxlen
+        self._buf: list[MessageRecord] = []
+        self._start = 0
+        self.extend(records)
+        
+    def append(self, record: MessageRecord):
+        if self.maxlen == 0:
+            # history turned off, like a deque(maxlen=0)
+            return
+        if len(self._buf) < self.maxlen:
+            self._buf.append(record)
+        else:
+            # full: overwrite the oldest record
+            self._buf[self._start] = record
+            self._start = (self._start + 1) % self.maxlen
+            
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+            
+    def clear(self):
+        self._buf = []
+        self._start = 0
+        
+    def __len__(self) -> int:
+        return len(self._buf)
+    
+    def __getitem__(self, i: int) -> MessageRecord:
+        n = len(self._buf)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('message history index out of range')
+        return self._buf[(self._start + i) % n]
+    
+    def __iter__(self):
+        return iter(self._buf[self._start:] + self._buf[:self._start])
+    
+    def __reversed__(self):
+        return (self[i] for i in range(len(self) - 1, -1, -1))
+    
+    def time_range(self, since: datetime | None = None, until: datetime | None = None) -> tuple[int, int]:
+        """Index range [lo, hi) of the records received between since and until (inclusive)."""
+        lo = 0 if since is None else bisect.bisect_left(self, since, key=lambda m: m.recv_time)
+        hi = len(self) if until is None else bisect.bisect_right(self, until, key=lambda m: m.recv_time)
+        return lo, max(lo, hi)
+    
+    def trim_before(self, cutoff: datetime) -> int:
+        """Drop the records received before cutoff. Returns how many were dropped."""
+        n, _ = self.time_range(cutoff)
+        if n:
+            self._buf = list(self)[n:]
+            self._start = 0
+        return n
+    
+    def index_after(self, msg_id: int) -> int:
+        """Index of the first record newer than msg_id."""
+        return bisect.bisect_right(self, msg_id, key=lambda m: m.msg_id)
+    
+    @classmethod
+    def validate(cls, value: Any) -> 'MessageHistory':
+        if isinstance(value, cls):
+            return value
+        return cls(_record_list.validate_python(value))
+    
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda history: [m.to_dict() for m in history]
+            ),
+        )
+        
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema: core_schema.CoreSchema, handler: GetJsonSchemaHandler):
+        return handler(_record_list.core_schema)
+    
+_record_list = TypeAdapter(list[MessageRecord])
+        
 class MessageStore(BaseModel):
-    messages: list[MessageContent | MessageHold | MessageRequest] = []
+    current: MessageRecord | None = None
+    messages: MessageHistory = Field(default_factory=MessageHistory)
     config: dict[str, Any] = {}
+    # the store version at the last config change
+    config_version: int = 0
+    last_msg_id: int = 0
+    # starts at the creation time so a deleted and recreated store never reuses a version
+    version: int = Field(default_factory=time.time_ns)
+    
+    def touch(self) -> int:
+        """Bump the version after the current message, history or config changed. Reads don't count."""
+        self.version += 1
+        return self.version
     
     @computed_field
     @property
     def message_count(self) -> int:
-        """Returns the total number of messages in the database."""
+        """Returns the number of messages in the message history."""
         return len(self.messages)
\ No newline at end of file
@@ -0,0 +1,73 @@
+from collections import defaultdict, deque
+from typing import Any
+
+
+def apply_merge_patch(target: dict[str, Any], patch: dict[str, Any]) -> dict[str, Any]:
+    """Apply an RFC 7386 JSON merge patch to target, in place. null deletes a key."""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            current = target.get(key)
+            if not isinstance(current, dict):
+                # nested objects are rebuilt, so the config never shares dicts with the patch
+                current = target[key] = {}
+            apply_merge_patch(current, value)
+        else:
+            target[key] = value
+    return target
+
+def compose_merge_patches(first: dict[str, Any], second: dict[str, Any]) -> dict[str, Any] | None:
+    """
+    One merge patch with the effect of applying first, then second. Returns None when that can't
+    be written as a merge patch: an object in second landing on a value first replaced.
+    """
+    out = dict(first)
+    for key, value in second.items():
+        if isinstance(value, dict) and key in out:
+            if not isinstance(out[key], dict):
+                return None
+            value = compose_merge_patches(out[key], value)
+            if value is None:
+                return None
+        out[key] = value
+    return out
+
+
+class ConfigHistory:
+    """
+    The last few changes to each PC's config as merge patches, so a client can catch up with a
+    diff instead of refetching the whole config. Each change links the config version before it
+    to the one after it; full replacements are recorded as None, and no diff can cross them.
+    """
+    def __init__(self, maxlen: int = 100):
+        self.maxlen = maxlen
+        self.changes: defaultdict[str, deque[tuple[int, int, dict[str, Any] | None]]] = defaultdict(
+            lambda: deque(maxlen=self.maxlen))
+
+    def record(self, dest_pc: str, prev_version: int, version: int, patch: dict[str, Any] | None):
+        self.changes[dest_pc].append((prev_version, version, patch))
+
+    def diff(self, dest_pc: str, since_version: int, version: int) -> dict[str, Any] | None:
+        """A merge patch from since_version to version, or None if the history doesn't cover it."""
+        if since_version == version:
+            return {}
+        out = {}
+        at_version = since_version
+        for prev_version, change_version, patch in self.changes.get(dest_pc, ()):
+            if prev_version != at_version:
+                continue
+            if patch is None:
+                return None
+            out = compose_merge_patches(out, patch)
+            if out is None:
+                return None
+            at_version = change_version
+        # the chain breaks if a change was made elsewhere (another worker, before a restart)
+        return out if at_version == version else None
+
+    def discard(self, dest_pc: str):
+        self.changes.pop(dest_pc, None)
+
+    def clear(self):
+        self.changes.clear()
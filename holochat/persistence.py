@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Literal, MutableMapping
+
+from .models import MessageRecord, MessageStore
+from .patch import apply_merge_patch
+
+
+LOG_FNAME = 'holochat_wal.jsonl'
+SNAPSHOT_FNAME = 'holochat_snapshot.json'
+
+
+def apply_change(db: MutableMapping[str, MessageStore], record: dict[str, Any]):
+    """Replay a single change record (as published on the change feed) onto the database."""
+    event, dest_pc, data = record["event"], record["target"], record["data"]
+
+    if event == "message_posted":
+        msg = MessageRecord.validate(data)
+        store = db[dest_pc]
+        store.current = msg
+        store.messages.append(msg.copy())
+        store.last_msg_id = msg.msg_id
+        store.touch()
+
+    elif event == "message_read":
+        store = db.get(dest_pc)
+        if store is not None and store.current is not None and store.current.msg_id == data["msg_id"]:
+            store.current.read_count = data["read_count"]
+            store.current.request_time = datetime.fromisoformat(data["request_time"])
+
+    elif event == "message_expired":
+        store = db.get(dest_pc)
+        if store is not None and store.current is not None and store.current.msg_id == data["msg_id"]:
+            store.current = None
+            store.touch()
+
+    elif event == "history_trimmed":
+        if dest_pc in db:
+            db[dest_pc].messages.trim_before(datetime.fromisoformat(data["before"]))
+            db[dest_pc].touch()
+
+    elif event == "messages_deleted":
+        if dest_pc in db:
+            db[dest_pc].current = None
+            db[dest_pc].messages.clear()
+            db[dest_pc].touch()
+
+    elif event == "config_changed":
+        store = db[dest_pc]
+        if data.keys() == {"config", "config_version"}:
+            store.config = data["config"]
+            store.touch()
+            store.config_version = data["config_version"]
+        else:
+            # logs written before config_version was recorded hold just the config
+            store.config = data
+            store.config_version = store.touch()
+
+    elif event == "config_patched":
+        store = db[dest_pc]
+        apply_merge_patch(store.config, data["patch"])
+        store.touch()
+        store.config_version = data["config_version"]
+
+    elif event == "store_loaded":
+        db[dest_pc] = MessageStore.model_validate(data)
+
+    elif event == "store_deleted":
+        db.pop(dest_pc, None)
+
+
+class WriteAheadLog:
+    """
+    Append-only log of database changes, periodically compacted into a snapshot. Records are
+    queued without any I/O and group-committed to disk from a background task, so request
+    handlers never wait on the disk.
+    """
+    def __init__(self, db: MutableMapping[str, MessageStore], data_dir: str | Path,
+                 durability: Literal['flush', 'fsync'] = 'fsync', commit_interval_ms: int | float = 5,
+                 compact_every: int = 10000):
+        self.db = db
+        self.data_dir = Path(data_dir)
+        self.log_path = self.data_dir / LOG_FNAME
+        self.snapshot_path = self.data_dir / SNAPSHOT_FNAME
+        self.durability = durability
+        self.commit_interval = commit_interval_ms / 1000
+        self.compact_every = compact_every
+
+        self.pending: list[str] = []
+        self.last_seq = 0
+        self.records_since_snapshot = 0
+        self._file = None
+        self._writer: asyncio.Task | None = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+    def recover(self) -> int:
+        """Rebuild the database from the snapshot plus the log. Returns the last sequence id."""
+        snapshot_seq = 0
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            for dest_pc, store in snapshot["stores"].items():
+                self.db[dest_pc] = MessageStore.model_validate(store)
+
+        self.last_seq = snapshot_seq
+        if self.log_path.exists():
+            valid_bytes = 0
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn write at the tail of the log, everything after it is lost anyway
+                        break
+                    valid_bytes += len(line)
+                    if record["seq"] <= snapshot_seq:
+                        continue
+                    apply_change(self.db, record)
+                    self.last_seq = record["seq"]
+                    self.records_since_snapshot += 1
+            # cut off the torn tail so new records don't get glued onto it
+            if valid_bytes < self.log_path.stat().st_size:
+                os.truncate(self.log_path, valid_bytes)
+        return self.last_seq
+
+    def start(self):
+        """Open the log and start the background writer."""
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.log_path, 'a')
+        self._closing = False
+        self._writer = asyncio.create_task(self.run())
+
+    def append(self, seq: int, record: str):
+        """Queue a change record for the next group commit. Does no I/O."""
+        self.pending.append(record)
+        self.last_seq = seq
+        self._wakeup.set()
+
+    async def run(self):
+        """Background task: commit queued records in groups and compact the log when it gets long."""
+        while True:
+            await self._wakeup.wait()
+            if self._closing:
+                return
+            # give concurrent requests a moment to add to the same group
+            await asyncio.sleep(self.commit_interval)
+            self._wakeup.clear()
+            await self.commit()
+            if self.records_since_snapshot >= self.compact_every:
+                await self.compact()
+
+    async def commit(self):
+        """Write every queued record in one go."""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.records_since_snapshot += len(batch)
+        await asyncio.to_thread(self._write, '\n'.join(batch) + '\n')
+
+    def _write(self, data: str):
+        self._file.write(data)
+        self._file.flush()
+        if self.durability == 'fsync':
+            os.fsync(self._file.fileno())
+
+    async def compact(self):
+        """Save the whole database as a snapshot, then start a fresh log."""
+        await self.commit()
+        # dump in the event loop so the snapshot is consistent with last_seq
+        snapshot = json.dumps({
+            "seq": self.last_seq,
+            "stores": {pc: store.model_dump(mode="json") for pc, store in self.db.items()},
+        })
+        await asyncio.to_thread(self._write_snapshot, snapshot)
+        self.records_since_snapshot = 0
+
+    def _write_snapshot(self, snapshot: str):
+        tmp_path = self.snapshot_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # every record in the log is now covered by the snapshot
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def close(self):
+        """Stop the background writer, then compact so the next startup only reads a snapshot."""
+        self._closing = True
+        self._wakeup.set()
+        await self._writer
+        await self.compact()
+        self._file.close()
+        self._file = None
@@ -0,0 +1,44 @@
+import asyncio
+from collections import defaultdict
+
+
+class Subscriber:
+    """A single push client with its own bounded send queue."""
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, payload: str):
+        """Queue a payload without blocking. If the client has fallen behind, drop its oldest payload."""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(payload)
+
+
+class PubSub:
+    """Fan-out of pre-serialized payloads to the subscribers of each destination PC."""
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers: defaultdict[str, set[Subscriber]] = defaultdict(set)
+
+    def subscribe(self, dest_pc: str) -> Subscriber:
+        sub = Subscriber(self.queue_size)
+        self.subscribers[dest_pc].add(sub)
+        return sub
+
+    def unsubscribe(self, dest_pc: str, sub: Subscriber):
+        subs = self.subscribers.get(dest_pc)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self.subscribers[dest_pc]
+
+    def has_subscribers(self, dest_pc: str) -> bool:
+        return dest_pc in self.subscribers
+
+    def publish(self, dest_pc: str, payload: str):
+        """Hand the payload to every subscriber of the target PC. Never awaits."""
+        for sub in self.subscribers.get(dest_pc, ()):
+            sub.offer(payload)
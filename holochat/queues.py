@@ -0,0 +1,205 @@
+from typing import Any, Iterable
+
+from .models import MessageRecord
+
+
+class Consumer:
+    """Where one consumer is in a queue, and what it was sent but hasn't acked yet."""
+    __slots__ = ('offset', 'inflight', 'dropped')
+
+    def __init__(self, offset: int):
+        # seq of the next message to deliver for the first time
+        self.offset = offset
+        # seq -> (redelivery deadline, deliveries so far). Every delivery gets the same ack
+        # timeout and goes to the end, so the dict is in deadline order: the first item is the
+        # next one due. That's why the timeout can't change while anything is in flight
+        self.inflight: dict[int, tuple[float, int]] = {}
+        # messages trimmed (max_len) before this consumer got them
+        self.dropped = 0
+
+    def low_seq(self) -> int:
+        """The oldest seq this consumer may still need."""
+        return min(self.inflight, default=self.offset)
+
+
+class MessageQueue:
+    """
+    FIFO queue of the messages posted to one client PC. Every consumer reads the whole queue in
+    order at its own offset, and acks what it got; messages not acked within ack_timeout are
+    delivered again. Messages are kept in a list with a moving head, so a delivery is an index
+    and trimming the head is amortized O(1), however deep the backlog.
+    """
+    def __init__(self, ack_timeout: float = 30, max_len: int = 100_000):
+        self.ack_timeout = ack_timeout
+        self.max_len = max_len
+        self._items: list[MessageRecord] = []
+        self._start = 0
+        # seq of the message at _items[_start]
+        self.head_seq = 0
+        self.consumers: dict[str, Consumer] = {}
+
+    def __len__(self) -> int:
+        return len(self._items) - self._start
+
+    @property
+    def next_seq(self) -> int:
+        return self.head_seq + len(self)
+
+    def append(self, record: MessageRecord) -> int:
+        seq = self.next_seq
+        self._items.append(record)
+        if len(self) > self.max_len:
+            self._drop_head(1)
+        return seq
+
+    def _drop_head(self, count: int):
+        self._start += count
+        self.head_seq += count
+        # compact once the dead prefix outweighs the live part
+        if self._start > 1024 and self._start * 2 > len(self._items):
+            del self._items[:self._start]
+            self._start = 0
+
+    def _get(self, seq: int) -> MessageRecord:
+        return self._items[self._start + seq - self.head_seq]
+
+    def _entry(self, seq: int, deliveries: int) -> dict[str, Any]:
+        record = self._get(seq)
+        return {"seq": seq, "deliveries": deliveries, "msg_id": record.msg_id, "message": record.message,
+                "sender": record.sender, "recv_time": record.recv_time.isoformat()}
+
+    def pop(self, consumer: str, now: float, max_count: int = 1) -> list[dict[str, Any]]:
+        """
+        Deliver up to max_count messages to a consumer: overdue unacked ones first, then new
+        ones in order. A new consumer starts at the oldest message still queued.
+        """
+        state = self.consumers.get(consumer)
+        if state is None:
+            state = self.consumers[consumer] = Consumer(self.head_seq)
+        out = []
+        inflight = state.inflight
+        while inflight and len(out) < max_count:
+            seq, (deadline, deliveries) = next(iter(inflight.items()))
+            if deadline > now:
+                break
+            del inflight[seq]
+            if seq < self.head_seq:
+                state.dropped += 1
+                continue
+            inflight[seq] = (now + self.ack_timeout, deliveries + 1)
+            out.append(self._entry(seq, deliveries + 1))
+        if state.offset < self.head_seq:
+            state.dropped += self.head_seq - state.offset
+            state.offset = self.head_seq
+        while len(out) < max_count and state.offset < self.next_seq:
+            seq = state.offset
+            state.offset += 1
+            inflight[seq] = (now + self.ack_timeout, 1)
+            out.append(self._entry(seq, 1))
+        return out
+
+    def ack(self, consumer: str, seqs: Iterable[int]) -> int:
+        """Mark messages as handled by a consumer. Returns how many were waiting for an ack."""
+        state = self.consumers.get(consumer)
+        if state is None:
+            return 0
+        acked = sum(state.inflight.pop(seq, None) is not None for seq in seqs)
+        if acked:
+            self._trim()
+        return acked
+
+    def _trim(self):
+        """Drop the messages every consumer is done with."""
+        low = min((state.low_seq() for state in self.consumers.values()), default=self.head_seq)
+        if low > self.head_seq:
+            self._drop_head(min(low, self.next_seq) - self.head_seq)
+
+    def has_ready(self, consumer: str, now: float) -> bool:
+        """Whether pop would deliver anything to this consumer right now."""
+        state = self.consumers.get(consumer)
+        if state is None:
+            return len(self) > 0
+        if state.offset < self.next_seq:
+            return True
+        return bool(state.inflight) and next(iter(state.inflight.values()))[0] <= now
+
+    def next_due(self, consumer: str) -> float | None:
+        """When this consumer's oldest unacked message comes due for redelivery, if it has any."""
+        state = self.consumers.get(consumer)
+        if state is None or not state.inflight:
+            return None
+        return next(iter(state.inflight.values()))[0]
+
+    def remove_consumer(self, consumer: str) -> bool:
+        removed = self.consumers.pop(consumer, None) is not None
+        if removed:
+            self._trim()
+        return removed
+
+    def clear(self):
+        """Drop every queued message. Consumers stay, and carry on with the next message posted."""
+        self._drop_head(len(self))
+        for state in self.consumers.values():
+            state.offset = self.head_seq
+            state.inflight.clear()
+
+    def info(self) -> dict[str, Any]:
+        return {
+            "length": len(self),
+            "head_seq": self.head_seq,
+            "next_seq": self.next_seq,
+            "ack_timeout": self.ack_timeout,
+            "consumers": {
+                name: {"offset": state.offset, "lag": self.next_seq - state.offset,
+                       "unacked": len(state.inflight), "dropped": state.dropped}
+                for name, state in self.consumers.items()
+            },
+        }
+
+
+class QueueRegistry:
+    """The queues of the client PCs in queue mode: those in the settings, plus any enabled at runtime."""
+    def __init__(self, pcs: Iterable[str] = (), ack_timeout: float = 30, max_len: int = 100_000):
+        self.configured = set(pcs)
+        self.ack_timeout = ack_timeout
+        self.max_len = max_len
+        self.queues: dict[str, MessageQueue] = {}
+
+    def get(self, dest_pc: str) -> MessageQueue | None:
+        queue = self.queues.get(dest_pc)
+        if queue is None and dest_pc in self.configured:
+            queue = self.enable(dest_pc)
+        return queue
+
+    def enable(self, dest_pc: str, ack_timeout: float | None = None) -> MessageQueue:
+        """
+        Put a PC in queue mode, or change the ack timeout of its queue. Raises ValueError for a new
+        timeout while messages wait for an ack, since their deadlines are kept in order.
+        """
+        queue = self.queues.get(dest_pc)
+        if queue is None:
+            queue = self.queues[dest_pc] = MessageQueue(self.ack_timeout, self.max_len)
+        if ack_timeout is not None and ack_timeout != queue.ack_timeout:
+            if any(state.inflight for state in queue.consumers.values()):
+                raise ValueError("The ack timeout can't change while messages are waiting for an ack.")
+            queue.ack_timeout = ack_timeout
+        return queue
+
+    def disable(self, dest_pc: str) -> bool:
+        self.configured.discard(dest_pc)
+        return self.queues.pop(dest_pc, None) is not None
+
+    def clear_messages(self, dest_pc: str):
+        """Empty a PC's queue, if it has one, e.g. when its messages are deleted."""
+        queue = self.queues.get(dest_pc)
+        if queue is not None:
+            queue.clear()
+
+    def discard(self, dest_pc: str):
+        """Drop a queue's contents and consumers, e.g. when its store is deleted. The PC stays in queue mode."""
+        queue = self.queues.get(dest_pc)
+        if queue is not None:
+            self.queues[dest_pc] = MessageQueue(queue.ack_timeout, queue.max_len)
+
+    def clear(self):
+        self.queues.clear()
@@ -1,5 +1,6 @@
 import json
 from pathlib import Path
+from typing import Literal
 
 from pydantic import BaseModel
 
@@ -16,10 +17,64 @@ class _ServerSettings(BaseModel):
     ip: str = '0.0.0.0'
     workers: int = 1
     
+class _PersistenceSettings(BaseModel):
+    enabled: bool = False
+    data_dir: str = 'holochat_data'
+    durability: Literal['flush', 'fsync'] = 'fsync'
+    commit_interval_ms: int | float = 5
+    compact_every: int = 10000
+    
+class _StoreSettings(BaseModel):
+    backend: Literal['memory', 'sqlite'] = 'memory'
+    sqlite_path: str = 'holochat.db'
+    poll_interval_ms: int | float = 50
+    
+class _BlobSettings(BaseModel):
+    spill_dir: str = 'holochat_blobs'
+    spill_bytes: int | None = 16 * 2**20
+    max_bytes: int = 512 * 2**20
+    
+class _TriggerSettings(BaseModel):
+    enabled: bool = False
+    host: str = '0.0.0.0'
+    tcp_port: int | None = 8001
+    udp_port: int | None = 8001
+    
+class _QueueSettings(BaseModel):
+    pcs: list[str] = []
+    ack_timeout_secs: int | float = 30
+    max_len: int = 100_000
+    
+class _RetentionPolicy(BaseModel):
+    evict_expired: bool = True
+    history_secs: int | float | None = None
+    idle_secs: int | float | None = None
+    
+class _SweeperSettings(BaseModel):
+    enabled: bool = False
+    slice_ms: int | float = 2
+    default: _RetentionPolicy = _RetentionPolicy()
+    pcs: dict[str, _RetentionPolicy] = {}
+    
 class MainSettings(BaseModel):
     message_stale_secs: int | float = 10
     message_expire_secs: int | float = 30
+    message_history_len: int = 100
+    config_history_len: int = 100
+    long_poll_max_secs: int | float = 60
+    ws_queue_size: int = 100
+    event_backlog: int = 1000
+    event_keepalive_secs: int | float = 15
+    target_groups: dict[str, list[str]] = {}
+    json_encoder: Literal['auto', 'orjson', 'pydantic', 'stdlib'] = 'auto'
+    metrics: bool = True
     server: _ServerSettings = _ServerSettings()    
+    store: _StoreSettings = _StoreSettings()
+    persistence: _PersistenceSettings = _PersistenceSettings()
+    blobs: _BlobSettings = _BlobSettings()
+    sweeper: _SweeperSettings = _SweeperSettings()
+    trigger: _TriggerSettings = _TriggerSettings()
+    queue: _QueueSettings = _QueueSettings()
     settings_file: str = '<pydantic>'
 
 
@@ -37,6 +92,15 @@ def load_settings() -> MainSettings:
         settings = MainSettings()
     return settings
 
+_settings: MainSettings | None = None
+
+def get_settings() -> MainSettings:
+    """The settings of this process: loaded on first use, then shared by everything that asks."""
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
+
 def save_settings(use_home: bool = False, overwrite: bool = False):
     """Generate a JSON config file for the main settings model."""
     if use_home:
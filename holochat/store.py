@@ -0,0 +1,207 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from .models import MessageStore
+
+
+class MemoryBackend(defaultdict[str, MessageStore]):
+    """
+    The default backend: a dict of MessageStores that lives in this process. Fastest, but every
+    uvicorn worker gets its own copy.
+    """
+    shared = False
+
+    def __init__(self):
+        super().__init__(MessageStore)
+
+    @contextmanager
+    def edit(self, dest_pc: str, *fields: str) -> Iterator[MessageStore]:
+        """Mutate the store of a client PC (created if missing). `fields` is only a hint here."""
+        yield self[dest_pc]
+
+    def put(self, dest_pc: str, store: MessageStore):
+        """Replace the whole store of a client PC."""
+        self[dest_pc] = store
+
+    def delete(self, dest_pc: str):
+        del self[dest_pc]
+
+
+class SqliteBackend:
+    """
+    Stores every MessageStore in a SQLite database in WAL mode, so that all uvicorn workers on
+    this machine share one database. Each field of a store is kept as its own JSON row with its
+    own version, so an edit only rewrites the fields it declares. Each process caches the parsed
+    stores and only re-parses the fields whose version has changed: counting a read rewrites
+    `current`, and leaves the history and config cached in every worker. Calls may come from
+    several threads of one worker; they take turns on its connection.
+    """
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        # pc -> (store version, version of each field, parsed store)
+        self._cache: dict[str, tuple[int, dict[str, int], MessageStore]] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # connections must not cross a fork, so each worker process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stores (pc TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS store_fields ("
+                "pc TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (pc, field)"
+                ") WITHOUT ROWID"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(store_fields)")}
+            if "version" not in columns:
+                # databases from before field versions
+                self._conn.execute("ALTER TABLE store_fields ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._pid = os.getpid()
+            self._cache.clear()
+        return self._conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't both read-modify-write
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _write(self, conn: sqlite3.Connection, dest_pc: str, data: dict[str, Any]) -> int:
+        """Write fields of a store under its next version. Returns the version."""
+        # a new store starts at the creation time, so a deleted and recreated one never reuses a version
+        version = conn.execute(
+            "INSERT INTO stores (pc, version) VALUES (?, ?) "
+            "ON CONFLICT (pc) DO UPDATE SET version = version + 1 RETURNING version",
+            (dest_pc, time.time_ns()),
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT OR REPLACE INTO store_fields (pc, field, value, version) VALUES (?, ?, ?, ?)",
+            [(dest_pc, field, json.dumps(value), version) for field, value in data.items()],
+        )
+        return version
+
+    def _load(self, dest_pc: str, version: int | None = None) -> MessageStore | None:
+        if version is None:
+            row = self.conn.execute("SELECT version FROM stores WHERE pc = ?", (dest_pc,)).fetchone()
+            if row is None:
+                self._cache.pop(dest_pc, None)
+                return None
+            version = row[0]
+        cached = self._cache.get(dest_pc)
+        if cached is not None and cached[0] == version:
+            return cached[2]
+        # something changed: find out which fields, and only parse those
+        versions = dict(self.conn.execute("SELECT field, version FROM store_fields WHERE pc = ?", (dest_pc,)))
+        stale = [field for field, v in versions.items() if cached is None or cached[1].get(field) != v]
+        rows = self.conn.execute(
+            f"SELECT field, value FROM store_fields WHERE pc = ? AND field IN ({', '.join('?' * len(stale))})",
+            (dest_pc, *stale),
+        )
+        loaded = MessageStore.model_validate({field: json.loads(value) for field, value in rows})
+        if cached is None:
+            store = loaded
+        else:
+            # the fields that didn't change keep their parsed objects
+            fields = {field: getattr(cached[2], field) for field in MessageStore.model_fields}
+            fields.update({field: getattr(loaded, field) for field in stale})
+            store = MessageStore.model_construct(**fields)
+        self._cache[dest_pc] = (version, versions, store)
+        return store
+
+    def __contains__(self, dest_pc: str) -> bool:
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM stores WHERE pc = ?", (dest_pc,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM stores").fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def get(self, dest_pc: str) -> MessageStore | None:
+        with self._lock:
+            return self._load(dest_pc)
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return [pc for (pc,) in self.conn.execute("SELECT pc FROM stores ORDER BY rowid")]
+
+    def items(self) -> list[tuple[str, MessageStore]]:
+        with self._lock:
+            versions = self.conn.execute("SELECT pc, version FROM stores ORDER BY rowid").fetchall()
+            return [(pc, self._load(pc, version)) for pc, version in versions]
+
+    @contextmanager
+    def edit(self, dest_pc: str, *fields: str) -> Iterator[MessageStore]:
+        """
+        Mutate the store of a client PC (created if missing) inside a write transaction, so edits
+        from different workers can't overwrite each other. Only the listed fields are written back;
+        with no fields given, the whole store is.
+        """
+        try:
+            with self._transaction() as conn:
+                store = self._load(dest_pc)
+                is_new = store is None
+                if is_new:
+                    store = MessageStore()
+                yield store
+                if is_new or not fields:
+                    fields = tuple(MessageStore.model_fields)
+                version = self._write(conn, dest_pc, store.model_dump(mode="json", include=set(fields)))
+                versions = {} if is_new else dict(self._cache[dest_pc][1])
+                versions.update(dict.fromkeys(fields, version))
+                self._cache[dest_pc] = (version, versions, store)
+        except BaseException:
+            # the cached object may be half-edited
+            self._cache.pop(dest_pc, None)
+            raise
+
+    def put(self, dest_pc: str, store: MessageStore):
+        """Replace the whole store of a client PC."""
+        data = store.model_dump(mode="json", include=set(MessageStore.model_fields))
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM store_fields WHERE pc = ?", (dest_pc,))
+            version = self._write(conn, dest_pc, data)
+            self._cache[dest_pc] = (version, dict.fromkeys(data, version), store)
+
+    def delete(self, dest_pc: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM store_fields WHERE pc = ?", (dest_pc,))
+            conn.execute("DELETE FROM stores WHERE pc = ?", (dest_pc,))
+            self._cache.pop(dest_pc, None)
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM store_fields")
+            conn.execute("DELETE FROM stores")
+            self._cache.clear()
+
+
+def open_backend(backend: str, sqlite_path: str) -> MemoryBackend | SqliteBackend:
+    """Create the store backend selected in the settings."""
+    if backend == 'sqlite':
+        return SqliteBackend(sqlite_path)
+    return MemoryBackend()
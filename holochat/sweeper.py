@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Literal
+
+from .models import MessageStore
+from .settings import _RetentionPolicy
+
+
+# changes made by the sweeper itself, which don't count as activity
+SWEEPER_EVENTS = {"message_expired", "history_trimmed"}
+
+
+async def _run_inline(fn: Callable[..., Any], *args) -> Any:
+    return fn(*args)
+
+
+class Sweeper:
+    """
+    Evicts expired messages, old history and idle stores in the background, following the
+    retention policy of each PC. Deadlines are kept in a min-heap, so a wakeup only looks at
+    what is due. Entries are checked against the live store when they come due, so nothing has
+    to be unscheduled when a store changes in the meantime. A store is idle when it was neither
+    changed nor read (see touch) for idle_secs. Store calls, including the eviction callbacks,
+    go through `run_db`, which can move them off the event loop for a backend that may block.
+    """
+    def __init__(
+        self,
+        db,
+        expire_secs: int | float,
+        expire_message: Callable[[str, int], None],
+        trim_history: Callable[[str, datetime], None],
+        drop_store: Callable[[str], None],
+        default_policy: _RetentionPolicy = _RetentionPolicy(),
+        policies: dict[str, _RetentionPolicy] | None = None,
+        slice_ms: int | float = 2,
+        run_db: Callable[..., Awaitable[Any]] = _run_inline,
+    ):
+        self.db = db
+        self.expire_secs = expire_secs
+        self.expire_message = expire_message
+        self.trim_history = trim_history
+        self.drop_store = drop_store
+        self.default_policy = default_policy
+        self.policies = policies or {}
+        self.slice_secs = slice_ms / 1000
+        self.run_db = run_db
+        # (deadline, tiebreak, kind, dest_pc, arg): arg is the msg_id of a 'message' entry, and
+        # the (last activity, store version) seen when an 'idle' entry was scheduled
+        self.heap: list[tuple[float, int, str, str, Any]] = []
+        # time.time() of the last change or read of each store the sweeper knows about
+        self.last_change: dict[str, float] = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def policy(self, dest_pc: str) -> _RetentionPolicy:
+        return self.policies.get(dest_pc, self.default_policy)
+
+    def push(self, deadline: float, kind: Literal['message', 'history', 'idle'], dest_pc: str, arg: Any = None):
+        if not self.heap or deadline < self.heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self.heap, (deadline, next(self._counter), kind, dest_pc, arg))
+
+    def _push_idle(self, dest_pc: str, store: MessageStore | None, since: float):
+        idle_secs = self.policy(dest_pc).idle_secs
+        if idle_secs is not None:
+            # the version catches changes this process hasn't seen, e.g. from another worker;
+            # None when it isn't known yet, which makes the entry look again before dropping
+            version = store.version if store is not None else None
+            self.push(max(since + idle_secs, time.time()), 'idle', dest_pc, (since, version))
+
+    def _push_history(self, dest_pc: str, store: MessageStore):
+        history_secs = self.policy(dest_pc).history_secs
+        if history_secs is not None and store.messages:
+            self.push(store.messages[0].recv_time.timestamp() + history_secs, 'history', dest_pc)
+
+    def _push_message(self, dest_pc: str, msg_id: int, recv_time: datetime):
+        policy = self.policy(dest_pc)
+        if policy.evict_expired:
+            self.push(recv_time.timestamp() + self.expire_secs, 'message', dest_pc, msg_id)
+        if policy.history_secs is not None:
+            self.push(recv_time.timestamp() + policy.history_secs, 'history', dest_pc)
+
+    def schedule_store(self, dest_pc: str, store: MessageStore):
+        """Schedule everything a store will need, e.g. after it was recovered or loaded."""
+        if store.current is not None:
+            self._push_message(dest_pc, store.current.msg_id, store.current.recv_time)
+        self._push_history(dest_pc, store)
+        now = time.time()
+        self.last_change[dest_pc] = now
+        self._push_idle(dest_pc, store, now)
+
+    def schedule_all(self, items):
+        for dest_pc, store in items:
+            self.schedule_store(dest_pc, store)
+
+    def touch(self, dest_pc: str):
+        """Count a read as activity, so a store that is only read isn't dropped as idle."""
+        if dest_pc in self.last_change:
+            self.last_change[dest_pc] = time.time()
+
+    def observe(self, event: str, dest_pc: str, data: Any):
+        """Change feed observer: schedule the deadlines a change brings with it."""
+        if event in SWEEPER_EVENTS:
+            return
+        if event == "store_deleted":
+            self.last_change.pop(dest_pc, None)
+            return
+        if event == "store_loaded":
+            # the event carries the store, so observers never have to wait on the backend
+            self.schedule_store(dest_pc, MessageStore.model_validate(data))
+            return
+        if event == "message_posted":
+            self._push_message(dest_pc, data["msg_id"], datetime.fromisoformat(data["recv_time"]))
+        first_change = dest_pc not in self.last_change
+        self.last_change[dest_pc] = time.time()
+        if first_change:
+            self._push_idle(dest_pc, None, self.last_change[dest_pc])
+
+    async def handle(self, kind: str, dest_pc: str, arg: Any):
+        """Act on one due entry, if it still applies to the store."""
+        store = await self.run_db(self.db.get, dest_pc)
+        if store is None:
+            return
+        if kind == 'message':
+            if store.current is not None and store.current.msg_id == arg:
+                await self.run_db(self.expire_message, dest_pc, arg)
+        elif kind == 'history':
+            history_secs = self.policy(dest_pc).history_secs
+            if history_secs is None or not store.messages:
+                return
+            cutoff = datetime.fromtimestamp(time.time() - history_secs)
+            if store.messages[0].recv_time < cutoff:
+                await self.run_db(self.trim_history, dest_pc, cutoff)
+                # the oldest message left gets its own deadline, even if nothing is posted again
+                store = await self.run_db(self.db.get, dest_pc)
+                if store is not None and store.messages and store.messages[0].recv_time >= cutoff:
+                    self._push_history(dest_pc, store)
+        elif kind == 'idle':
+            idle_secs = self.policy(dest_pc).idle_secs
+            if idle_secs is None:
+                return
+            since, version = arg
+            last_change = self.last_change.get(dest_pc, since)
+            if last_change == since and version is None:
+                # scheduled without the store at hand: look again right away, knowing its version
+                self._push_idle(dest_pc, store, since)
+            elif last_change == since and store.version == version:
+                self.last_change.pop(dest_pc, None)
+                await self.run_db(self.drop_store, dest_pc)
+            else:
+                # changed or read since: look again idle_secs after the last activity (seen here or not)
+                if last_change == since:
+                    last_change = self.last_change[dest_pc] = time.time()
+                self._push_idle(dest_pc, store, last_change)
+
+    async def sweep(self):
+        """Handle every entry that is due, yielding to the event loop every slice_ms."""
+        slice_end = time.perf_counter() + self.slice_secs
+        while self.heap and self.heap[0][0] <= time.time():
+            _, _, kind, dest_pc, arg = heapq.heappop(self.heap)
+            await self.handle(kind, dest_pc, arg)
+            if time.perf_counter() >= slice_end:
+                await asyncio.sleep(0)
+                slice_end = time.perf_counter() + self.slice_secs
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            await self.sweep()
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,194 @@
+import asyncio
+import functools
+import socket
+from typing import Any, Callable
+
+import anyio
+
+from .models import MessageContent, MessageRecord
+
+
+# longest command accepted, in bytes; a TCP client sending more is disconnected
+MAX_LINE = 64 * 2**10
+DEFAULT_SENDER = 'trigger'
+
+
+class TriggerCommands:
+    """
+    The line protocol shared by the TCP and UDP listeners. Each command is one line of UTF-8 and
+    gets a one-line reply:
+
+        PING                        -> PONG
+        POST <dest_pc> <message>    -> OK <msg_id>
+        GET <dest_pc>               -> MSG <msg_id> <read_count> <message>, or NONE
+        SENDER <name>               -> OK (TCP only: the sender of this connection's later POSTs)
+
+    Messages go to and come from the same stores as the REST API, through the same functions.
+    """
+    def __init__(self, post_message: Callable[[str, MessageContent], MessageRecord],
+                 read_message: Callable[[str], tuple[dict[str, Any], str] | None]):
+        self.post_message = post_message
+        self.read_message = read_message
+
+    def handle(self, line: bytes, sender: str = DEFAULT_SENDER, connected: bool = True) -> tuple[bytes, str]:
+        """
+        Run one command. Returns the reply line and the (possibly changed) sender. Without a
+        connection (UDP) there is nothing to keep a sender on, so SENDER is an error.
+        """
+        try:
+            command, _, rest = line.decode().strip().partition(' ')
+        except UnicodeDecodeError:
+            return b'ERR invalid UTF-8\n', sender
+        command = command.upper()
+        if command == 'PING':
+            return b'PONG\n', sender
+        if command == 'POST':
+            dest_pc, _, message = rest.partition(' ')
+            if not dest_pc:
+                return b'ERR usage: POST <dest_pc> <message>\n', sender
+            new_msg = self.post_message(dest_pc, MessageContent.model_construct(message=message, sender=sender))
+            return f'OK {new_msg.msg_id}\n'.encode(), sender
+        if command == 'GET':
+            dest_pc = rest.strip()
+            if not dest_pc:
+                return b'ERR usage: GET <dest_pc>\n', sender
+            read = self.read_message(dest_pc)
+            if read is None:
+                return b'NONE\n', sender
+            out, _ = read
+            # replies are one line, so line breaks inside a message are sent as spaces
+            message = out["message"].replace('\r', ' ').replace('\n', ' ')
+            return f'MSG {out["msg_id"]} {out["read_count"]} {message}\n'.encode(), sender
+        if command == 'SENDER':
+            if not connected:
+                return b'ERR SENDER needs a TCP connection\n', sender
+            if not rest.strip():
+                return b'ERR usage: SENDER <name>\n', sender
+            return b'OK\n', rest.strip()
+        return f'ERR unknown command {command!r}\n'.encode(), sender
+
+
+class _TcpProtocol(asyncio.Protocol):
+    def __init__(self, commands: TriggerCommands, connections: set, offload: bool = False):
+        self.commands = commands
+        self.connections = connections
+        self.offload = offload
+        self.sender = DEFAULT_SENDER
+        self.buffer = b''
+        self.transport: asyncio.Transport | None = None
+        # offloaded commands still waiting, and the task working through them in order
+        self.pending: list[bytes] = []
+        self.worker: asyncio.Task | None = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.connections.add(transport)
+
+    def connection_lost(self, exc: Exception | None):
+        self.connections.discard(self.transport)
+        if self.worker is not None:
+            self.worker.cancel()
+
+    def data_received(self, data: bytes):
+        *lines, self.buffer = (self.buffer + data).split(b'\n')
+        lines = [line for line in lines if line.strip()]
+        if self.offload:
+            self.pending.extend(lines)
+            if self.pending and (self.worker is None or self.worker.done()):
+                self.worker = asyncio.create_task(self.run_pending())
+        elif lines:
+            replies = []
+            for line in lines:
+                reply, self.sender = self.commands.handle(line, self.sender)
+                replies.append(reply)
+            # one write for everything a segment asked for
+            self.transport.write(b''.join(replies))
+        if len(self.buffer) > MAX_LINE:
+            self.transport.write(b'ERR line too long\n')
+            self.transport.close()
+
+    async def run_pending(self):
+        """Run the waiting commands in a worker thread, one at a time so replies keep their order."""
+        while self.pending:
+            lines, self.pending = self.pending, []
+            replies = []
+            for line in lines:
+                reply, self.sender = await anyio.to_thread.run_sync(self.commands.handle, line, self.sender)
+                replies.append(reply)
+            if not self.transport.is_closing():
+                self.transport.write(b''.join(replies))
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, commands: TriggerCommands, offload: bool = False):
+        self.commands = commands
+        self.offload = offload
+        self.transport: asyncio.DatagramTransport | None = None
+        # keeps the offloaded commands' tasks alive until they reply
+        self.tasks: set[asyncio.Task] = set()
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        # one command per datagram, answered to where it came from
+        line = data.rstrip(b'\r\n')
+        if self.offload:
+            task = asyncio.create_task(self.reply_from_thread(line, addr))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return
+        reply, _ = self.commands.handle(line, connected=False)
+        self.transport.sendto(reply, addr)
+
+    async def reply_from_thread(self, line: bytes, addr):
+        handle = functools.partial(self.commands.handle, line, connected=False)
+        reply, _ = await anyio.to_thread.run_sync(handle)
+        if not self.transport.is_closing():
+            self.transport.sendto(reply, addr)
+
+
+class TriggerServer:
+    """
+    Raw TCP and UDP listeners for hard-timed triggers, running in the app's event loop. A
+    command costs a socket read, a line split and a store update, without HTTP parsing,
+    routing or validation in between. With `offload`, for a store backend that can block on a
+    lock (SQLite), commands run in a worker thread instead, so they don't stall the event loop.
+    """
+    def __init__(self, commands: TriggerCommands, host: str = '0.0.0.0', tcp_port: int | None = None,
+                 udp_port: int | None = None, reuse_port: bool = False, offload: bool = False):
+        self.commands = commands
+        self.offload = offload
+        self.host = host
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        # with several workers, each one binds the same ports and the kernel spreads the clients
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Transport] = set()
+        self._udp: asyncio.DatagramTransport | None = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.tcp_port is not None:
+            self._server = await loop.create_server(lambda: _TcpProtocol(self.commands, self._connections, self.offload), self.host,
+                                                    self.tcp_port, reuse_port=self.reuse_port or None)
+            # the actual port, when asked for port 0
+            self.tcp_port = self._server.sockets[0].getsockname()[1]
+        if self.udp_port is not None:
+            self._udp, _ = await loop.create_datagram_endpoint(lambda: _UdpProtocol(self.commands, self.offload),
+                                                               local_addr=(self.host, self.udp_port),
+                                                               reuse_port=self.reuse_port or None)
+            self.udp_port = self._udp.get_extra_info('sockname')[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            # rigs keep their connections open, which would hold up wait_closed
+            for transport in list(self._connections):
+                transport.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
@@ -0,0 +1,69 @@
+"""
+Benchmark for holochat.client against the module-level httpx calls the scripts use, which open
+a new connection for every request. Starts a local server in another process.
+
+    python scripts/bench_client.py [n_requests]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import httpx
+
+from holochat.bench import free_port, launch_server
+from holochat.client import AsyncClient, Client
+
+N_REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+
+def report(name, times):
+    times = sorted(times)
+    print(f'  {name:28s} {statistics.mean(times) * 1e3:8.3f} {times[len(times) // 2] * 1e3:8.3f} '
+          f'{times[int(len(times) * 0.99)] * 1e3:8.3f}')
+
+def time_calls(fxn):
+    fxn()
+    times = []
+    for _ in range(N_REQUESTS):
+        start = time.perf_counter()
+        fxn()
+        times.append(time.perf_counter() - start)
+    return times
+
+async def time_async_calls(fxn):
+    await fxn()
+    times = []
+    for _ in range(N_REQUESTS):
+        start = time.perf_counter()
+        await fxn()
+        times.append(time.perf_counter() - start)
+    return times
+
+async def async_cases(url):
+    async with AsyncClient(url) as client:
+        report('AsyncClient.post_message', await time_async_calls(lambda: client.post_message('bench-pc', 'trigger')))
+        report('AsyncClient.get_message', await time_async_calls(lambda: client.get_message('bench-pc')))
+
+def main():
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = launch_server('holochat.main:app', port)
+    try:
+        print(f'{N_REQUESTS} requests each (ms):')
+        print(f'  {"":28s} {"mean":>8s} {"p50":>8s} {"p99":>8s}')
+        report('httpx.post (per call)', time_calls(
+            lambda: httpx.post(f'{url}/msg/bench-pc', json={'message': 'trigger'})))
+        report('httpx.get (per call)', time_calls(lambda: httpx.get(f'{url}/msg/bench-pc')))
+        with Client(url) as client:
+            report('Client.post_message', time_calls(lambda: client.post_message('bench-pc', 'trigger')))
+            report('Client.get_message', time_calls(lambda: client.get_message('bench-pc')))
+            asyncio.run(async_cases(url))
+            client.delete_db('bench-pc')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
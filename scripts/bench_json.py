@@ -0,0 +1,90 @@
+"""
+Benchmark for JSON response encoding on /db, /msg/all and a large config.
+
+Compares FastAPI's default serialization (jsonable_encoder for plain routes, pydantic's dump_json
+for routes with a response model) with FastJSONResponse on each encoder, then measures full GET
+requests through the ASGI app.
+
+    python scripts/bench_json.py [n_pcs] [n_config_keys]
+"""
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from holochat import encoding
+from holochat.main import app, message_db
+from holochat.models import MessageStore, settings
+
+N_PCS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+N_CONFIG_KEYS = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+N_REPEATS = 20
+ENCODERS = ("stdlib", "pydantic", "orjson")
+
+db_adapter = TypeAdapter(dict[str, MessageStore])
+
+
+def ms_per_call(fxn, n=N_REPEATS):
+    fxn()
+    start = time.perf_counter()
+    for _ in range(n):
+        fxn()
+    return (time.perf_counter() - start) / n * 1e3
+
+def make_config(n_keys):
+    return {f"param_{i}": {"values": [i * 0.1] * 20, "name": f"stim {i}", "enabled": i % 2 == 0}
+            for i in range(n_keys)}
+
+async def fill_db(client):
+    await client.delete("/db")
+    for pc in range(N_PCS):
+        for i in range(settings.message_history_len):
+            await client.post(f"/msg/pc{pc}", json={"message": f"message {i}", "sender": "bench"})
+    await client.post("/config/pc0", json=make_config(N_CONFIG_KEYS))
+
+async def ms_per_request(client, url, n=N_REPEATS):
+    await client.get(url)
+    start = time.perf_counter()
+    for _ in range(n):
+        await client.get(url)
+    return (time.perf_counter() - start) / n * 1e3
+
+async def main():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await fill_db(client)
+        stores = dict(message_db.items())
+        all_messages = {pc: store.messages for pc, store in stores.items()}
+        config = stores["pc0"].config
+
+        print(f'{N_PCS} PCs x {settings.message_history_len} messages, config with {N_CONFIG_KEYS} keys')
+        print('serialization only (ms):')
+        print(f'  {"":14s} {"fastapi":>9s}' + ''.join(f' {encoder:>9s}' for encoder in ENCODERS))
+        cases = [
+            ("/db", lambda: db_adapter.dump_json(db_adapter.validate_python(stores)), stores),
+            ("/msg/all", lambda: json.dumps(jsonable_encoder(
+                {pc: [m.to_dict() for m in msgs] for pc, msgs in all_messages.items()})).encode(), all_messages),
+            ("/config/{pc}", lambda: json.dumps(jsonable_encoder(config)).encode(), config),
+        ]
+        for name, baseline, content in cases:
+            row = [ms_per_call(baseline)]
+            for encoder in ENCODERS:
+                if encoder == "orjson" and encoding.orjson is None:
+                    row.append(float("nan"))
+                    continue
+                dumps = encoding.get_dumps(encoder)
+                row.append(ms_per_call(lambda: dumps(content)))
+            print(f'  {name:14s}' + ''.join(f' {t:9.2f}' for t in row))
+
+        print(f'full GET through the app with the {settings.json_encoder!r} encoder (ms/request):')
+        for url in ("/db", "/msg/all", "/config/pc0"):
+            print(f'  {url:14s} {await ms_per_request(client, url):9.2f}')
+        await client.delete("/db")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
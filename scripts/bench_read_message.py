@@ -0,0 +1,67 @@
+"""
+Microbenchmark for the GET /msg/{dest_pc} hot path.
+
+Compares the per-read work of the old pydantic round-trip (model_dump -> new MessageRequest ->
+response validation -> JSON) with the in-place MessageRecord fast path, then measures the CPU
+time of full GET requests through the ASGI app.
+
+    python scripts/bench_read_message.py [n_reads]
+"""
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+from pydantic import TypeAdapter
+
+from holochat.main import app
+from holochat.models import MessageHold, MessageRecord, MessageRequest
+
+N_READS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+response_adapter = TypeAdapter(MessageRequest)
+
+
+def old_read(held):
+    # what read_message used to do on every GET, plus FastAPI's response model handling
+    if isinstance(held, MessageRequest):
+        held.read_count += 1
+    msg = MessageRequest(**held.model_dump(exclude={"request_time"}))
+    content = response_adapter.dump_python(response_adapter.validate_python(msg), mode="json")
+    return msg, json.dumps(content)
+
+def new_read(record):
+    record.mark_read()
+    return record, json.dumps(record.request_dict())
+
+def cpu_per_call(fxn, msg, n):
+    start = time.process_time()
+    for _ in range(n):
+        msg, _ = fxn(msg)
+    return (time.process_time() - start) / n * 1e6
+
+async def cpu_per_request(n):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/msg/bench", json={"message": "benchmark message", "sender": "bench"})
+        start = time.process_time()
+        for _ in range(n):
+            await client.get("/msg/bench")
+        return (time.process_time() - start) / n * 1e6
+
+
+if __name__ == '__main__':
+    held = MessageHold(message="benchmark message", sender="bench", target="bench", msg_id=1)
+    record = MessageRecord("benchmark message", "bench", "bench", msg_id=1)
+
+    old_us = cpu_per_call(old_read, held, N_READS)
+    new_us = cpu_per_call(new_read, record, N_READS)
+    print(f'read_message work, {N_READS} reads:')
+    print(f'  pydantic round-trip: {old_us:7.2f} us/read')
+    print(f'  MessageRecord:       {new_us:7.2f} us/read  ({old_us / new_us:.1f}x faster)')
+
+    n_requests = max(N_READS // 10, 100)
+    request_us = asyncio.run(cpu_per_request(n_requests))
+    print(f'full GET /msg/{{dest_pc}} through the app, {n_requests} requests:')
+    print(f'  {request_us:7.2f} us CPU/request (includes the HTTP client)')
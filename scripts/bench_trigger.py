@@ -0,0 +1,74 @@
+"""
+Latency and jitter of the raw TCP/UDP trigger listeners against the HTTP API (through the
+pooled holochat.client). Runs the server in a thread of this process, with triggers enabled.
+
+    python scripts/bench_trigger.py [n_requests]
+"""
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import uvicorn
+
+from holochat.bench import free_port
+from holochat.client import Client, TriggerClient
+from holochat.models import settings
+
+N_REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def report(name, fxn):
+    for _ in range(50):
+        fxn()
+    times = []
+    for _ in range(N_REQUESTS):
+        start = time.perf_counter()
+        fxn()
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    print(f'  {name:26s} {statistics.mean(times):8.1f} {times[len(times) // 2]:8.1f} '
+          f'{times[int(len(times) * 0.99)]:8.1f} {times[-1]:8.1f} {statistics.stdev(times):8.1f}')
+
+def udp_command(sock):
+    def send(line):
+        sock.send(line)
+        return sock.recv(65536)
+    return send
+
+def main():
+    http_port, trigger_port = free_port(), free_port()
+    settings.trigger.enabled = True
+    settings.trigger.host = '127.0.0.1'
+    settings.trigger.tcp_port = settings.trigger.udp_port = trigger_port
+    from holochat.main import app
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=http_port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp.connect(('127.0.0.1', trigger_port))
+    send_udp = udp_command(udp)
+    try:
+        with Client(f'http://127.0.0.1:{http_port}') as client, TriggerClient('127.0.0.1', trigger_port) as trigger:
+            print(f'{N_REQUESTS} requests each (us):')
+            print(f'  {"":26s} {"mean":>8s} {"p50":>8s} {"p99":>8s} {"max":>8s} {"stdev":>8s}')
+            report('HTTP post_message', lambda: client.post_message('bench-pc', 'trigger'))
+            report('TCP POST', lambda: trigger.post_message('bench-pc', 'trigger'))
+            report('UDP POST', lambda: send_udp(b'POST bench-pc trigger'))
+            report('HTTP get_message', lambda: client.get_message('bench-pc'))
+            report('TCP GET', lambda: trigger.get_message('bench-pc'))
+            report('UDP GET', lambda: send_udp(b'GET bench-pc'))
+            report('TCP PING', trigger.ping)
+            client.delete_db('bench-pc')
+    finally:
+        udp.close()
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,20 @@
 #type: ignore
+import array
+import asyncio
+import json
+import re
 import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
-from holochat.main import app
+import holochat
+from holochat import export, models
+from holochat.main import app, blob_store, changes, stream_events, sweeper
 from holochat.settings import load_settings
 
 pytestmark = pytest.mark.api
@@ -27,6 +37,15 @@ def test_read_main():
     assert response.template.name == 'index.html'
     assert "request" in response.context
     
+def test_dashboard_listens_to_every_change_event():
+    package = Path(holochat.__file__).parent
+    published = set()
+    for path in package.glob("*.py"):
+        published |= set(re.findall(r'changes\.publish\("(\w+)"', path.read_text()))
+    assert published
+    page = client.get("/").text
+    assert {name for name in published if f'"{name}"' not in page} == set()
+    
 def test_post_message():
     response = client.post("/msg/pc", json={"message": "Holography is fun."})
     assert response.status_code == 200
@@ -203,4 +222,489 @@ def test_pc_key_exists_in_db():
     
 def test_missing_key_raises_404():
     response = client.get("/db/pc1")
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+    
+def test_message_ids_increment():
+    client.post("/msg/pc1", json={"message": "first"})
+    r1 = client.get("/msg/pc1")
+    client.post("/msg/pc1", json={"message": "second"})
+    r2 = client.get("/msg/pc1")
+    assert r1.json()["msg_id"] == 1
+    assert r2.json()["msg_id"] == 2
+    
+def test_long_poll_returns_new_message():
+    client.post("/msg/pc1", json={"message": "Test long poll"})
+    response = client.get("/msg/pc1", params={"wait": 1, "after": 0})
+    assert response.status_code == 200
+    assert response.json()["message"] == "Test long poll"
+    assert response.json()["read_count"] == 0
+    
+def test_long_poll_timeout():
+    client.post("/msg/pc1", json={"message": "Test long poll timeout"})
+    msg_id = client.get("/msg/pc1").json()["msg_id"]
+    response = client.get("/msg/pc1", params={"wait": 0.1, "after": msg_id})
+    assert response.status_code == 204
+    response = client.get("/msg/pc2", params={"wait": 0.1})
+    assert response.status_code == 204
+    
+def test_long_poll_wakes_on_post():
+    async def poll_then_post():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as aclient:
+            poll = asyncio.create_task(aclient.get("/msg/pc1", params={"wait": 5}))
+            await asyncio.sleep(0.05)
+            assert not poll.done()
+            await aclient.post("/msg/pc1", json={"message": "Wake up"})
+            return await asyncio.wait_for(poll, 1)
+    response = asyncio.run(poll_then_post())
+    assert response.status_code == 200
+    assert response.json()["message"] == "Wake up"
+    
+def test_websocket_pushes_messages_and_configs():
+    with TestClient(app) as ws_client:
+        with ws_client.websocket_connect("/ws/pc1") as websocket:
+            ws_client.post("/msg/pc1", json={"message": "Pushed message", "sender": "holo"})
+            ws_client.post("/config/pc1", json={"test": "config"})
+            msg_update = websocket.receive_json()
+            config_update = websocket.receive_json()
+    assert msg_update["event"] == "message"
+    assert msg_update["data"]["message"] == "Pushed message"
+    assert msg_update["data"]["sender"] == "holo"
+    assert msg_update["data"]["message_status"] == "new"
+    assert config_update == {"event": "config", "target": "pc1", "data": {"test": "config"}}
+    
+def test_websocket_pushes_config_deletes():
+    with TestClient(app) as ws_client:
+        ws_client.post("/config/pc1", json={"test": "config"})
+        with ws_client.websocket_connect("/ws/pc1") as websocket:
+            ws_client.delete("/config/pc1")
+            update = websocket.receive_json()
+    assert update == {"event": "config", "target": "pc1", "data": {}}
+    
+def test_websocket_push_does_not_count_as_read():
+    with TestClient(app) as ws_client:
+        with ws_client.websocket_connect("/ws/pc1") as websocket:
+            ws_client.post("/msg/pc1", json={"message": "Pushed message"})
+            websocket.receive_json()
+        response = ws_client.get("/msg/pc1")
+    assert response.json()["read_count"] == 0
+    
+def read_event_frames(n_frames, last_event_id):
+    async def collect():
+        response = await stream_events(last_event_id=last_event_id)
+        frames = []
+        async for frame in response.body_iterator:
+            frames.append(frame)
+            if len(frames) == n_frames:
+                break
+        await response.body_iterator.aclose()
+        return frames
+    return asyncio.run(collect())
+    
+def test_event_stream_resumes_from_last_event_id():
+    start = changes.seq
+    client.post("/msg/pc1", json={"message": "Test events"})
+    client.get("/msg/pc1")
+    client.post("/config/pc1", json={"test": "config"})
+    client.delete("/db/pc1")
+    frames = read_event_frames(4, last_event_id=str(start))
+    events = [frame.splitlines()[1] for frame in frames]
+    assert events == ["event: message_posted", "event: message_read", 
+                      "event: config_changed", "event: store_deleted"]
+    frames = read_event_frames(1, last_event_id=str(start + 3))
+    assert frames[0].startswith(f"id: {start + 4}\n")
+    
+def test_event_stream_reset_on_unknown_id():
+    frames = read_event_frames(1, last_event_id=str(changes.seq + 100))
+    assert "event: reset" in frames[0]
+    
+def test_event_stream_reset_when_client_falls_behind(monkeypatch):
+    monkeypatch.setattr(changes, "backlog", deque(changes.backlog, maxlen=5))
+    async def collect():
+        response = await stream_events(last_event_id=None)
+        client.post("/msg/pc1", json={"message": "first"})
+        frames = [await response.body_iterator.__anext__()]
+        # more changes than the backlog keeps go by before the client reads again
+        for i in range(10):
+            client.post("/msg/pc1", json={"message": f"message {i}"})
+        frames.append(await response.body_iterator.__anext__())
+        client.post("/msg/pc1", json={"message": "after"})
+        frames.append(await response.body_iterator.__anext__())
+        await response.body_iterator.aclose()
+        return frames
+    frames = asyncio.run(collect())
+    assert [frame.splitlines()[1] for frame in frames] == [
+        "event: message_posted", "event: reset", "event: message_posted"]
+    assert frames[2].startswith(f"id: {changes.seq}\n")
+
+def test_message_history_is_bounded(monkeypatch):
+    monkeypatch.setattr(models.settings, "message_history_len", 3)
+    client.delete("/db")
+    for i in range(5):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    response = client.get("/db/pc1")
+    assert response.json()["message_count"] == 3
+    assert [m["message"] for m in response.json()["messages"]] == ["message 2", "message 3", "message 4"]
+    assert response.json()["current"]["message"] == "message 4"
+    
+def test_message_history_can_be_off(monkeypatch):
+    monkeypatch.setattr(models.settings, "message_history_len", 0)
+    client.delete("/db")
+    assert client.post("/msg/pc1", json={"message": "no history"}).status_code == 200
+    assert client.get("/msg/pc1").json()["message"] == "no history"
+    assert client.get("/db/pc1").json()["message_count"] == 0
+    
+def test_read_does_not_touch_history():
+    client.post("/msg/pc1", json={"message": "Test history"})
+    client.get("/msg/pc1")
+    client.get("/msg/pc1")
+    response = client.get("/db/pc1")
+    assert response.json()["current"]["read_count"] == 1
+    assert response.json()["messages"][0]["message_status"] == "new"
+    
+def test_message_history_pages():
+    for i in range(5):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    response = client.get("/msg/pc1/history", params={"limit": 2})
+    assert response.status_code == 200
+    assert response.json()["total"] == 5
+    assert [m["message"] for m in response.json()["messages"]] == ["message 4", "message 3"]
+    response = client.get("/msg/pc1/history", params={"offset": 4, "limit": 2})
+    assert [m["message"] for m in response.json()["messages"]] == ["message 0"]
+    
+def test_message_history_missing_pc():
+    response = client.get("/msg/pc1/history")
+    assert response.status_code == 404
+    
+def test_save_pc_streams_json():
+    for i in range(5):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    client.post("/config/pc1", json={"test": "config"})
+    client.get("/msg/pc1")
+    response = client.get("/save/pc1")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == "attachment; filename=pc1_holochat_db.json"
+    assert response.json() == client.get("/db/pc1").json()
+    
+def test_save_pc_chunks_large_history(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_MESSAGES", 2)
+    for i in range(5):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    saved = client.get("/save/pc1").json()
+    assert [m["message"] for m in saved["messages"]] == [f"message {i}" for i in range(5)]
+    
+def test_save_all_streams_ndjson():
+    client.post("/msg/pc1", json={"message": "Test ndjson"})
+    client.post("/msg/pc1", json={"message": "Test ndjson again"})
+    client.post("/config/pc2", json={"test": "config"})
+    response = client.get("/save")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(line["type"], line["target"]) for line in lines] == [
+        ("store", "pc1"), ("message", "pc1"), ("message", "pc1"), ("store", "pc2")]
+    assert lines[3]["data"]["config"] == {"test": "config"}
+    
+def test_save_all_as_json():
+    client.post("/msg/pc1", json={"message": "Test json"})
+    client.post("/config/pc2", json={"test": "config"})
+    response = client.get("/save", params={"format": "json"})
+    assert response.json() == client.get("/db").json()
+    
+def without_version(store):
+    # loading a dump is a change, so it moves the store version on
+    return {k: v for k, v in store.items() if k != "version"}
+
+def test_load_round_trips_ndjson_save():
+    for i in range(3):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    client.get("/msg/pc1")
+    client.post("/config/pc2", json={"test": "config"})
+    saved_db = client.get("/db").json()
+    dump = client.get("/save").content
+    client.delete("/db")
+    response = client.post("/load", content=dump, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.json()["records"] == 5
+    assert response.json()["targets"] == ["pc1", "pc2"]
+    loaded_db = client.get("/db").json()
+    assert {pc: without_version(store) for pc, store in loaded_db.items()} == {pc: without_version(store) for pc, store in saved_db.items()}
+    assert loaded_db["pc1"]["version"] > saved_db["pc1"]["version"]
+    # the restored current message keeps counting reads
+    assert client.get("/msg/pc1").json()["read_count"] == 1
+    
+def test_load_round_trips_json_saves():
+    client.post("/msg/pc1", json={"message": "Test json load"})
+    client.post("/config/pc1", json={"test": "config"})
+    saved_pc = client.get("/db/pc1").json()
+    pc_dump = client.get("/save/pc1").content
+    db_dump = client.get("/save", params={"format": "json"}).content
+    client.delete("/db")
+    response = client.post("/load/pc1", content=pc_dump, headers={"Content-Type": "application/json"})
+    assert response.status_code == 200
+    assert without_version(client.get("/db/pc1").json()) == without_version(saved_pc)
+    client.delete("/db")
+    response = client.post("/load", content=db_dump, headers={"Content-Type": "application/json"})
+    assert without_version(client.get("/db/pc1").json()) == without_version(saved_pc)
+    
+def test_load_rejects_bad_dump_without_changes():
+    client.post("/msg/pc1", json={"message": "keep me"})
+    bad_dump = '{"type": "store", "target": "pc1", "data": {}}\n{"type": "message", "target": "pc1", "data": {"nope": 1}}\n'
+    response = client.post("/load", content=bad_dump, params={"format": "ndjson"})
+    assert response.status_code == 422
+    assert client.get("/msg/pc1").json()["message"] == "keep me"
+    
+def test_batch_post():
+    batch = [
+        {"target": "si", "message": "start trial", "sender": "master"},
+        {"target": "daq", "message": "start trial"},
+    ]
+    response = client.post("/msg/batch", json=batch)
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {"item": 0, "target": "si", "msg_id": 1},
+        {"item": 1, "target": "daq", "msg_id": 1},
+    ]
+    assert client.get("/msg/si").json()["sender"] == "master"
+    assert client.get("/msg/daq").json()["sender"] == "unknown"
+    
+def test_batch_post_to_target_group(monkeypatch):
+    monkeypatch.setattr(models.settings, "target_groups", {"rigs": ["si", "daq", "holo"]})
+    response = client.post("/msg/batch", json=[{"target": "rigs", "message": "start trial"}])
+    assert [r["target"] for r in response.json()["results"]] == ["si", "daq", "holo"]
+    for pc in ["si", "daq", "holo"]:
+        assert client.get(f"/msg/{pc}").json()["message"] == "start trial"
+    
+def test_batch_post_is_validated_first():
+    batch = [{"target": "si", "message": "start trial"}, {"message": "no target"}]
+    response = client.post("/msg/batch", json=batch)
+    assert response.status_code == 422
+    assert client.get("/msg/si").status_code == 404
+    
+def test_msg_all_cursor_pages():
+    for pc in ("pc2", "pc1"):
+        for i in range(3):
+            client.post(f"/msg/{pc}", json={"message": f"{pc} message {i}"})
+    pages = []
+    params = {"limit": 4}
+    while True:
+        response = client.get("/msg/all", params=params)
+        assert response.status_code == 200
+        pages.append({pc: [m["message"] for m in msgs] for pc, msgs in response.json().items()})
+        if "x-next-cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["x-next-cursor"]
+    assert pages == [
+        {"pc1": ["pc1 message 0", "pc1 message 1", "pc1 message 2"], "pc2": ["pc2 message 0"]},
+        {"pc2": ["pc2 message 1", "pc2 message 2"]},
+    ]
+    
+def test_msg_all_filters():
+    client.post("/msg/pc1", json={"message": "old", "sender": "rig"})
+    time.sleep(0.01)
+    split = datetime.now()
+    client.post("/msg/pc1", json={"message": "new", "sender": "rig"})
+    client.post("/msg/pc2", json={"message": "other", "sender": "laptop"})
+    response = client.get("/msg/all", params={"since": split.isoformat()})
+    assert {pc: [m["message"] for m in msgs] for pc, msgs in response.json().items()} == {"pc1": ["new"], "pc2": ["other"]}
+    response = client.get("/msg/all", params={"until": split.isoformat()})
+    assert {pc: [m["message"] for m in msgs] for pc, msgs in response.json().items()} == {"pc1": ["old"]}
+    response = client.get("/msg/all", params={"sender": "laptop"})
+    assert list(response.json()) == ["pc2"]
+    
+def test_db_pages_keep_store_fields():
+    client.post("/config/pc1", json={"gain": 2})
+    for i in range(3):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    response = client.get("/db", params={"limit": 2})
+    store = response.json()["pc1"]
+    assert [m["message"] for m in store["messages"]] == ["message 0", "message 1"]
+    assert store["current"]["message"] == "message 2"
+    assert store["config"] == {"gain": 2}
+    response = client.get("/db", params={"limit": 2, "cursor": response.headers["x-next-cursor"]})
+    assert [m["message"] for m in response.json()["pc1"]["messages"]] == ["message 2"]
+    
+def test_bad_cursor():
+    response = client.get("/msg/all", params={"cursor": "not a cursor"})
+    assert response.status_code == 400
+    
+def test_message_etag_skips_unchanged_reads():
+    client.post("/msg/pc1", json={"message": "Test etag"})
+    response = client.get("/msg/pc1")
+    etag = response.headers["etag"]
+    response = client.get("/msg/pc1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+    # the 304 didn't count as a read
+    assert client.get("/db/pc1").json()["current"]["read_count"] == 0
+    client.post("/msg/pc1", json={"message": "Test etag 2"})
+    response = client.get("/msg/pc1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["message"] == "Test etag 2"
+    assert response.headers["etag"] != etag
+    
+def test_message_head_does_not_count_read():
+    client.post("/msg/pc1", json={"message": "Test head"})
+    response = client.head("/msg/pc1")
+    assert response.status_code == 200
+    assert client.get("/msg/pc1").headers["etag"] == response.headers["etag"]
+    assert client.get("/db/pc1").json()["current"]["read_count"] == 0
+    assert client.head("/msg/pc2").status_code == 404
+    
+def test_config_etag():
+    client.post("/config/pc1", json={"test": "config"})
+    etag = client.get("/config/pc1").headers["etag"]
+    assert client.get("/config/pc1", headers={"If-None-Match": f'"other", {etag}'}).status_code == 304
+    client.post("/config/pc1", json={"test": "new config"})
+    response = client.get("/config/pc1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json() == {"test": "new config"}
+    
+def test_config_etag_ignores_message_traffic():
+    client.post("/config/pc1", json={"test": "config"})
+    etag = client.get("/config/pc1").headers["etag"]
+    client.post("/msg/pc1", json={"message": "unrelated"})
+    client.get("/msg/pc1")
+    response = client.get("/config/pc1", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    client.patch("/config/pc1", json={"test": "patched"})
+    assert client.get("/config/pc1", headers={"If-None-Match": etag}).status_code == 200
+    
+def test_latest_follows_posts_reads_and_deletes():
+    client.post("/msg/pc1", json={"message": "first"})
+    client.post("/msg/pc2", json={"message": "second"})
+    client.post("/config/pc3", json={"test": "config only"})
+    latest = client.get("/msg/latest").json()
+    assert {pc: m["message"] for pc, m in latest.items()} == {"pc1": "first", "pc2": "second"}
+    client.get("/msg/pc1")
+    assert client.get("/msg/latest").json()["pc1"]["request_time"] is not None
+    client.delete("/msg/pc1")
+    client.delete("/db/pc2")
+    assert client.get("/msg/latest").json() == {}
+    
+def test_all_configs_follow_changes():
+    client.post("/config/pc1", json={"test": "config 1"})
+    client.post("/config/pc2", json={"test": "config 2"})
+    client.post("/msg/pc3", json={"message": "message only"})
+    assert client.get("/config").json() == {"pc1": {"test": "config 1"}, "pc2": {"test": "config 2"}}
+    client.post("/config/pc1", json={"test": "new config 1"})
+    client.delete("/config/pc2")
+    assert client.get("/config").json() == {"pc1": {"test": "new config 1"}}
+    client.delete("/db")
+    assert client.get("/config").json() == {}
+    
+def test_msgpack_config_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    config = {"targets": [[i * 0.5, -i * 0.25, 1.0] for i in range(1000)], "name": "holo"}
+    response = client.post("/config/pc1", content=msgpack.packb(config), headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 200
+    response = client.get("/config/pc1", headers={"Accept": "application/msgpack"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == config
+    # JSON clients see the same config
+    assert client.get("/config/pc1").json() == config
+    
+def test_msgpack_message_round_trip():
+    msgpack = pytest.importorskip("msgpack")
+    body = msgpack.packb({"message": "Test msgpack", "sender": "rig"})
+    response = client.post("/msg/pc1", content=body, headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 200
+    response = client.get("/msg/pc1", headers={"Accept": "application/msgpack, application/json;q=0.5"})
+    msg = msgpack.unpackb(response.content)
+    assert msg["message"] == "Test msgpack"
+    assert msg["sender"] == "rig"
+    response = client.get("/msg/latest", headers={"Accept": "application/msgpack"})
+    assert msgpack.unpackb(response.content)["pc1"]["msg_id"] == msg["msg_id"]
+    
+def test_msgpack_body_is_validated():
+    msgpack = pytest.importorskip("msgpack")
+    body = msgpack.packb({"sender": "no message"})
+    response = client.post("/msg/pc1", content=body, headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 422
+    response = client.post("/msg/pc1", content=b"\xc1", headers={"Content-Type": "application/msgpack"})
+    assert response.status_code == 400
+
+def test_msgpack_binary_values_are_rejected():
+    msgpack = pytest.importorskip("msgpack")
+    targets = array.array("f", [0.5, 1.5]).tobytes()
+    for config in [{"targets": targets}, {"nested": [{"t": msgpack.ExtType(1, b"x")}]}, {b"key": 1}]:
+        response = client.post("/config/pc1", content=msgpack.packb(config), headers={"Content-Type": "application/msgpack"})
+        assert response.status_code == 400
+    # nothing was stored, and the server still serves the database
+    assert client.get("/config/pc1").status_code == 404
+    assert client.get("/config").status_code == 200
+    assert client.get("/db").status_code == 200
+    
+def test_blob_round_trip():
+    targets = array.array("f", [i * 0.5 for i in range(3000)])
+    response = client.post("/blob/pc1/targets", content=targets.tobytes(),
+                           headers={"X-Dtype": "float32", "X-Shape": "1000,3"})
+    assert response.status_code == 200
+    assert response.json()["nbytes"] == 12000
+    response = client.get("/blob/pc1/targets")
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-dtype"] == "float32"
+    assert response.headers["x-shape"] == "1000,3"
+    assert array.array("f", response.content) == targets
+    assert client.get("/blob/pc1/targets", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+    assert client.get("/blob/pc1").json() == {"targets": {"dtype": "float32", "shape": [1000, 3], "nbytes": 12000, "spilled": False}}
+    assert client.delete("/blob/pc1/targets").status_code == 200
+    assert client.get("/blob/pc1/targets").status_code == 404
+    
+def test_blob_must_match_dtype_and_shape():
+    data = array.array("h", range(10)).tobytes()
+    response = client.post("/blob/pc1/bad", content=data, headers={"X-Dtype": "int16", "X-Shape": "11"})
+    assert response.status_code == 422
+    response = client.post("/blob/pc1/bad", content=data, headers={"X-Dtype": "complex64", "X-Shape": "10"})
+    assert response.status_code == 422
+    response = client.post("/blob/pc1/bad", content=data, headers={"X-Dtype": "int16", "X-Shape": "ten"})
+    assert response.status_code == 422
+    assert client.get("/blob/pc1").status_code == 404
+    
+def test_large_blob_spills_to_disk(monkeypatch, tmp_path):
+    monkeypatch.setattr(blob_store, "spill_dir", tmp_path)
+    monkeypatch.setattr(blob_store, "spill_bytes", 1024)
+    data = array.array("d", range(1000))
+    response = client.post("/blob/pc1/big", content=data.tobytes(), headers={"X-Dtype": "float64", "X-Shape": "1000"})
+    assert response.json()["spilled"] is True
+    assert len(list(tmp_path.iterdir())) == 1
+    assert array.array("d", client.get("/blob/pc1/big").content) == data
+    client.delete("/db")
+    assert list(tmp_path.iterdir()) == []
+    
+def test_config_merge_patch():
+    client.post("/config/pc1", json={"mouse_name": "m1", "stim": {"power": 5, "rate": 10}})
+    response = client.patch("/config/pc1", json={"mouse_name": "m2", "stim": {"rate": None}},
+                            headers={"Content-Type": "application/merge-patch+json"})
+    assert response.status_code == 200
+    assert client.get("/config/pc1").json() == {"mouse_name": "m2", "stim": {"power": 5}}
+    assert response.json()["config_version"] == int(client.get("/config/pc1").headers["x-config-version"])
+    
+def test_config_since_version():
+    client.post("/config/pc1", json={"mouse_name": "m1", "trial": 0})
+    version = int(client.get("/config/pc1").headers["x-config-version"])
+    for trial in range(1, 4):
+        client.patch("/config/pc1", json={"trial": trial})
+    response = client.get("/config/pc1", params={"since_version": version})
+    assert response.json()["patch"] == {"trial": 3}
+    latest = response.json()["config_version"]
+    assert client.get("/config/pc1", params={"since_version": latest}).json() == {"config_version": latest, "patch": {}}
+    # a full replacement can't be sent as a diff
+    client.post("/config/pc1", json={"mouse_name": "m2"})
+    response = client.get("/config/pc1", params={"since_version": latest})
+    assert response.json()["config"] == {"mouse_name": "m2"}
+    
+def test_sweeper_evictions_reach_the_api(monkeypatch):
+    monkeypatch.setattr(sweeper, "default_policy", models.settings.sweeper.default.model_copy(update={"idle_secs": 60}))
+    client.post("/msg/pc1", json={"message": "Test expiry"})
+    client.post("/config/pc2", json={"test": "config"})
+    asyncio.run(sweeper.handle("message", "pc1", 1))
+    assert client.get("/msg/pc1").status_code == 404
+    assert client.get("/msg/latest").json() == {}
+    assert client.get("/db/pc1").json()["message_count"] == 1
+    # idle entries carry the (last activity, store version) seen when they were scheduled
+    asyncio.run(sweeper.handle("idle", "pc2", (0, client.get("/db/pc2").json()["version"])))
+    assert client.get("/config").json() == {}
+    assert client.get("/db/pc2").status_code == 404
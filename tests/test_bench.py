@@ -0,0 +1,53 @@
+#type: ignore
+import asyncio
+
+import httpx
+import pytest
+
+from holochat import bench
+from holochat.main import app, message_db
+
+pytestmark = pytest.mark.api
+
+def test_parse_mix():
+    assert bench.parse_mix("post=2, get=6,config_get") == {"post": 2.0, "get": 6.0, "config_get": 1.0}
+    with pytest.raises(ValueError):
+        bench.parse_mix("post=1,delete=1")
+    with pytest.raises(ValueError):
+        bench.parse_mix("post=0")
+
+def test_percentile():
+    ordered = [float(i) for i in range(1, 101)]
+    assert bench.percentile(ordered, 50) == 50
+    assert bench.percentile(ordered, 99) == 99
+    assert bench.percentile(ordered, 100) == 100
+    assert bench.percentile([3.0], 95) == 3
+    assert bench.percentile([], 50) == 0
+
+def make_result(throughput, p50_ms, p99_ms):
+    stats = bench.OpStats(count=100, throughput=throughput, p50_ms=p50_ms, p95_ms=p50_ms, p99_ms=p99_ms)
+    return bench.BenchResult(params={}, environment={}, started="2024-01-01T00:00:00", duration_secs=1,
+                             total=stats, ops={"get": stats})
+
+def test_compare_against_baseline():
+    baseline = make_result(1000, 1.0, 5.0)
+    assert bench.compare(make_result(950, 1.05, 5.4), baseline) == []
+    regressions = bench.compare(make_result(800, 1.0, 6.0), baseline)
+    assert "total: throughput 800.0/s, baseline 1000.0/s" in regressions
+    assert "get: p99 6.00 ms, baseline 5.00 ms" in regressions
+
+def test_result_round_trip(tmp_path):
+    result = make_result(1000, 1.0, 5.0)
+    bench.save_result(result, tmp_path / "result.json")
+    assert bench.load_result(tmp_path / "result.json") == result
+
+def test_run_bench_in_process():
+    transport = httpx.ASGITransport(app=app)
+    result = asyncio.run(bench.run_bench("http://bench", rigs=3, duration=0.2, warmup=0.05,
+                                         mix="post=1,get=1,config_get=1,config_post=1", transport=transport))
+    assert set(result.ops) == set(bench.OPS)
+    assert result.total.count == sum(stats.count for stats in result.ops.values()) > 0
+    assert result.total.errors == 0
+    assert result.total.p50_ms <= result.total.p99_ms <= result.total.max_ms
+    # the rigs clean up after themselves
+    assert not any(pc.startswith(bench.RIG_PREFIX) for pc in message_db)
@@ -0,0 +1,56 @@
+#type: ignore
+import asyncio
+import json
+
+import pytest
+
+from holochat.changes import ChangeFeed
+
+pytestmark = pytest.mark.api
+
+
+def test_sequence_ids_increase():
+    feed = ChangeFeed()
+    assert feed.publish("message_posted", "pc1") == 1
+    assert feed.publish("config_changed", "pc1", {"test": "config"}) == 2
+    seqs = [seq for seq, _ in feed.since(0)]
+    assert seqs == [1, 2]
+    
+def test_since_returns_only_newer_changes():
+    feed = ChangeFeed()
+    for _ in range(5):
+        feed.publish("message_posted", "pc1")
+    assert [seq for seq, _ in feed.since(3)] == [4, 5]
+    assert feed.since(5) == []
+    
+def test_frames_are_sse_formatted():
+    feed = ChangeFeed()
+    feed.publish("config_changed", "pc1", {"test": "config"})
+    _, frame = feed.since(0)[0]
+    lines = frame.splitlines()
+    assert lines[0] == "id: 1"
+    assert lines[1] == "event: config_changed"
+    assert json.loads(lines[2].removeprefix("data: "))["data"] == {"test": "config"}
+    assert frame.endswith("\n\n")
+    
+def test_cannot_resume_past_backlog():
+    feed = ChangeFeed(backlog=3)
+    for _ in range(5):
+        feed.publish("message_posted", "pc1")
+    assert not feed.can_resume(0)
+    assert feed.can_resume(2)
+    assert [seq for seq, _ in feed.since(0)] == [3, 4, 5]
+    assert not feed.can_resume(10)
+    
+def test_wait_wakes_on_publish():
+    async def wait_then_publish():
+        feed = ChangeFeed()
+        waiter = asyncio.create_task(feed.wait(0, timeout=1))
+        await asyncio.sleep(0.01)
+        feed.publish("store_deleted", "pc1")
+        return await waiter
+    assert asyncio.run(wait_then_publish())
+    
+def test_wait_times_out():
+    feed = ChangeFeed()
+    assert not asyncio.run(feed.wait(0, timeout=0.01))
@@ -0,0 +1,116 @@
+#type: ignore
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from holochat.client import AsyncClient, Client
+from holochat.main import app
+from holochat.models import MessageHold, MessageRequest, MessageStore
+
+pytestmark = pytest.mark.api
+
+test_client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    test_client.delete("/db")
+    yield
+    test_client.delete("/db")
+
+@pytest.fixture
+def client():
+    # the TestClient transport runs requests through the app in-process
+    with Client("http://testserver", transport=test_client._transport) as client:
+        yield client
+
+def test_messages(client):
+    assert client.get_message("pc1") is None
+    client.post_message("pc1", "first", sender="ctrl")
+    client.post_message("pc1", "second")
+    assert isinstance(client.latest_messages()["pc1"], MessageHold)
+    msg = client.get_message("pc1")
+    assert isinstance(msg, MessageRequest)
+    assert (msg.message, msg.sender, msg.msg_id) == ("second", "unknown", 2)
+    history = client.message_history("pc1")
+    assert [m.message for m in history] == ["second", "first"]
+    assert [m.sender for m in client.all_messages(sender="ctrl")["pc1"]] == ["ctrl"]
+    client.delete_messages("pc1")
+    assert client.get_message("pc1") is None
+
+def test_batch(client):
+    results = client.post_batch([{"message": "go", "target": "pc1"}, {"message": "go", "target": "pc2"}])
+    assert [r["target"] for r in results] == ["pc1", "pc2"]
+
+def test_config_and_db(client):
+    assert client.get_config("pc1") is None
+    client.set_config("pc1", {"mouse": "m1", "stim": {"power": 1}})
+    version = client.patch_config("pc1", {"stim": {"power": 2}})
+    assert client.get_config("pc1") == {"mouse": "m1", "stim": {"power": 2}}
+    assert client.all_configs() == {"pc1": {"mouse": "m1", "stim": {"power": 2}}}
+    store = client.get_store("pc1")
+    assert isinstance(store, MessageStore)
+    assert store.config_version == version
+    assert set(client.get_db()) == {"pc1"}
+    client.delete_db("pc1")
+    assert client.get_store("pc1") is None
+
+def test_async_client():
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with AsyncClient("http://testserver", transport=transport) as client:
+            await client.post_message("pc1", "hello")
+            msg = await client.get_message("pc1")
+            assert msg.message == "hello"
+            # long poll: times out with no message newer than the one already seen
+            assert await client.get_message("pc1", wait=0.05, after=msg.msg_id) is None
+            await client.set_config("pc1", {"a": 1})
+            assert await client.get_config("pc1") == {"a": 1}
+            await client.delete_db()
+            assert await client.get_db() == {}
+    asyncio.run(run())
+
+def flaky_transport(failures: list, calls: list):
+    def handler(request):
+        calls.append(request.method)
+        if failures:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return httpx.Response(failure)
+        return httpx.Response(200, json={"a": 1})
+    return httpx.MockTransport(handler)
+
+def test_retry_with_backoff():
+    calls = []
+    transport = flaky_transport([503, httpx.ReadError("reset"), 502], calls)
+    with Client("http://testserver", transport=transport, backoff=0.001) as client:
+        assert client.get_config("pc1") == {"a": 1}
+    assert calls == ["GET"] * 4
+
+def test_retries_run_out():
+    calls = []
+    transport = flaky_transport([503] * 5, calls)
+    with Client("http://testserver", transport=transport, retries=2, backoff=0.001) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            client.get_config("pc1")
+    assert len(calls) == 3
+
+def test_post_only_retried_when_unsent():
+    calls = []
+    transport = flaky_transport([httpx.ConnectError("refused"), httpx.ReadError("reset")], calls)
+    with Client("http://testserver", transport=transport, backoff=0.001) as client:
+        # the read error may come after the server got the message, so it isn't sent twice
+        with pytest.raises(httpx.ReadError):
+            client.post_message("pc1", "trigger")
+    assert calls == ["POST", "POST"]
+
+def test_message_reads_only_retried_when_unsent():
+    calls = []
+    transport = flaky_transport([httpx.ConnectError("refused"), 503], calls)
+    with Client("http://testserver", transport=transport, backoff=0.001) as client:
+        # the server may have counted the read before the 503
+        with pytest.raises(httpx.HTTPStatusError):
+            client.get_message("pc1")
+    assert calls == ["GET", "GET"]
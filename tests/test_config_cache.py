@@ -0,0 +1,141 @@
+#type: ignore
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from holochat.client import AsyncClient, Client
+from holochat.config_cache import AsyncConfigCache, ConfigCache
+from holochat.main import app
+
+pytestmark = pytest.mark.api
+
+test_client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    test_client.delete("/db")
+    yield
+    test_client.delete("/db")
+
+class CountingTransport(httpx.BaseTransport):
+    """Runs requests through the app and keeps their status codes."""
+    def __init__(self):
+        self.statuses = []
+
+    def handle_request(self, request):
+        response = test_client._transport.handle_request(request)
+        self.statuses.append(response.status_code)
+        return response
+
+@pytest.fixture
+def transport():
+    return CountingTransport()
+
+@pytest.fixture
+def client(transport):
+    with Client("http://testserver", transport=transport) as client:
+        yield client
+
+def test_reads_are_cached(client, transport):
+    test_client.post("/config/pc1", json={"mouse": "m1"})
+    cache = ConfigCache(client)
+    assert cache.get("pc1") == {"mouse": "m1"}
+    for _ in range(10):
+        assert cache.get("pc1") == {"mouse": "m1"}
+    assert transport.statuses == [200]
+    assert cache.get("pc2") == {}
+
+def test_revalidation(client, transport):
+    test_client.post("/config/pc1", json={"mouse": "m1", "stim": {"power": 1}})
+    cache = ConfigCache(client, ["pc1"])
+    cache.revalidate()
+    cache.revalidate()
+    # nothing changed: a 304
+    assert transport.statuses == [200, 304]
+    old = cache.get("pc1")
+    test_client.patch("/config/pc1", json={"stim": {"power": 2}})
+    cache.revalidate()
+    assert cache.get("pc1") == {"mouse": "m1", "stim": {"power": 2}}
+    # configs handed out earlier are never changed under the reader
+    assert old == {"mouse": "m1", "stim": {"power": 1}}
+    test_client.delete("/config/pc1")
+    cache.revalidate()
+    assert cache.get("pc1") == {}
+
+def test_invalidate_and_max_staleness(client, transport):
+    test_client.post("/config/pc1", json={"trial": 1})
+    cache = ConfigCache(client)
+    assert cache.get("pc1") == {"trial": 1}
+    test_client.post("/config/pc1", json={"trial": 2})
+    assert cache.get("pc1") == {"trial": 1}
+    cache.invalidate("pc1")
+    assert cache.get("pc1") == {"trial": 2}
+    test_client.post("/config/pc1", json={"trial": 3})
+    time.sleep(0.02)
+    assert cache.get("pc1", max_staleness=0.01) == {"trial": 3}
+    assert cache.age("pc1") < 0.01
+
+def test_background_thread(client):
+    test_client.post("/config/pc1", json={"trial": 1})
+    with ConfigCache(client, ["pc1"], interval=0.01) as cache:
+        test_client.post("/config/pc1", json={"trial": 2})
+        deadline = time.monotonic() + 2
+        while cache.cached("pc1") != {"trial": 2} and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.cached("pc1") == {"trial": 2}
+
+def test_errors_keep_the_cached_config(transport):
+    test_client.post("/config/pc1", json={"trial": 1})
+    failing = httpx.MockTransport(lambda request: httpx.Response(503))
+    with Client("http://testserver", transport=transport) as client:
+        cache = ConfigCache(client)
+        cache.get("pc1")
+    with Client("http://testserver", transport=failing, retries=0) as client:
+        cache.client = client
+        cache.revalidate()
+    assert isinstance(cache.last_error, httpx.HTTPStatusError)
+    assert cache.cached("pc1") == {"trial": 1}
+
+def test_persisted_to_disk(client, transport, tmp_path):
+    path = tmp_path / "configs.json"
+    test_client.post("/config/pc1", json={"trial": 1})
+    ConfigCache(client, path=path).get("pc1")
+    restarted = ConfigCache(client, path=path)
+    # served from disk right away, then confirmed with a 304
+    assert restarted.cached("pc1") == {"trial": 1}
+    assert restarted.age("pc1") == float("inf")
+    restarted.revalidate()
+    assert transport.statuses[-1] == 304
+    assert restarted.age("pc1") < 1
+
+def test_async_cache():
+    async def run():
+        test_client.post("/config/pc1", json={"trial": 1})
+        async with AsyncClient("http://testserver", transport=httpx.ASGITransport(app=app)) as client:
+            async with AsyncConfigCache(client, ["pc1"], interval=0.01) as cache:
+                assert await cache.get("pc1") == {"trial": 1}
+                await client.patch_config("pc1", {"trial": 2})
+                for _ in range(200):
+                    if cache.cached("pc1") == {"trial": 2}:
+                        break
+                    await asyncio.sleep(0.01)
+                assert cache.cached("pc1") == {"trial": 2}
+    asyncio.run(run())
+
+def test_empty_patch_keeps_the_cached_config(client, transport, tmp_path, monkeypatch):
+    path = tmp_path / "configs.json"
+    test_client.post("/config/pc1", json={"mouse": "m1"})
+    cache = ConfigCache(client, ["pc1"], path=path)
+    cache.revalidate()
+    old = cache.get("pc1")
+    saves = []
+    monkeypatch.setattr(cache, "_save", lambda: saves.append(1))
+    # an empty patch bumps the version without changing anything
+    test_client.patch("/config/pc1", json={})
+    cache.revalidate()
+    assert transport.statuses == [200, 200]
+    assert cache.get("pc1") is old
+    assert saves == []
@@ -0,0 +1,65 @@
+#type: ignore
+import json
+
+import pytest
+
+from holochat import encoding
+from holochat.models import MessageRecord, MessageStore
+
+pytestmark = pytest.mark.api
+
+
+def make_store():
+    store = MessageStore(config={"gain": 2.5, "name": "rig"})
+    for i in range(3):
+        store.last_msg_id += 1
+        store.current = MessageRecord(f"message {i}", "tester", "pc1", msg_id=store.last_msg_id)
+        store.messages.append(store.current.copy())
+    store.current.mark_read()
+    return store
+
+@pytest.mark.parametrize("encoder", ["stdlib", "pydantic", "orjson"])
+def test_encoders_match_pydantic(encoder):
+    if encoder == "orjson" and encoding.orjson is None:
+        pytest.skip("orjson is not installed")
+    store = make_store()
+    dumps = encoding.get_dumps(encoder)
+    assert json.loads(dumps({"pc1": store})) == {"pc1": store.model_dump(mode="json")}
+    assert json.loads(dumps(store.messages)) == [m.to_dict() for m in store.messages]
+
+def test_auto_falls_back_to_pydantic(monkeypatch):
+    monkeypatch.setattr(encoding, "orjson", None)
+    assert encoding.get_dumps("auto") is encoding._pydantic_dumps
+    with pytest.raises(ImportError):
+        encoding.get_dumps("orjson")
+
+def test_stdlib_encoder_is_the_json_module():
+    dumps = encoding.get_dumps("stdlib")
+    assert dumps is encoding._stdlib_dumps
+    # the stdlib's own output, with starlette's options, and never NaN
+    value = {"name": "réglage", "gain": [1, 2.5]}
+    assert dumps(value) == json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+    with pytest.raises(ValueError):
+        dumps(float("nan"))
+
+def test_unknown_objects_still_fail():
+    with pytest.raises(TypeError):
+        encoding.get_dumps("stdlib")(object())
+
+@pytest.mark.parametrize("accept, expected", [
+    ("application/msgpack", True),
+    ("application/msgpack, application/json;q=0.5", True),
+    ("application/json, application/msgpack", False),
+    ("application/msgpack, application/json", True),
+    ("application/json;q=0.1, application/msgpack", True),
+    ("application/msgpack;q=0.0, application/json", False),
+    ("application/msgpack; q=0", False),
+    ("*/*, application/x-msgpack", False),
+    ("application/json;q=0, */*;q=0.5, application/vnd.msgpack;q=0.4", True),
+    ("text/html", False),
+    ("", False),
+])
+def test_accepts_msgpack_follows_q_values(accept, expected):
+    if encoding.msgpack is None:
+        pytest.skip("msgpack is not installed")
+    assert encoding.accepts_msgpack(accept) is expected
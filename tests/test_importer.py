@@ -0,0 +1,52 @@
+#type: ignore
+import asyncio
+import json
+
+import pytest
+
+from holochat.importer import DumpError, JsonReader, StoreLoader
+
+pytestmark = pytest.mark.api
+
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+def message(i):
+    return {"message": f"message {i}", "sender": "test", "target": "pc1", "msg_id": i, 
+            "recv_time": "2024-01-01T12:00:00"}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_json_reader_handles_any_chunking(chunk_size):
+    doc = {"messages": [message(i) for i in range(3)], "config": {"xy": [[1.5, 2.25]] * 4, "n": 12345}}
+    async def read():
+        reader = JsonReader(chunked(json.dumps(doc, indent=2).encode(), chunk_size))
+        out = {}
+        async for key in reader.keys():
+            if key == "messages":
+                out[key] = [m async for m in reader.elements()]
+            else:
+                out[key] = await reader.value()
+        return out
+    assert asyncio.run(read()) == doc
+    
+def test_loader_validates_in_batches(monkeypatch):
+    monkeypatch.setattr("holochat.importer.BATCH_SIZE", 2)
+    lines = [{"type": "store", "target": "pc1", "data": {"config": {"a": 1}, "last_msg_id": 5}}]
+    lines += [{"type": "message", "target": "pc1", "data": message(i)} for i in range(5)]
+    dump = "\n".join(json.dumps(line) for line in lines).encode()
+    loader = StoreLoader()
+    asyncio.run(loader.load_ndjson(chunked(dump, 10)))
+    stores = loader.finish()
+    assert loader.records == 6
+    assert [m.msg_id for m in stores["pc1"].messages] == [0, 1, 2, 3, 4]
+    assert stores["pc1"].config == {"a": 1}
+    
+def test_truncated_json_is_rejected():
+    async def read():
+        loader = StoreLoader()
+        await loader.load_store_json(JsonReader(chunked(b'{"messages": [{"message": "a"', 4)), "pc1")
+    with pytest.raises(DumpError):
+        asyncio.run(read())
@@ -0,0 +1,80 @@
+#type: ignore
+import pytest
+from fastapi.testclient import TestClient
+
+from holochat.main import app
+from holochat.metrics import Histogram, Metrics, store_nbytes
+from holochat.models import MessageRecord, MessageStore
+
+pytestmark = pytest.mark.api
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    client.delete("/db")
+    yield
+    client.delete("/db")
+
+def scrape() -> dict[str, float]:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+def test_histogram_buckets():
+    histogram = Histogram((1, 5, 10))
+    for value in (0, 1, 3, 7, 100):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    lines = list(histogram.render("x", pc="a"))
+    assert lines[0] == 'x_bucket{pc="a",le="1"} 2'
+    assert lines[3] == 'x_bucket{pc="a",le="+Inf"} 5'
+    assert lines[-2:] == ['x_sum{pc="a"} 111.0', 'x_count{pc="a"} 5']
+
+def test_route_stats_are_reused():
+    metrics = Metrics()
+    assert metrics.stats("/msg/{dest_pc}", "GET") is metrics.stats("/msg/{dest_pc}", "GET")
+    assert list(metrics.render())[-1].startswith("holochat_uptime_seconds ")
+
+def test_label_escaping():
+    histogram = Histogram((1,))
+    assert next(histogram.render("x", pc='a"b\\c')) == 'x_bucket{pc="a\\"b\\\\c",le="1"} 0'
+
+def test_store_nbytes_grows_with_messages():
+    store = MessageStore()
+    empty = store_nbytes(store)
+    store.messages.append(MessageRecord("x" * 1000, "sender", "pc1", msg_id=1))
+    assert store_nbytes(store) > empty + 1000
+
+def test_requests_by_route_template():
+    before = scrape()
+    key = 'holochat_requests_total{method="POST",route="/msg/{dest_pc}",status="200"}'
+    client.post("/msg/pc1", json={"message": "one"})
+    client.post("/msg/pc2", json={"message": "two"})
+    client.get("/msg/pc3")
+    samples = scrape()
+    assert samples[key] - before.get(key, 0) == 2
+    assert samples['holochat_requests_total{method="GET",route="/msg/{dest_pc}",status="404"}'] >= 1
+    assert samples['holochat_request_duration_seconds_count{method="POST",route="/msg/{dest_pc}"}'] >= 2
+    client.get("/no/such/path")
+    assert scrape()['holochat_requests_total{method="GET",route="<unmatched>",status="404"}'] >= 1
+
+def test_store_gauges():
+    for i in range(3):
+        client.post("/msg/pc1", json={"message": f"message {i}"})
+    client.get("/msg/pc1")
+    client.get("/msg/pc1")
+    client.post("/msg/pc2", json={"message": "unread"})
+    samples = scrape()
+    assert samples['holochat_messages{dest_pc="pc1"}'] == 3
+    assert samples['holochat_messages{dest_pc="pc2"}'] == 1
+    assert samples['holochat_current_message_reads_count'] == 2
+    assert samples['holochat_current_message_reads_bucket{le="0"}'] == 1
+    assert samples['holochat_store_bytes{dest_pc="pc1"}'] > 0
@@ -0,0 +1,82 @@
+#type: ignore
+from datetime import datetime, timedelta
+
+import pytest
+from pydantic import TypeAdapter
+
+from holochat.models import MessageHistory, MessageHold, MessageRecord, MessageRequest, MessageStore, settings
+
+pytestmark = pytest.mark.api
+
+RECV_TIME = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def make_record():
+    return MessageRecord("start trial", "ctrl", "pc1", msg_id=3, recv_time=RECV_TIME)
+
+def test_new_record_serializes_as_hold():
+    record = make_record()
+    out = record.to_dict()
+    assert out == record.held_dict()
+    assert MessageHold.model_validate(out).model_dump(mode="json") == out
+    assert "request_time" not in out
+    assert (out["message_status"], out["message_freshness"]) == ("new", "none")
+
+def test_mark_read_counts_after_the_first_read():
+    record = make_record()
+    record.mark_read()
+    # the first GET moves the message from held to requested without counting it
+    assert record.read_count == 0
+    first_read = record.request_time
+    assert first_read is not None
+    record.mark_read()
+    record.mark_read()
+    assert record.read_count == 2
+    assert record.request_time >= first_read
+
+def test_read_record_serializes_as_request():
+    record = make_record()
+    record.mark_read()
+    record.mark_read()
+    out = record.to_dict()
+    assert out == record.request_dict()
+    assert MessageRequest.model_validate(out).model_dump(mode="json") == out
+    assert out["read_count"] == 1
+    assert out["message_status"] == "read"
+    assert out["request_time"] == record.request_time.isoformat()
+    # request_dict can also describe the record as of another time, e.g. a websocket push
+    later = RECV_TIME + timedelta(seconds=5)
+    assert record.request_dict(later)["message_age_secs"] == 5
+
+def test_copy_is_independent():
+    record = make_record()
+    copy = record.copy()
+    record.mark_read()
+    assert copy.request_time is None
+    assert copy.to_dict() == make_record().to_dict()
+
+@pytest.mark.parametrize("reads", [0, 1, 3])
+def test_record_round_trips_through_pydantic(reads):
+    record = make_record()
+    for _ in range(reads):
+        record.mark_read()
+    adapter = TypeAdapter(MessageRecord)
+    restored = adapter.validate_python(adapter.dump_python(record, mode="json"))
+    assert isinstance(restored, MessageRecord)
+    assert restored.to_dict() == record.to_dict()
+    store = MessageStore(current=record)
+    assert MessageStore.model_validate(store.model_dump(mode="json")).current.to_dict() == record.to_dict()
+
+def test_validate_rejects_other_types():
+    with pytest.raises(ValueError):
+        MessageRecord.validate(42)
+
+def test_history_len_zero_keeps_no_history(monkeypatch):
+    monkeypatch.setattr(settings, "message_history_len", 0)
+    history = MessageHistory()
+    history.extend([make_record(), make_record()])
+    assert len(history) == 0
+    assert list(history) == []
+    store = MessageStore()
+    store.messages.append(make_record())
+    assert store.message_count == 0
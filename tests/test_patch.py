@@ -0,0 +1,64 @@
+#type: ignore
+import copy
+
+import pytest
+
+from holochat.patch import ConfigHistory, apply_merge_patch, compose_merge_patches
+
+pytestmark = pytest.mark.api
+
+
+# test cases from RFC 7386, appendix A
+RFC_CASES = [
+    ({"a": "b"}, {"a": "c"}, {"a": "c"}),
+    ({"a": "b"}, {"b": "c"}, {"a": "b", "b": "c"}),
+    ({"a": "b"}, {"a": None}, {}),
+    ({"a": "b", "b": "c"}, {"a": None}, {"b": "c"}),
+    ({"a": ["b"]}, {"a": "c"}, {"a": "c"}),
+    ({"a": "c"}, {"a": ["b"]}, {"a": ["b"]}),
+    ({"a": {"b": "c"}}, {"a": {"b": "d", "c": None}}, {"a": {"b": "d"}}),
+    ({"a": [{"b": "c"}]}, {"a": [1]}, {"a": [1]}),
+    ({"e": None}, {"a": 1}, {"e": None, "a": 1}),
+    ({}, {"a": {"bb": {"ccc": None}}}, {"a": {"bb": {}}}),
+]
+
+@pytest.mark.parametrize("target, patch, result", RFC_CASES)
+def test_apply_merge_patch(target, patch, result):
+    assert apply_merge_patch(target, patch) == result
+
+def test_patched_config_does_not_share_patch_objects():
+    patch = {"stim": {"power": 5}}
+    config = apply_merge_patch({}, patch)
+    config["stim"]["power"] = 10
+    assert patch == {"stim": {"power": 5}}
+
+def test_composed_patches_match_sequential_patches():
+    target = {"mouse_name": "m1", "stim": {"power": 5, "rate": 10}, "old": True}
+    patches = [{"stim": {"rate": None}, "old": None}, {"stim": {"power": 7}, "new": [1, 2]}, {"new": None}]
+    composed = {}
+    for patch in patches:
+        composed = compose_merge_patches(composed, patch)
+    expected = copy.deepcopy(target)
+    for patch in patches:
+        apply_merge_patch(expected, patch)
+    assert apply_merge_patch(copy.deepcopy(target), composed) == expected
+
+def test_compose_refuses_object_over_replaced_value():
+    assert compose_merge_patches({"stim": None}, {"stim": {"power": 5}}) is None
+
+def test_history_diffs():
+    history = ConfigHistory(maxlen=3)
+    history.record("pc1", 0, 1, None)
+    history.record("pc1", 1, 2, {"a": 1})
+    history.record("pc1", 2, 3, {"b": 2})
+    assert history.diff("pc1", 3, 3) == {}
+    assert history.diff("pc1", 1, 3) == {"a": 1, "b": 2}
+    # can't diff across a full replacement
+    assert history.diff("pc1", 0, 3) is None
+    history.record("pc1", 3, 4, {"c": 3})
+    history.record("pc1", 4, 5, {"d": 4})
+    # the change from version 1 fell out of the history
+    assert history.diff("pc1", 1, 5) is None
+    assert history.diff("pc1", 2, 5) == {"b": 2, "c": 3, "d": 4}
+    # a change made elsewhere breaks the chain
+    assert history.diff("pc1", 2, 6) is None
@@ -0,0 +1,116 @@
+#type: ignore
+import asyncio
+from collections import defaultdict
+
+import pytest
+
+from holochat.changes import ChangeFeed
+from holochat.models import MessageRecord, MessageStore
+from holochat.persistence import LOG_FNAME, SNAPSHOT_FNAME, WriteAheadLog, apply_change
+
+pytestmark = pytest.mark.persistence
+
+
+def post(db, feed, dest_pc, message):
+    store = db[dest_pc]
+    store.last_msg_id += 1
+    msg = MessageRecord(message, "test", dest_pc, msg_id=store.last_msg_id)
+    store.current = msg
+    store.messages.append(msg.copy())
+    feed.publish("message_posted", dest_pc, msg.held_dict())
+    
+def run_session(data_dir, mutate, crash=False, **wal_kwargs):
+    """Recover a database from data_dir, apply some changes, then shut down (or crash)."""
+    async def session():
+        db = defaultdict(MessageStore)
+        feed = ChangeFeed()
+        wal = WriteAheadLog(db, data_dir, **wal_kwargs)
+        feed.seq = wal.recover()
+        wal.start()
+        feed.listeners.append(wal.append)
+        mutate(db, feed)
+        await asyncio.sleep(0.05)
+        if crash:
+            # whatever was group-committed is on disk, but there is no final snapshot
+            wal._writer.cancel()
+            wal._file.close()
+        else:
+            await wal.close()
+        return db, feed
+    return asyncio.run(session())
+
+
+def test_changes_survive_restart(tmp_path):
+    def mutate(db, feed):
+        post(db, feed, "pc1", "first")
+        post(db, feed, "pc1", "second")
+        db["pc2"].config = {"test": "config"}
+        db["pc2"].config_version = 7
+        feed.publish("config_changed", "pc2", {"config": {"test": "config"}, "config_version": 7})
+    run_session(tmp_path, mutate)
+    db, feed = run_session(tmp_path, lambda db, feed: None)
+    assert db["pc1"].current.message == "second"
+    assert [m.message for m in db["pc1"].messages] == ["first", "second"]
+    assert db["pc1"].last_msg_id == 2
+    assert db["pc2"].config == {"test": "config"}
+    assert db["pc2"].config_version == 7
+    assert feed.seq == 3
+    
+def test_replay_log_after_crash(tmp_path):
+    def mutate(db, feed):
+        post(db, feed, "pc1", "logged")
+        db["pc1"].current.mark_read()
+        feed.publish("message_read", "pc1", {"msg_id": 1, "read_count": 0, "request_time": "2024-01-01T12:00:00"})
+    run_session(tmp_path, mutate, crash=True)
+    assert not (tmp_path / SNAPSHOT_FNAME).exists()
+    db, feed = run_session(tmp_path, lambda db, feed: None, crash=True)
+    assert db["pc1"].current.message == "logged"
+    assert db["pc1"].current.to_dict()["message_status"] == "new"
+    # simulate a torn write at the tail of the log
+    with open(tmp_path / LOG_FNAME, "a") as f:
+        f.write('{"seq": 3, "eve')
+    db, feed = run_session(tmp_path, lambda db, feed: post(db, feed, "pc1", "after crash"), crash=True)
+    assert db["pc1"].current.message == "after crash"
+    assert feed.seq == 3
+    db, feed = run_session(tmp_path, lambda db, feed: None)
+    assert [m.message for m in db["pc1"].messages] == ["logged", "after crash"]
+    assert db["pc1"].last_msg_id == 2
+    
+def test_log_is_compacted(tmp_path):
+    def mutate(db, feed):
+        for i in range(10):
+            post(db, feed, "pc1", f"message {i}")
+    run_session(tmp_path, mutate, compact_every=5, commit_interval_ms=1)
+    assert (tmp_path / SNAPSHOT_FNAME).exists()
+    assert (tmp_path / LOG_FNAME).read_text() == ""
+    
+def test_apply_read_and_delete():
+    db = defaultdict(MessageStore)
+    msg = MessageRecord("read me", "test", "pc1", msg_id=1)
+    apply_change(db, {"event": "message_posted", "target": "pc1", "data": msg.held_dict()})
+    read = {"msg_id": 1, "read_count": 2, "request_time": "2024-01-01T12:00:00"}
+    apply_change(db, {"event": "message_read", "target": "pc1", "data": read})
+    assert db["pc1"].current.read_count == 2
+    apply_change(db, {"event": "messages_deleted", "target": "pc1", "data": None})
+    assert db["pc1"].current is None
+    apply_change(db, {"event": "store_deleted", "target": "pc1", "data": None})
+    assert "pc1" not in db
+    
+def test_config_patches_survive_restart(tmp_path):
+    def mutate(db, feed):
+        db["pc1"].config = {"mouse_name": "m1", "stim": {"power": 5}}
+        feed.publish("config_changed", "pc1", {"config": db["pc1"].config, "config_version": 41})
+        feed.publish("config_patched", "pc1", {"patch": {"stim": {"power": None, "rate": 2}}, "config_version": 42})
+    run_session(tmp_path, mutate, crash=True)
+    db, _ = run_session(tmp_path, lambda db, feed: None)
+    assert db["pc1"].config == {"mouse_name": "m1", "stim": {"rate": 2}}
+    assert db["pc1"].config_version == 42
+    
+def test_config_version_restored_from_either_event():
+    db = defaultdict(MessageStore)
+    apply_change(db, {"event": "config_patched", "target": "pc1", "data": {"patch": {"a": 1}, "config_version": 50}})
+    apply_change(db, {"event": "config_changed", "target": "pc1", "data": {"config": {"b": 2}, "config_version": 60}})
+    assert (db["pc1"].config, db["pc1"].config_version) == ({"b": 2}, 60)
+    # a log from before config_version was recorded still replays
+    apply_change(db, {"event": "config_changed", "target": "pc1", "data": {"c": 3}})
+    assert db["pc1"].config == {"c": 3}
@@ -0,0 +1,30 @@
+#type: ignore
+import pytest
+
+from holochat.pubsub import PubSub
+
+pytestmark = pytest.mark.api
+
+
+def test_publish_reaches_only_target_subscribers():
+    pubsub = PubSub(queue_size=10)
+    sub1 = pubsub.subscribe("pc1")
+    sub2 = pubsub.subscribe("pc2")
+    pubsub.publish("pc1", "hello")
+    assert sub1.queue.get_nowait() == "hello"
+    assert sub2.queue.empty()
+    
+def test_slow_subscriber_drops_oldest():
+    pubsub = PubSub(queue_size=2)
+    slow = pubsub.subscribe("pc1")
+    for i in range(5):
+        pubsub.publish("pc1", str(i))
+    assert slow.dropped == 3
+    assert [slow.queue.get_nowait() for _ in range(2)] == ["3", "4"]
+    
+def test_unsubscribe_removes_empty_pc():
+    pubsub = PubSub()
+    sub = pubsub.subscribe("pc1")
+    assert pubsub.has_subscribers("pc1")
+    pubsub.unsubscribe("pc1", sub)
+    assert not pubsub.has_subscribers("pc1")
@@ -0,0 +1,185 @@
+#type: ignore
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from holochat.client import Client
+from holochat.main import app, queues
+from holochat.models import MessageRecord
+from holochat.queues import MessageQueue, QueueRegistry
+
+pytestmark = pytest.mark.api
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    client.delete("/db")
+    yield
+    client.delete("/db")
+    queues.configured.clear()
+
+def fill(queue, n, start=0):
+    for i in range(start, start + n):
+        queue.append(MessageRecord(f"m{i}", "tester", "pc1", msg_id=i + 1))
+
+def messages(entries):
+    return [entry["message"] for entry in entries]
+
+def test_consumers_read_in_order_at_their_own_offset():
+    queue = MessageQueue()
+    fill(queue, 5)
+    assert messages(queue.pop("a", 0, 2)) == ["m0", "m1"]
+    assert messages(queue.pop("a", 0, 10)) == ["m2", "m3", "m4"]
+    assert queue.pop("a", 0) == []
+    # a second consumer sees everything still queued, from the start
+    assert messages(queue.pop("b", 0, 10)) == ["m0", "m1", "m2", "m3", "m4"]
+    assert [e["seq"] for e in queue.pop("c", 0, 3)] == [0, 1, 2]
+
+def test_redelivery_after_ack_timeout():
+    queue = MessageQueue(ack_timeout=10)
+    fill(queue, 3)
+    assert [e["seq"] for e in queue.pop("a", 0, 2)] == [0, 1]
+    assert queue.ack("a", [0]) == 1
+    assert queue.has_ready("a", 0)
+    assert messages(queue.pop("a", 5)) == ["m2"]
+    assert not queue.has_ready("a", 5)
+    assert queue.next_due("a") == 10
+    # seq 1 was never acked, so it comes again once due, before anything new
+    fill(queue, 1, start=3)
+    out = queue.pop("a", 11, 2)
+    assert [(e["seq"], e["deliveries"]) for e in out] == [(1, 2), (3, 1)]
+    assert queue.ack("a", [1, 2, 3, 99]) == 3
+    assert queue.pop("a", 100) == []
+    assert len(queue) == 0
+
+def test_acked_messages_are_trimmed_once_every_consumer_is_done():
+    queue = MessageQueue()
+    fill(queue, 4)
+    queue.pop("a", 0, 4)
+    queue.pop("b", 0, 2)
+    queue.ack("a", [0, 1, 2, 3])
+    assert len(queue) == 4
+    queue.ack("b", [0, 1])
+    assert (len(queue), queue.head_seq) == (2, 2)
+    queue.remove_consumer("b")
+    assert len(queue) == 0
+    assert queue.info()["consumers"] == {"a": {"offset": 4, "lag": 0, "unacked": 0, "dropped": 0}}
+
+def test_max_len_drops_the_oldest():
+    queue = MessageQueue(max_len=3)
+    queue.pop("a", 0)
+    fill(queue, 5)
+    out = queue.pop("a", 100, 10)
+    assert messages(out) == ["m2", "m3", "m4"]
+    assert queue.info()["consumers"]["a"]["dropped"] == 2
+
+def test_deep_backlog():
+    queue = MessageQueue(max_len=10**6)
+    fill(queue, 200_000)
+    start = time.perf_counter()
+    seq = 0
+    while True:
+        out = queue.pop("a", 0, 100)
+        if not out:
+            break
+        assert out[0]["seq"] == seq
+        seq += len(out)
+        queue.ack("a", [e["seq"] for e in out])
+    assert seq == 200_000
+    assert len(queue) == 0
+    # the list is compacted as the head moves, so consumed messages don't pile up
+    assert len(queue._items) < 2048
+    assert time.perf_counter() - start < 5
+
+def test_clear_and_registry():
+    registry = QueueRegistry(["pc1"], ack_timeout=5)
+    assert registry.get("pc2") is None
+    queue = registry.get("pc1")
+    assert queue.ack_timeout == 5
+    fill(queue, 3)
+    queue.pop("a", 0, 2)
+    registry.clear_messages("pc1")
+    assert len(queue) == 0 and queue.pop("a", 100) == []
+    fill(queue, 1, start=3)
+    assert messages(queue.pop("a", 0)) == ["m3"]
+    assert registry.disable("pc1")
+    assert registry.get("pc1") is None
+
+def test_queue_api():
+    assert client.get("/queue/pc1").status_code == 404
+    client.post("/msg/pc1", json={"message": "before", "sender": "ctrl"})
+    assert client.post("/queue/pc1", params={"ack_timeout": 60}).json()["ack_timeout"] == 60
+    for i in range(3):
+        client.post("/msg/pc1", json={"message": f"m{i}", "sender": "ctrl"})
+    # the latest-message API is unchanged
+    assert client.get("/msg/pc1").json()["message"] == "m2"
+
+    out = client.post("/queue/pc1/pop", params={"consumer": "rig", "max": 2}).json()
+    assert out["consumer"] == "rig"
+    assert messages(out["messages"]) == ["m0", "m1"]
+    assert out["messages"][0]["sender"] == "ctrl"
+    acked = client.post("/queue/pc1/ack", json={"consumer": "rig", "seqs": [0, 1]}).json()
+    assert acked["acked"] == 2
+    info = client.get("/queue/pc1").json()
+    assert (info["length"], info["consumers"]["rig"]["lag"]) == (1, 1)
+
+    # a long poll returns at once with a message waiting, and empty once it times out
+    assert messages(client.post("/queue/pc1/pop", params={"consumer": "rig", "wait": 1}).json()["messages"]) == ["m2"]
+    start = time.monotonic()
+    assert client.post("/queue/pc1/pop", params={"consumer": "rig", "wait": 0.2}).json()["messages"] == []
+    assert time.monotonic() - start >= 0.2
+
+    assert client.delete("/queue/pc1/consumers/rig").status_code == 200
+    assert client.delete("/queue/pc1/consumers/rig").status_code == 404
+    client.delete("/msg/pc1")
+    assert client.get("/queue/pc1").json()["length"] == 0
+    assert client.delete("/queue/pc1").status_code == 200
+    assert client.post("/queue/pc1/pop", params={"consumer": "rig"}).status_code == 404
+
+def test_configured_pcs_and_client():
+    queues.configured.add("pc2")
+    with Client("http://testserver", transport=client._transport) as api:
+        api.post_message("pc2", "a")
+        api.post_message("pc2", "b")
+        out = api.queue_pop("pc2", "rig", max_count=5)
+        assert messages(out) == ["a", "b"]
+        assert api.queue_ack("pc2", "rig", [e["seq"] for e in out]) == 2
+        assert api.queue_pop("pc2", "rig", wait=0.05) == []
+    # deleting the PC empties its queue and forgets its consumers
+    client.delete("/db/pc2")
+    assert queues.get("pc2").info()["consumers"] == {}
+
+def test_runtime_queue_mode_survives_store_delete():
+    client.post("/queue/pc3", params={"ack_timeout": 7})
+    client.post("/msg/pc3", json={"message": "a", "sender": "ctrl"})
+    client.post("/queue/pc3/pop", params={"consumer": "rig"})
+    client.delete("/db/pc3")
+    info = client.get("/queue/pc3").json()
+    assert (info["length"], info["ack_timeout"], info["consumers"]) == (0, 7, {})
+    client.post("/msg/pc3", json={"message": "b", "sender": "ctrl"})
+    assert messages(client.post("/queue/pc3/pop", params={"consumer": "rig"}).json()["messages"]) == ["b"]
+
+def test_ack_timeout_fixed_while_in_flight():
+    registry = QueueRegistry(["pc1"], ack_timeout=5)
+    queue = registry.get("pc1")
+    fill(queue, 2)
+    queue.pop("a", 0)
+    with pytest.raises(ValueError):
+        registry.enable("pc1", ack_timeout=1)
+    # the same timeout again is fine
+    assert registry.enable("pc1", ack_timeout=5) is queue
+    queue.ack("a", [0])
+    assert registry.enable("pc1", ack_timeout=1).ack_timeout == 1
+    # the new timeout keeps deadlines in order
+    queue.pop("a", 10, 2)
+    assert queue.next_due("a") == 11
+
+def test_ack_timeout_change_conflicts_over_http():
+    client.post("/queue/pc1", params={"ack_timeout": 60})
+    client.post("/msg/pc1", json={"message": "a", "sender": "ctrl"})
+    client.post("/queue/pc1/pop", params={"consumer": "rig"})
+    assert client.post("/queue/pc1", params={"ack_timeout": 5}).status_code == 409
+    client.post("/queue/pc1/ack", json={"consumer": "rig", "seqs": [0]})
+    assert client.post("/queue/pc1", params={"ack_timeout": 5}).json()["ack_timeout"] == 5
@@ -4,7 +4,8 @@ from pathlib import Path
 
 import pytest
 
-from holochat.settings import (MainSettings, generate_schema,
+from holochat import models
+from holochat.settings import (MainSettings, generate_schema, get_settings,
                                generate_settings, load_settings, save_settings,
                                USER_JSON_PATH, REPO_JSON_PATH)
 
@@ -23,6 +24,10 @@ def test_load_settings_type():
     settings = load_settings()
     assert isinstance(settings, MainSettings)
     
+def test_settings_loaded_once():
+    assert get_settings() is get_settings()
+    assert models.settings is get_settings()
+    
 def test_generate_new_schema(schema_path: Path):
     generate_schema(schema_path, overwrite=False)
     assert Path(schema_path).exists()
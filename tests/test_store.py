@@ -0,0 +1,173 @@
+#type: ignore
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from holochat import main
+from holochat.models import MessageRecord
+from holochat.store import MemoryBackend, SqliteBackend
+from holochat.trigger import TriggerCommands, TriggerServer
+
+pytestmark = pytest.mark.store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteBackend(str(tmp_path / "holochat.db"))
+    return MemoryBackend()
+
+def post(backend, dest_pc, message):
+    with backend.edit(dest_pc, "current", "messages", "last_msg_id") as store:
+        store.last_msg_id += 1
+        store.current = MessageRecord(message, "test", dest_pc, msg_id=store.last_msg_id)
+        store.messages.append(store.current.copy())
+
+
+def test_edit_creates_store(backend):
+    assert "pc1" not in backend
+    post(backend, "pc1", "hello")
+    assert "pc1" in backend
+    assert backend.get("pc1").current.message == "hello"
+    assert [pc for pc, _ in backend.items()] == ["pc1"]
+    
+def test_delete_and_clear(backend):
+    post(backend, "pc1", "hello")
+    post(backend, "pc2", "hello")
+    backend.delete("pc1")
+    assert backend.get("pc1") is None
+    assert list(backend.keys()) == ["pc2"]
+    backend.clear()
+    assert len(backend) == 0
+    
+def test_failed_edit_is_rolled_back(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "holochat.db"))
+    post(backend, "pc1", "hello")
+    with pytest.raises(RuntimeError):
+        with backend.edit(dest_pc="pc1") as store:
+            store.config = {"half": "done"}
+            raise RuntimeError
+    assert backend.get("pc1").config == {}
+    
+def test_sqlite_workers_share_state(tmp_path):
+    # two backends on the same file behave like two uvicorn workers
+    worker1 = SqliteBackend(str(tmp_path / "holochat.db"))
+    worker2 = SqliteBackend(str(tmp_path / "holochat.db"))
+    post(worker1, "pc1", "first")
+    assert worker2.get("pc1").current.message == "first"
+    post(worker2, "pc1", "second")
+    assert worker1.get("pc1").current.message == "second"
+    assert worker1.get("pc1").last_msg_id == 2
+    with worker1.edit("pc1", "config") as store:
+        store.config = {"test": "config"}
+    # only config was written back, the messages worker2 posted are intact
+    assert [m.message for m in worker2.get("pc1").messages] == ["first", "second"]
+    assert worker2.get("pc1").config == {"test": "config"}
+    
+def test_sqlite_reloads_only_changed_fields(tmp_path):
+    worker1 = SqliteBackend(str(tmp_path / "holochat.db"))
+    worker2 = SqliteBackend(str(tmp_path / "holochat.db"))
+    for i in range(3):
+        post(worker1, "pc1", f"message {i}")
+    with worker1.edit("pc1", "config") as store:
+        store.config = {"test": "config"}
+    cached = worker2.get("pc1")
+    # a read in one worker rewrites current only
+    with worker1.edit("pc1", "current") as store:
+        store.current.mark_read()
+    store = worker2.get("pc1")
+    assert store.current.request_time is not None
+    assert store.messages is cached.messages
+    assert store.config is cached.config
+    assert worker2.get("pc1") is store
+    
+def test_sqlite_opens_database_without_field_versions(tmp_path):
+    path = str(tmp_path / "holochat.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE stores (pc TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE store_fields (pc TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, "
+                 "PRIMARY KEY (pc, field)) WITHOUT ROWID")
+    conn.execute("INSERT INTO stores VALUES ('pc1', 3)")
+    conn.execute("""INSERT INTO store_fields VALUES ('pc1', 'config', '{"old": "config"}')""")
+    conn.commit()
+    conn.close()
+    backend = SqliteBackend(path)
+    assert backend.get("pc1").config == {"old": "config"}
+    post(backend, "pc1", "hello")
+    assert SqliteBackend(path).get("pc1").current.message == "hello"
+    
+def test_api_on_sqlite_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "message_db", SqliteBackend(str(tmp_path / "holochat.db")))
+    client = TestClient(main.app)
+    client.post("/msg/pc1", json={"message": "Stored in sqlite"})
+    client.post("/config/pc1", json={"test": "config"})
+    client.get("/msg/pc1")
+    response = client.get("/msg/pc1")
+    assert response.json()["message"] == "Stored in sqlite"
+    assert response.json()["read_count"] == 1
+    assert client.get("/config/pc1").json() == {"test": "config"}
+    assert client.get("/db").json()["pc1"]["message_count"] == 1
+    assert client.get("/msg/pc1", params={"wait": 0.1, "after": 1}).status_code == 204
+    client.delete("/db/pc1")
+    assert client.get("/db/pc1").status_code == 404
+
+class LoopWatchingBackend(SqliteBackend):
+    """Records the store calls made on the event loop, where a locked database would stall it."""
+    def __init__(self, path):
+        super().__init__(path)
+        self.on_loop = []
+
+    def _check(self, name):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.on_loop.append(name)
+
+    def get(self, dest_pc):
+        self._check("get")
+        return super().get(dest_pc)
+
+    def edit(self, dest_pc, *fields):
+        self._check("edit")
+        return super().edit(dest_pc, *fields)
+
+    def delete(self, dest_pc):
+        self._check("delete")
+        return super().delete(dest_pc)
+
+def test_triggers_and_sweeper_keep_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    backend = LoopWatchingBackend(str(tmp_path / "holochat.db"))
+    monkeypatch.setattr(main, "message_db", backend)
+    monkeypatch.setattr(main.sweeper, "db", backend)
+    monkeypatch.setattr(main.sweeper, "default_policy", main.settings.sweeper.default.model_copy(update={"idle_secs": 60}))
+    async def run():
+        server = TriggerServer(TriggerCommands(main.post_message, main.read_current),
+                               host="127.0.0.1", tcp_port=0, udp_port=0, offload=True)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.tcp_port)
+            writer.write(b"SENDER daq\nPOST pc1 go\nGET pc1\n")
+            replies = [await reader.readline() for _ in range(3)]
+            writer.close()
+            await writer.wait_closed()
+            replies_udp = asyncio.Queue()
+            class Protocol(asyncio.DatagramProtocol):
+                def datagram_received(self, data, addr):
+                    replies_udp.put_nowait(data)
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                Protocol, remote_addr=("127.0.0.1", server.udp_port))
+            transport.sendto(b"POST pc1 udp")
+            replies.append(await asyncio.wait_for(replies_udp.get(), 2))
+            transport.close()
+            await main.sweeper.handle("message", "pc1", 2)
+            version = (await asyncio.to_thread(backend.get, "pc1")).version
+            await main.sweeper.handle("idle", "pc1", (0, version))
+        finally:
+            await server.close()
+        return replies
+    assert asyncio.run(run()) == [b"OK\n", b"OK 1\n", b"MSG 1 0 go\n", b"OK 2\n"]
+    assert backend.on_loop == []
+    assert "pc1" not in backend
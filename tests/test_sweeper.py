@@ -0,0 +1,163 @@
+#type: ignore
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from holochat.models import MessageRecord
+from holochat.settings import _RetentionPolicy
+from holochat.store import MemoryBackend
+from holochat.sweeper import Sweeper
+
+pytestmark = pytest.mark.sweeper
+
+
+def make_sweeper(db, **kwargs):
+    evicted = []
+    def expire_message(dest_pc, msg_id):
+        db[dest_pc].current = None
+        evicted.append(("message", dest_pc, msg_id))
+    def trim_history(dest_pc, cutoff):
+        db[dest_pc].messages.trim_before(cutoff)
+        evicted.append(("history", dest_pc))
+    def drop_store(dest_pc):
+        del db[dest_pc]
+        evicted.append(("store", dest_pc))
+    sweeper = Sweeper(db, expire_secs=10, expire_message=expire_message, trim_history=trim_history,
+                      drop_store=drop_store, **kwargs)
+    return sweeper, evicted
+
+def post(db, dest_pc, message, age_secs=0):
+    store = db[dest_pc]
+    store.last_msg_id += 1
+    msg = MessageRecord(message, "test", dest_pc, msg_id=store.last_msg_id,
+                        recv_time=datetime.now() - timedelta(seconds=age_secs))
+    store.current = msg
+    store.messages.append(msg.copy())
+    store.touch()
+    return msg
+
+
+def test_expired_message_is_evicted():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db)
+    msg = post(db, "pc1", "old", age_secs=11)
+    sweeper.observe("message_posted", "pc1", msg.held_dict())
+    post(db, "pc2", "new")
+    sweeper.observe("message_posted", "pc2", db["pc2"].current.held_dict())
+    asyncio.run(sweeper.sweep())
+    assert evicted == [("message", "pc1", 1)]
+    assert db["pc1"].current is None
+    assert db["pc2"].current is not None
+    # the pc2 deadline is still waiting
+    assert len(sweeper.heap) == 1
+
+def test_replaced_message_is_not_evicted():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db)
+    sweeper.observe("message_posted", "pc1", post(db, "pc1", "old", age_secs=11).held_dict())
+    post(db, "pc1", "new")
+    asyncio.run(sweeper.sweep())
+    assert evicted == []
+
+def test_per_pc_history_and_idle_policies():
+    db = MemoryBackend()
+    policies = {"pc1": _RetentionPolicy(evict_expired=False, history_secs=5, idle_secs=0)}
+    sweeper, evicted = make_sweeper(db, policies=policies)
+    post(db, "pc1", "old", age_secs=8)
+    post(db, "pc1", "new")
+    post(db, "pc2", "other", age_secs=8)
+    sweeper.schedule_all(db.items())
+    asyncio.run(sweeper.sweep())
+    assert ("history", "pc1") in evicted
+    assert ("store", "pc1") in evicted
+    assert "pc2" in db
+    
+def test_recovered_history_is_trimmed_message_by_message():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db, default_policy=_RetentionPolicy(evict_expired=False, history_secs=5))
+    for age_secs in (5.1, 4.95, 4.9):
+        post(db, "pc1", "old", age_secs=age_secs)
+    # e.g. recovered after its current message expired: only the history has deadlines
+    db["pc1"].current = None
+    sweeper.schedule_all(db.items())
+    asyncio.run(sweeper.sweep())
+    assert len(db["pc1"].messages) == 2
+    # the next oldest message got a deadline of its own
+    assert [entry[2] for entry in sweeper.heap] == ["history"]
+    time.sleep(0.15)
+    asyncio.run(sweeper.sweep())
+    assert len(db["pc1"].messages) == 0
+    assert sweeper.heap == []
+
+def test_idle_store_is_kept_while_changing():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db, default_policy=_RetentionPolicy(idle_secs=0.05))
+    post(db, "pc1", "first")
+    sweeper.schedule_all(db.items())
+    time.sleep(0.06)
+    post(db, "pc1", "second")
+    sweeper.observe("config_changed", "pc1", {})
+    asyncio.run(sweeper.sweep())
+    assert evicted == []
+    # rescheduled, and dropped once nothing changed for idle_secs
+    time.sleep(0.06)
+    asyncio.run(sweeper.sweep())
+    assert evicted == [("store", "pc1")]
+
+def test_store_that_is_only_read_is_not_idle():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db, default_policy=_RetentionPolicy(idle_secs=0.05))
+    post(db, "pc1", "first")
+    sweeper.schedule_all(db.items())
+    # a rig polling its config and messages, which doesn't change the store
+    for i in range(4):
+        time.sleep(0.03)
+        if i % 2:
+            sweeper.touch("pc1")
+        else:
+            sweeper.observe("message_read", "pc1", {"msg_id": 1})
+        asyncio.run(sweeper.sweep())
+    assert evicted == []
+    time.sleep(0.06)
+    asyncio.run(sweeper.sweep())
+    assert evicted == [("store", "pc1")]
+    # reads of stores the sweeper doesn't know about aren't tracked
+    sweeper.touch("pc9")
+    assert "pc9" not in sweeper.last_change
+
+def test_sweep_runs_in_slices():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db, slice_ms=0.1)
+    for i in range(2000):
+        sweeper.observe("message_posted", f"pc{i}", post(db, f"pc{i}", "old", age_secs=11).held_dict())
+    
+    async def main():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+        task = asyncio.create_task(ticker())
+        await sweeper.sweep()
+        task.cancel()
+        return ticks
+    
+    assert asyncio.run(main()) > 1
+    assert len(evicted) == 2000
+
+def test_run_wakes_up_for_new_deadlines():
+    db = MemoryBackend()
+    sweeper, evicted = make_sweeper(db)
+    
+    async def main():
+        sweeper.start()
+        await asyncio.sleep(0.01)
+        sweeper.observe("message_posted", "pc1", post(db, "pc1", "old", age_secs=11).held_dict())
+        await asyncio.sleep(0.01)
+        await sweeper.close()
+    
+    asyncio.run(main())
+    assert evicted == [("message", "pc1", 1)]
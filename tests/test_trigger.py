@@ -0,0 +1,107 @@
+#type: ignore
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from holochat.client import TriggerClient
+from holochat.main import app, post_message, read_current
+from holochat.trigger import TriggerCommands, TriggerServer
+
+pytestmark = pytest.mark.api
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    client.delete("/db")
+    yield
+    client.delete("/db")
+
+def run_with_server(test):
+    """Run test(server) with TCP and UDP listeners on free ports."""
+    async def run():
+        server = TriggerServer(TriggerCommands(post_message, read_current), host="127.0.0.1", tcp_port=0, udp_port=0)
+        await server.start()
+        try:
+            await test(server)
+        finally:
+            await server.close()
+    asyncio.run(run())
+
+def test_commands():
+    commands = TriggerCommands(post_message, read_current)
+    assert commands.handle(b"PING") == (b"PONG\n", "trigger")
+    assert commands.handle(b"GET pc1") == (b"NONE\n", "trigger")
+    assert commands.handle(b"POST pc1 start trial 3") == (b"OK 1\n", "trigger")
+    assert commands.handle(b"SENDER daq") == (b"OK\n", "daq")
+    assert commands.handle(b"post pc1 stop", "daq") == (b"OK 2\n", "daq")
+    assert commands.handle(b"GET pc1")[0] == b"MSG 2 0 stop\n"
+    assert commands.handle(b"GET pc1")[0] == b"MSG 2 1 stop\n"
+    assert commands.handle(b"POST")[0].startswith(b"ERR usage")
+    assert commands.handle(b"JUMP")[0] == b"ERR unknown command 'JUMP'\n"
+    assert commands.handle(b"\xff")[0] == b"ERR invalid UTF-8\n"
+
+def test_tcp_messages_reach_the_api():
+    async def test(server):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.tcp_port)
+        # several commands in one segment, answered in order
+        writer.write(b"SENDER daq\nPOST pc1 go\nGET pc1\n")
+        await writer.drain()
+        replies = [await reader.readline() for _ in range(3)]
+        writer.close()
+        await writer.wait_closed()
+        assert replies == [b"OK\n", b"OK 1\n", b"MSG 1 0 go\n"]
+    run_with_server(test)
+    msg = client.get("/msg/pc1").json()
+    assert (msg["message"], msg["sender"], msg["read_count"]) == ("go", "daq", 1)
+
+def test_tcp_split_lines_and_long_lines():
+    async def test(server):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.tcp_port)
+        writer.write(b"PO")
+        await writer.drain()
+        writer.write(b"ST pc1 split\r\n")
+        assert await reader.readline() == b"OK 1\n"
+        writer.write(b"x" * (70 * 2**10))
+        assert await reader.readline() == b"ERR line too long\n"
+        assert await reader.read() == b""
+        writer.close()
+    run_with_server(test)
+    assert client.get("/msg/pc1").json()["message"] == "split"
+
+def test_udp():
+    async def test(server):
+        loop = asyncio.get_running_loop()
+        replies = asyncio.Queue()
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                replies.put_nowait(data)
+
+        transport, _ = await loop.create_datagram_endpoint(Protocol, remote_addr=("127.0.0.1", server.udp_port))
+        transport.sendto(b"POST pc2 udp trigger\n")
+        assert await asyncio.wait_for(replies.get(), 2) == b"OK 1\n"
+        transport.sendto(b"GET pc2")
+        assert await asyncio.wait_for(replies.get(), 2) == b"MSG 1 0 udp trigger\n"
+        # a datagram has no connection to keep a sender on
+        transport.sendto(b"SENDER stim\n")
+        assert await asyncio.wait_for(replies.get(), 2) == b"ERR SENDER needs a TCP connection\n"
+        transport.close()
+    run_with_server(test)
+    assert client.get("/db/pc2").json()["message_count"] == 1
+
+def test_trigger_client():
+    async def test(server):
+        def use_client():
+            with TriggerClient("127.0.0.1", server.tcp_port, sender="stim") as trigger:
+                trigger.ping()
+                assert trigger.get_message("pc1") is None
+                assert trigger.post_message("pc1", "") == 1
+                assert trigger.post_message("pc1", "fire") == 2
+                assert trigger.get_message("pc1") == (2, 0, "fire")
+                with pytest.raises(ValueError):
+                    trigger.post_message("pc1", "two\nlines")
+        await asyncio.to_thread(use_client)
+    run_with_server(test)
+    assert client.get("/msg/pc1").json()["sender"] == "stim"